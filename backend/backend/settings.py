@@ -89,6 +89,9 @@ if env("USE_SQLITE_FOR_TESTS") or "PYTEST_CURRENT_TEST" in os.environ:
         "default": {
             "ENGINE": "django.db.backends.sqlite3",
             "NAME": BASE_DIR / "db.sqlite3",
+            # Tests default to in-memory SQLite; point this at a file to run
+            # the threaded checkout stress test.
+            "TEST": {"NAME": env("SQLITE_TEST_DB", default=None)},
         }
     }
     CACHES = {
@@ -183,13 +186,67 @@ REST_FRAMEWORK = {
     ),
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 10,
+    "DEFAULT_THROTTLE_RATES": {
+        "coupon_validate": env("COUPON_VALIDATE_THROTTLE_RATE", default="60/min"),
+    },
 }
 
+# Serve opted-in list endpoints (products, orders) through
+# store.compiled_serializers instead of DRF field serialization.
+COMPILED_SERIALIZERS = env.bool("COMPILED_SERIALIZERS", default=True)
+
+# Payment webhooks get a local signature check, are stored raw in the
+# WebhookInbox table and acknowledged at once; the process_webhook_inbox task
+# verifies them with the provider and applies them.
+PAYMENT_WEBHOOK_ASYNC = env.bool("PAYMENT_WEBHOOK_ASYNC", default=False)
+
+# Store prices are in CURRENCY_BASE; conversion rates (e.g. NPR for eSewa)
+# come from CURRENCY_RATE_SOURCE. The default source reads CURRENCY_RATES_FILE
+# ({"base": "USD", "rates": {"NPR": "133.5"}}) when set, else CURRENCY_RATES.
+CURRENCY_BASE = env("CURRENCY_BASE", default="USD")
+CURRENCY_RATES = {"NPR": env("ESEWA_CONVERSION_RATE", default="133.5")}
+CURRENCY_RATES_FILE = env("CURRENCY_RATES_FILE", default=None)
+CURRENCY_RATE_SOURCE = env("CURRENCY_RATE_SOURCE", default="store.services.currency.DefaultRateSource")
+
 
 # Celery
 CELERY_BROKER_URL = CELERY_BROKER_URL if 'CELERY_BROKER_URL' in locals() else env("CELERY_BROKER_URL", default=env("REDIS_URL", default="redis://localhost:6379/0"))
 CELERY_RESULT_BACKEND = CELERY_RESULT_BACKEND if 'CELERY_RESULT_BACKEND' in locals() else env("CELERY_RESULT_BACKEND", default="redis://localhost:6379/1")
 CELERY_TIMEZONE = TIME_ZONE
+CELERY_BEAT_SCHEDULE = {
+    "rebuild-copurchase-matrix": {
+        "task": "store.tasks.rebuild_copurchase_matrix",
+        "schedule": 60 * 60 * 24,
+    },
+    "build-similarity-index": {
+        "task": "store.tasks.build_similarity_index",
+        "schedule": 60 * 60 * 24,
+    },
+    "release-expired-reservations": {
+        "task": "store.tasks.release_expired_reservations",
+        "schedule": 60,
+    },
+    "poll-pending-payments": {
+        "task": "store.tasks.poll_pending_payments",
+        "schedule": 30,
+    },
+    "process-webhook-inbox": {
+        "task": "store.tasks.process_webhook_inbox",
+        "schedule": 5,
+    },
+    "sweep-carts": {
+        "task": "store.tasks.sweep_carts",
+        "schedule": 60 * 15,
+    },
+    "process-refund-jobs": {
+        "task": "store.tasks.process_refund_jobs",
+        "schedule": 60,
+    },
+}
+
+# Item-item similarity index written by build_similarity_index and
+# memory-mapped by API workers.
+RECOMMENDATION_INDEX_DIR = env("RECOMMENDATION_INDEX_DIR", default=str(BASE_DIR / "var" / "recommendations"))
 
 
 # Redis cache (optional)
@@ -200,6 +257,12 @@ if "PYTEST_CURRENT_TEST" not in os.environ and not env("USE_SQLITE_FOR_TESTS"):
             "LOCATION": env("REDIS_URL", default="redis://localhost:6379/0"),
         }
     }
+    # Carts are Redis hashes updated per line (store.services.cart.RedisCartStore);
+    # without this setting they fall back to the cache above.
+    CART_REDIS_URL = env("CART_REDIS_URL", default=env("REDIS_URL", default="redis://localhost:6379/0"))
+    # Circuit breaker state shared by all workers (store.services.circuit);
+    # without it breakers live in the cache above.
+    CIRCUIT_REDIS_URL = env("CIRCUIT_REDIS_URL", default=env("REDIS_URL", default="redis://localhost:6379/0"))
 
 
 # Email
@@ -3,8 +3,6 @@ from __future__ import annotations
 import logging
 from typing import Any, Dict, Iterable, Tuple
 
-import requests
-
 from .base import BaseSupplierAdapter, register_adapter
 
 log = logging.getLogger(__name__)
@@ -33,7 +31,9 @@ class AliExpressAdapter(BaseSupplierAdapter):
     def fetch_products(self, page: int = 1) -> Tuple[Iterable[Dict[str, Any]], bool]:
         # Example using API; replace URL with real endpoint or call scraper
         try:
-            resp = requests.get(
+            resp = self._http(
+                "fetch_products",
+                "GET",
                 f"{self.API_BASE}/products",
                 params={"page": page, "page_size": 50},
                 headers=self._headers(),
@@ -61,7 +61,9 @@ class AliExpressAdapter(BaseSupplierAdapter):
 
     def fetch_product_details(self, supplier_product_id: str) -> Dict[str, Any]:
         try:
-            resp = requests.get(
+            resp = self._http(
+                "fetch_product_details",
+                "GET",
                 f"{self.API_BASE}/products/{supplier_product_id}", headers=self._headers(), timeout=15
             )
             resp.raise_for_status()
@@ -82,7 +84,9 @@ class AliExpressAdapter(BaseSupplierAdapter):
 
     def place_order(self, supplier_order_payload: Dict[str, Any]) -> Dict[str, Any]:
         try:
-            resp = requests.post(
+            resp = self._http(
+                "place_order",
+                "POST",
                 f"{self.API_BASE}/orders",
                 json=supplier_order_payload,
                 headers=self._headers(),
@@ -97,7 +101,9 @@ class AliExpressAdapter(BaseSupplierAdapter):
 
     def get_order_status(self, supplier_order_id: str) -> Dict[str, Any]:
         try:
-            resp = requests.get(
+            resp = self._http(
+                "get_order_status",
+                "GET",
                 f"{self.API_BASE}/orders/{supplier_order_id}", headers=self._headers(), timeout=15
             )
             resp.raise_for_status()
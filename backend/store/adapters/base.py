@@ -3,18 +3,37 @@ from __future__ import annotations
 import abc
 from typing import Any, Dict, Iterable, Tuple
 
+import requests
+
 from store.models import Supplier
+from store.services.circuit import get_breaker
 
 
 class BaseSupplierAdapter(abc.ABC):
     """Abstract base class for supplier adapters.
 
     Implement concrete adapters that translate supplier APIs into a uniform interface.
+    Remote calls go through ``_http`` so each operation has a circuit breaker
+    named ``supplier:<circuit_key>:<operation>``.
     """
 
+    circuit_key: str = ""
+
     def __init__(self, supplier: Supplier):
         self.supplier = supplier
 
+    def _http(self, operation: str, method: str, url: str, **kwargs) -> requests.Response:
+        """Send one supplier request; raises ``CircuitOpen`` while the operation's breaker is open.
+
+        Connection errors, timeouts and 5xx responses count as failures.
+        """
+        key = self.circuit_key or type(self).__name__.lower().replace("adapter", "")
+        with get_breaker(f"supplier:{key}:{operation}").guard() as call:
+            resp = requests.request(method, url, **kwargs)
+            if resp.status_code >= 500:
+                call.failed()
+            return resp
+
     # Product listing: returns iterable of supplier product dicts + pagination flag
     @abc.abstractmethod
     def fetch_products(self, page: int = 1) -> Tuple[Iterable[Dict[str, Any]], bool]:
@@ -3,8 +3,6 @@ from __future__ import annotations
 import logging
 from typing import Any, Dict, Iterable, Tuple
 
-import requests
-
 from .base import BaseSupplierAdapter, register_adapter
 
 log = logging.getLogger(__name__)
@@ -28,7 +26,7 @@ class CJAdapter(BaseSupplierAdapter):
 
     def fetch_products(self, page: int = 1) -> Tuple[Iterable[Dict[str, Any]], bool]:
         try:
-            resp = requests.get(f"{self._base()}/products", params={"page": page, "per_page": 50}, headers=self._headers(), timeout=15)
+            resp = self._http("fetch_products", "GET", f"{self._base()}/products", params={"page": page, "per_page": 50}, headers=self._headers(), timeout=15)
             resp.raise_for_status()
             data = resp.json()
         except Exception as exc:
@@ -49,7 +47,7 @@ class CJAdapter(BaseSupplierAdapter):
 
     def fetch_product_details(self, supplier_product_id: str) -> Dict[str, Any]:
         try:
-            resp = requests.get(f"{self._base()}/products/{supplier_product_id}", headers=self._headers(), timeout=15)
+            resp = self._http("fetch_product_details", "GET", f"{self._base()}/products/{supplier_product_id}", headers=self._headers(), timeout=15)
             resp.raise_for_status()
             p = resp.json()
         except Exception as exc:
@@ -68,7 +66,7 @@ class CJAdapter(BaseSupplierAdapter):
 
     def place_order(self, supplier_order_payload: Dict[str, Any]) -> Dict[str, Any]:
         try:
-            resp = requests.post(f"{self._base()}/orders", json=supplier_order_payload, headers=self._headers(), timeout=20)
+            resp = self._http("place_order", "POST", f"{self._base()}/orders", json=supplier_order_payload, headers=self._headers(), timeout=20)
             resp.raise_for_status()
             data = resp.json()
         except Exception as exc:
@@ -78,7 +76,7 @@ class CJAdapter(BaseSupplierAdapter):
 
     def get_order_status(self, supplier_order_id: str) -> Dict[str, Any]:
         try:
-            resp = requests.get(f"{self._base()}/orders/{supplier_order_id}", headers=self._headers(), timeout=15)
+            resp = self._http("get_order_status", "GET", f"{self._base()}/orders/{supplier_order_id}", headers=self._headers(), timeout=15)
             resp.raise_for_status()
             data = resp.json()
         except Exception:
@@ -5,8 +5,6 @@ import io
 import logging
 from typing import Any, Dict, Iterable, Tuple, List
 
-import requests
-
 from .base import BaseSupplierAdapter, register_adapter
 
 log = logging.getLogger(__name__)
@@ -31,6 +29,8 @@ class GenericCSVAdapter(BaseSupplierAdapter):
     }
     """
 
+    circuit_key = "generic"
+
     DEFAULT_MAP = {
         "id": "id",
         "title": "title",
@@ -55,7 +55,7 @@ class GenericCSVAdapter(BaseSupplierAdapter):
         content = creds.get("csv_content")
         if not content and creds.get("csv_url"):
             try:
-                r = requests.get(creds["csv_url"], timeout=20)
+                r = self._http("fetch_csv", "GET", creds["csv_url"], timeout=20)
                 r.raise_for_status()
                 content = r.text
             except Exception as exc:
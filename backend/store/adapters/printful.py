@@ -72,7 +72,9 @@ class PrintfulAdapter(BaseSupplierAdapter):
         if not (refresh and client_id and client_secret):
             return None
         try:
-            resp = requests.post(
+            resp = self._http(
+                "refresh_token",
+                "POST",
                 self._token_url(),
                 data={
                     "grant_type": "refresh_token",
@@ -92,19 +94,24 @@ class PrintfulAdapter(BaseSupplierAdapter):
         try:
             headers = kwargs.pop("headers", {}) or {}
             headers.update(self._headers())
-            r2 = requests.request(method, url, headers=headers, timeout=kwargs.pop("timeout", 15), **kwargs)
+            r2 = self._http(self._operation(url), method, url, headers=headers, timeout=kwargs.pop("timeout", 15), **kwargs)
             r2.raise_for_status()
             return r2
         except Exception as exc:
             log.error("Printful request retry failed: %s", exc)
             return None
 
+    def _operation(self, url: str) -> str:
+        """Breaker operation for an API URL: its first path segment (``products``, ``orders``...)."""
+        path = url[len(self._base()):] if url.startswith(self._base()) else url
+        return path.strip("/").split("/", 1)[0].split("?", 1)[0] or "api"
+
     def _request(self, method: str, path: str, **kwargs) -> Optional[requests.Response]:
         url = f"{self._base()}{path}"
         headers = kwargs.pop("headers", {}) or {}
         headers.update(self._headers())
         try:
-            resp = requests.request(method, url, headers=headers, timeout=kwargs.pop("timeout", 15), **kwargs)
+            resp = self._http(self._operation(url), method, url, headers=headers, timeout=kwargs.pop("timeout", 15), **kwargs)
             if resp.status_code == 401:
                 # attempt refresh
                 retried = self._refresh_and_retry(method, url, headers=headers, **kwargs)
@@ -215,7 +222,7 @@ class PrintfulAdapter(BaseSupplierAdapter):
         # requests with files should not send JSON content-type
         headers.pop("Content-Type", None)
         try:
-            resp = requests.post(url, headers=headers, files={"file": (filename, file_bytes)}, data={"purpose": purpose}, timeout=30)
+            resp = self._http("upload_file", "POST", url, headers=headers, files={"file": (filename, file_bytes)}, data={"purpose": purpose}, timeout=30)
             if resp.status_code == 401:
                 retried = self._refresh_and_retry("POST", url, files={"file": (filename, file_bytes)}, data={"purpose": purpose})
                 if retried is None:
@@ -3,8 +3,6 @@ from __future__ import annotations
 import logging
 from typing import Any, Dict, Iterable, Tuple
 
-import requests
-
 from .base import BaseSupplierAdapter, register_adapter
 
 log = logging.getLogger(__name__)
@@ -39,7 +37,9 @@ class SpocketAdapter(BaseSupplierAdapter):
 
     def fetch_products(self, page: int = 1) -> Tuple[Iterable[Dict[str, Any]], bool]:
         try:
-            resp = requests.get(
+            resp = self._http(
+                "fetch_products",
+                "GET",
                 f"{self._base()}/products",
                 params={"page": page, "per_page": 50},
                 headers=self._headers(),
@@ -68,7 +68,9 @@ class SpocketAdapter(BaseSupplierAdapter):
 
     def fetch_product_details(self, supplier_product_id: str) -> Dict[str, Any]:
         try:
-            resp = requests.get(
+            resp = self._http(
+                "fetch_product_details",
+                "GET",
                 f"{self._base()}/products/{supplier_product_id}",
                 headers=self._headers(),
                 timeout=15,
@@ -91,7 +93,9 @@ class SpocketAdapter(BaseSupplierAdapter):
 
     def place_order(self, supplier_order_payload: Dict[str, Any]) -> Dict[str, Any]:
         try:
-            resp = requests.post(
+            resp = self._http(
+                "place_order",
+                "POST",
                 f"{self._base()}/orders",
                 json=supplier_order_payload,
                 headers=self._headers(),
@@ -106,7 +110,9 @@ class SpocketAdapter(BaseSupplierAdapter):
 
     def get_order_status(self, supplier_order_id: str) -> Dict[str, Any]:
         try:
-            resp = requests.get(
+            resp = self._http(
+                "get_order_status",
+                "GET",
                 f"{self._base()}/orders/{supplier_order_id}",
                 headers=self._headers(),
                 timeout=15,
@@ -131,6 +131,38 @@ class PaymentAdmin(admin.ModelAdmin):
     search_fields = ("provider_payment_id",)
 
 
+@admin.register(models.PaymentEvent)
+class PaymentEventAdmin(admin.ModelAdmin):
+    list_display = ("id", "order", "provider", "provider_event_id", "status", "source", "created_at")
+    list_filter = ("provider", "status", "source")
+    search_fields = ("provider_event_id",)
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(models.WebhookInbox)
+class WebhookInboxAdmin(admin.ModelAdmin):
+    list_display = ("id", "order", "provider", "succeeded", "received_at", "processed_at", "attempts")
+    list_filter = ("provider", "succeeded")
+    search_fields = ("order__id",)
+
+
+class RefundJobItemInline(admin.TabularInline):
+    model = models.RefundJobItem
+    extra = 0
+    fields = ("order", "payment", "provider", "amount", "status", "error", "processed_at")
+    readonly_fields = fields
+    can_delete = False
+
+
+@admin.register(models.RefundJob)
+class RefundJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "status", "created_by", "reason", "created_at", "finished_at")
+    list_filter = ("status",)
+    inlines = [RefundJobItemInline]
+
+
 @admin.register(models.Coupon)
 class CouponAdmin(admin.ModelAdmin):
     list_display = (
@@ -139,12 +171,14 @@ class CouponAdmin(admin.ModelAdmin):
         "discount_type",
         "value",
         "usage_limit",
+        "redemption_count",
         "per_user_limit",
         "is_active",
         "expires_at",
         "is_referral",
         "influencer_name",
     )
+    readonly_fields = ("redemption_count",)
     list_filter = ("discount_type", "is_active", "is_referral")
     search_fields = ("code", "influencer_name", "influencer_handle")
 
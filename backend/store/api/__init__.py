@@ -22,6 +22,7 @@ from .admin import (  # noqa: F401
     AdminContentPageViewSet,
     AdminUserViewSet,
     AdminActionLogViewSet,
+    AdminRefundJobViewSet,
 )
 
 # Re-export legacy views until they are refactored
@@ -35,9 +36,11 @@ from ..views import (  # noqa: F401
     CartSaveForLaterView,
     CartClearView,
     CheckoutView,
+    CheckoutIntentRetryView,
     OrderTrackingView,
     PaymentsWebhookView,
     PaymentsVerifyView,
+    PaymentsReturnView,
     PaymentRefundView,
     HealthView,
     RegisterView,
@@ -6,7 +6,8 @@ from decimal import Decimal
 from django.db.models import F, Q, Sum
 from django.db.models.functions import TruncDay
 from django.utils import timezone
-from rest_framework import generics, status, viewsets
+from django.db import transaction
+from rest_framework import generics, mixins, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
@@ -25,6 +26,7 @@ from store.models import (
     ContentPage,
     User,
     AdminActionLog,
+    RefundJob,
 )
 from store.permissions import IsAdmin, IsStaff
 from store.serializers import (
@@ -38,8 +40,13 @@ from store.serializers import (
     ContentPageSerializer,
     AdminUserSerializer,
     AdminActionLogSerializer,
+    RefundJobCreateSerializer,
+    RefundJobDetailSerializer,
+    RefundJobSerializer,
 )
-from store.tasks import sync_supplier_products
+from store.services.audit import record_admin_action
+from store.services.refunds import claim_payment_refund, create_refund_job, queued_for_refund, release_payment_refund
+from store.tasks import process_refund_jobs, sync_supplier_products
 from store.payments.base import get_gateway
 from .mixins import AuditedModelViewSet
 
@@ -193,12 +200,19 @@ class AdminOrderViewSet(AuditedModelViewSet):
         if not payment:
             self.log_admin_action(action='refund', instance=order, status='failure', metadata={'reason': 'no_successful_payment'})
             return Response({'detail': 'No successful payment to refund.'}, status=status.HTTP_400_BAD_REQUEST)
+        if queued_for_refund(payment) or not claim_payment_refund(payment.pk):
+            self.log_admin_action(action='refund', instance=order, status='failure', metadata={'reason': 'refund_in_progress'})
+            return Response({'detail': 'Payment is already being refunded.'}, status=status.HTTP_409_CONFLICT)
         gateway = get_gateway(payment.provider)
         try:
             gateway.handle_refund(order, amount)
         except NotImplementedError:
+            release_payment_refund(payment.pk)
             self.log_admin_action(action='refund', instance=order, status='failure', metadata={'reason': 'gateway_not_supported'})
             return Response({'detail': 'Refund not supported for this provider.'}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception:
+            release_payment_refund(payment.pk)
+            raise
         payment.status = PaymentModel.Status.REFUNDED
         payment.save(update_fields=['status'])
         order.status = Order.Status.REFUNDED
@@ -286,3 +300,49 @@ class AdminActionLogViewSet(viewsets.ReadOnlyModelViewSet):
         if status_filter:
             qs = qs.filter(status=status_filter)
         return qs
+
+
+class AdminRefundJobViewSet(
+    mixins.CreateModelMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet
+):
+    """Bulk refunds: POST ``{order_ids, reason}`` queues a job; GET the job to poll its progress."""
+
+    queryset = RefundJob.objects.select_related('created_by').order_by('-created_at')
+    permission_classes = [IsAuthenticated, IsStaff]
+
+    def get_serializer_class(self):
+        if self.action == 'create':
+            return RefundJobCreateSerializer
+        if self.action == 'retrieve':
+            return RefundJobDetailSerializer
+        return RefundJobSerializer
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if self.action == 'retrieve':
+            qs = qs.prefetch_related('items')
+        return qs
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        order_ids = serializer.validated_data['order_ids']
+        job = create_refund_job(order_ids, actor=request.user, reason=serializer.validated_data['reason'])
+        record_admin_action(
+            actor=request.user,
+            request=request,
+            resource='refund_job',
+            action='create',
+            object_pk=str(job.pk),
+            metadata={'orders': len(order_ids), 'reason': job.reason},
+        )
+
+        def enqueue():
+            try:
+                process_refund_jobs.delay(job.pk)
+            except Exception:
+                # The process-refund-jobs beat entry picks the job up.
+                pass
+
+        transaction.on_commit(enqueue)
+        return Response(RefundJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
@@ -7,9 +7,13 @@ from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
-from store.models import Coupon, CouponRedemption, User
+from store.models import Coupon, User
 from store.permissions import IsStaff, user_has_role
 from store.serializers import CouponSerializer
+from store.services.cart import CartService
+from store.services.coupons import get_cached_coupon, limit_reached
+from store.services.pricing import coupon_discount, get_priced_cart
+from store.throttles import CouponValidateThrottle
 
 
 class CouponViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
@@ -33,30 +37,36 @@ class CouponViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.G
             qs = qs.filter(is_active=True)
         return qs
 
-    @action(detail=False, methods=["post"], url_path="validate", permission_classes=[AllowAny])
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="validate",
+        permission_classes=[AllowAny],
+        throttle_classes=[CouponValidateThrottle],
+    )
     def validate(self, request):
         code = (request.data.get("code") or "").strip()
-        order_total = Decimal(str(request.data.get("order_total") or "0"))
-        coupon = Coupon.objects.filter(code__iexact=code, is_active=True).first()
-        if not coupon:
+        raw_total = request.data.get("order_total")
+        if raw_total in (None, ""):
+            # Without an explicit total, validate against the caller's cart.
+            cart = CartService.get(request)
+            order_total = get_priced_cart(cart).subtotal if cart else Decimal("0")
+        else:
+            order_total = Decimal(str(raw_total))
+        coupon = get_cached_coupon(code)
+        if not coupon or not coupon.is_active:
             return Response({"valid": False, "detail": "Coupon not found"}, status=status.HTTP_404_NOT_FOUND)
         if coupon.expires_at and timezone.now() > coupon.expires_at:
             return Response({"valid": False, "detail": "Coupon expired"}, status=status.HTTP_400_BAD_REQUEST)
         if coupon.min_order_total and order_total < coupon.min_order_total:
             return Response({"valid": False, "detail": "Order total too low"}, status=status.HTTP_400_BAD_REQUEST)
-        if coupon.usage_limit:
-            used = coupon.redemptions.count()
-            if used >= coupon.usage_limit:
-                return Response({"valid": False, "detail": "Coupon usage limit reached"}, status=status.HTTP_400_BAD_REQUEST)
-        if coupon.per_user_limit and request.user.is_authenticated:
-            per_user_used = coupon.redemptions.filter(user=request.user).count()
-            if per_user_used >= coupon.per_user_limit:
-                return Response({"valid": False, "detail": "Coupon already used"}, status=status.HTTP_400_BAD_REQUEST)
+        exhausted = limit_reached(coupon, request.user)
+        if exhausted == "usage":
+            return Response({"valid": False, "detail": "Coupon usage limit reached"}, status=status.HTTP_400_BAD_REQUEST)
+        if exhausted == "per_user":
+            return Response({"valid": False, "detail": "Coupon already used"}, status=status.HTTP_400_BAD_REQUEST)
 
-        discount_amount = coupon.value
-        if coupon.discount_type == Coupon.DiscountType.PERCENT:
-            discount_amount = (order_total * coupon.value / Decimal("100"))
-        discount_amount = discount_amount.quantize(Decimal("0.01"))
+        discount_amount = coupon_discount(coupon, order_total)
         return Response({
             "valid": True,
             "coupon": CouponSerializer(coupon).data,
@@ -2,8 +2,11 @@ from __future__ import annotations
 
 from typing import Any
 
+from django.conf import settings
+from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 
+from store.compiled_serializers import CompiledSerializer, compile_serializer
 from store.models import AdminActionLog
 from store.services.audit import record_admin_action
 
@@ -53,3 +56,31 @@ class AuditedModelViewSet(ModelViewSet):
         object_pk = str(getattr(instance, "pk", ""))
         super().perform_destroy(instance)
         self.log_admin_action(action="delete", metadata={"object_pk": object_pk})
+
+
+class CompiledListMixin:
+    """Render ``list`` through a compiled serializer instead of DRF fields.
+
+    The filtered queryset is paginated as ``values()`` rows and rendered by
+    ``store.compiled_serializers``; output is identical to the regular path.
+    Falls back to DRF when the serializer is not compilable or when
+    ``settings.COMPILED_SERIALIZERS`` is off.
+    """
+
+    def get_compiled_serializer_kwargs(self) -> dict[str, Any]:
+        return {}
+
+    def get_compiled_serializer(self) -> CompiledSerializer | None:
+        if not getattr(settings, "COMPILED_SERIALIZERS", True):
+            return None
+        return compile_serializer(self.get_serializer_class(), **self.get_compiled_serializer_kwargs())
+
+    def list(self, request, *args, **kwargs):
+        compiled = self.get_compiled_serializer()
+        if compiled is None:
+            return super().list(request, *args, **kwargs)
+        rows = compiled.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(compiled.render(page, request=request))
+        return Response(compiled.render(list(rows), request=request))
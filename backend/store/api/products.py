@@ -10,7 +10,7 @@ import io
 from decimal import Decimal
 
 from django.utils.text import slugify
-from django.db.models import Count, Q
+from django.db.models import Q
 from rest_framework import mixins, viewsets
 from rest_framework.decorators import action
 from rest_framework.exceptions import PermissionDenied
@@ -18,19 +18,26 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .mixins import AuditedModelViewSet
+from .mixins import AuditedModelViewSet, CompiledListMixin
+from ..constants import RECOMMENDATION_TOP_K
 from ..filters import ProductFilter
 from ..models import Category, Supplier, User
 from ..permissions import IsStaffOrVendor
 from ..repositories.product import Product, ProductRepository
-from ..serializers import ProductSerializer, ProductWriteSerializer
+from ..serializers import ProductListSerializer, ProductSerializer, ProductWriteSerializer
+from ..services.currency import localize_rows, requested_currency
+from ..services.facets import compute_facets
+from ..services.similarity import get_similarity_index
 from ..tasks import sync_supplier_products
 
 
-class ProductViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+class ProductViewSet(CompiledListMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
     """Public product listing and retrieval.
 
     Supports filtering, search and ordering via DRF and django-filter.
+    ``?fields=``/``?expand=`` switch to the slim ``ProductListSerializer`` and
+    a queryset that only loads the selected columns and relations.
+    ``?currency=`` adds ``localized_price`` to every listed product.
     """
 
     lookup_field = "slug"
@@ -40,22 +47,67 @@ class ProductViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.
     search_fields = ["title", "sku"]
     ordering_fields = ["base_price", "created_at", "avg_rating", "title"]
 
+    def _sparse_fields(self) -> set[str] | None:
+        """Fields selected via ``?fields=``/``?expand=``, or None for the full representation."""
+        params = self.request.query_params
+        if self.action not in ("list", "retrieve") or ("fields" not in params and "expand" not in params):
+            return None
+        return ProductListSerializer.selected_fields(params)
+
     def get_queryset(self):
+        fields = self._sparse_fields()
+        if fields is not None:
+            return ProductRepository.get_listing_queryset(fields).order_by("-created_at")
         return ProductRepository.get_active_products_queryset().order_by("-created_at")
 
+    def get_serializer_class(self):
+        if self._sparse_fields() is not None:
+            return ProductListSerializer
+        return ProductSerializer
+
+    def get_compiled_serializer_kwargs(self):
+        fields = self._sparse_fields()
+        return {"fields": frozenset(fields)} if fields is not None else {}
+
+    def list(self, request, *args, **kwargs):
+        currency = requested_currency(request)
+        response = super().list(request, *args, **kwargs)
+        if currency:
+            data = response.data
+            localize_rows(data["results"] if isinstance(data, dict) else data, currency)
+        return response
+
+    @action(detail=False, methods=["get"], permission_classes=[AllowAny], url_path="facets")
+    def facets(self, request):
+        """Facet counts for the current filter/search parameters."""
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(compute_facets(queryset))
+
     @action(detail=True, methods=["get"], permission_classes=[AllowAny], url_path="recommendations")
     def recommendations(self, request, slug=None):
+        """Related products from precomputed indexes, never per-request co-occurrence SQL.
+
+        Reads the memory-mapped item-item similarity index first, then the
+        co-purchase table, and finally falls back to top-rated products from
+        the same category when the product has no interaction history yet.
+        """
         product = self.get_object()
         base_qs = ProductRepository.get_active_products_queryset()
-        related = (
-            base_qs.filter(order_items__order__items__product=product)
-            .exclude(id=product.id)
-            .annotate(freq=Count("order_items__id"))
-            .order_by("-freq", "-avg_rating")
-        )
-        if not related.exists():
-            related = base_qs.filter(category=product.category).exclude(id=product.id).order_by("-avg_rating", "-created_at")
-        serializer = self.get_serializer(related[:8], many=True)
+        index = get_similarity_index()
+        related_ids = index.similar(product.id, limit=RECOMMENDATION_TOP_K) if index else []
+        if not related_ids:
+            related_ids = ProductRepository.copurchased_product_ids(product.id, limit=RECOMMENDATION_TOP_K)
+        related: list[Product] = []
+        if related_ids:
+            by_id = base_qs.in_bulk(related_ids)
+            related = [by_id[pid] for pid in related_ids if pid in by_id]
+        if not related:
+            related = list(
+                base_qs.filter(category_id=product.category_id)
+                .exclude(id=product.id)
+                .order_by("-avg_rating", "-created_at")[:RECOMMENDATION_TOP_K]
+            )
+        serializer = self.get_serializer(related, many=True)
         return Response(serializer.data)
 
 
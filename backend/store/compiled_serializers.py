@@ -0,0 +1,255 @@
+"""Compiled read path for DRF model serializers.
+
+``compile_serializer`` walks a serializer's fields once and turns them into a
+flat ``values()`` lookup list plus per-field row getters, so hot list
+endpoints can render plain dict rows without instantiating models or running
+DRF's per-field machinery. Output matches ``Serializer(...).data``:
+
+- model fields reuse the bound DRF field's ``to_representation``;
+- forward foreign keys and reverse one-to-ones become joined lookups;
+- reverse foreign keys (``many=True``) are fetched in one batched query per
+  relation and grouped by parent id;
+- ``SerializerMethodField``s need a row-level equivalent declared on the
+  serializer as ``compiled_resolvers = {"name": (("lookup", ...), func)}``;
+- fields backed by queryset annotations are emitted only when the queryset
+  carries the annotation, mirroring DRF skipping missing read-only attributes.
+
+Anything else raises ``SerializerNotCompilable`` and callers fall back to DRF.
+"""
+from __future__ import annotations
+
+from collections import defaultdict
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.db.models import QuerySet
+from rest_framework import serializers
+from rest_framework.relations import PKOnlyObject, PrimaryKeyRelatedField
+from rest_framework.settings import api_settings
+
+_SKIP = object()
+
+
+class SerializerNotCompilable(Exception):
+    """The serializer uses a feature the compiled path cannot reproduce."""
+
+
+class _Many:
+    """A reverse foreign key rendered with a nested ``many=True`` serializer."""
+
+    def __init__(self, plan: "CompiledSerializer", parent_pk: str, fk_name: str, fk_attname: str):
+        self.plan = plan
+        self.parent_pk = parent_pk
+        self.fk_name = fk_name
+        self.fk_attname = fk_attname
+
+    def fetch(self, rows: List[dict], request) -> Dict[Any, List[dict]]:
+        parent_ids = {row[self.parent_pk] for row in rows if row[self.parent_pk] is not None}
+        if not parent_ids:
+            return {}
+        model = self.plan.model
+        queryset = model._default_manager.filter(**{f"{self.fk_name}__in": parent_ids})
+        queryset = queryset.order_by(*(model._meta.ordering or ["pk"]))
+        child_rows = list(self.plan.values(queryset, extra=(self.fk_attname,)))
+        rendered = self.plan.render(child_rows, request=request)
+        grouped: Dict[Any, List[dict]] = defaultdict(list)
+        for row, data in zip(child_rows, rendered):
+            grouped[row[self.fk_attname]].append(data)
+        return grouped
+
+
+class _Node:
+    """Fields of one serializer level, addressed relative to an ORM prefix."""
+
+    def __init__(self, serializer: serializers.Serializer, model, prefix: str, top_level: bool):
+        self.model = model
+        self.prefix = prefix
+        self.top_level = top_level
+        self.paths: List[str] = []
+        self.annotations: List[str] = []
+        self.many: List[_Many] = []
+        # (field name, getter(row, ctx) -> value or _SKIP)
+        self.getters: List[Tuple[str, Callable]] = []
+        resolvers = getattr(type(serializer), "compiled_resolvers", {})
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            self.getters.append((name, self._compile_field(name, field, resolvers)))
+
+    def _lookup(self, relative: str) -> str:
+        path = self.prefix + relative
+        if path not in self.paths:
+            self.paths.append(path)
+        return path
+
+    def _compile_field(self, name: str, field, resolvers) -> Callable:
+        if isinstance(field, serializers.SerializerMethodField):
+            if name not in resolvers:
+                raise SerializerNotCompilable(f"{name}: SerializerMethodField without a compiled resolver")
+            lookups, func = resolvers[name]
+            return self._compile_resolver(lookups, func)
+        if field.source == "*":
+            raise SerializerNotCompilable(f"{name}: source='*' is not supported")
+
+        *through, attr = field.source.split(".")
+        model = self.model
+        relative = ""
+        for part in through:
+            related = self._get_field(model, part)
+            if related is None or not (related.one_to_one or related.many_to_one):
+                raise SerializerNotCompilable(f"{name}: cannot traverse {part!r}")
+            relative += f"{part}__"
+            model = related.related_model
+        model_field = self._get_field(model, attr)
+
+        if model_field is None:
+            if hasattr(model, attr):
+                raise SerializerNotCompilable(f"{name}: {attr!r} is a model attribute, not a column")
+            if through or not self.top_level:
+                # DRF skips read-only attributes the instance does not carry.
+                return lambda row, ctx: _SKIP
+            return self._compile_annotation(attr, field)
+
+        if isinstance(field, serializers.ListSerializer):
+            if through or not model_field.one_to_many:
+                raise SerializerNotCompilable(f"{name}: only reverse foreign keys can be nested with many=True")
+            plan = CompiledSerializer(field.child, model_field.related_model)
+            many = _Many(plan, self._lookup(relative + model._meta.pk.name), model_field.field.name, model_field.field.attname)
+            self.many.append(many)
+            return lambda row, ctx: ctx["many"][many].get(row[many.parent_pk], [])
+
+        if isinstance(field, serializers.BaseSerializer):
+            if not (model_field.one_to_one or model_field.many_to_one):
+                raise SerializerNotCompilable(f"{name}: nested serializer over {attr!r}")
+            node = _Node(field, model_field.related_model, self.prefix + relative + attr + "__", top_level=False)
+            self.paths.extend(p for p in node.paths if p not in self.paths)
+            self.many.extend(node.many)
+            pk_path = self._lookup(relative + attr + "__" + model_field.related_model._meta.pk.name)
+
+            def nested(row, ctx, node=node, pk_path=pk_path):
+                if row[pk_path] is None:
+                    return None
+                return node.to_dict(row, ctx)
+
+            return nested
+
+        if model_field.is_relation:
+            if not isinstance(field, PrimaryKeyRelatedField) or not (model_field.many_to_one or model_field.one_to_one):
+                raise SerializerNotCompilable(f"{name}: unsupported relation field {type(field).__name__}")
+            if not model_field.concrete:
+                raise SerializerNotCompilable(f"{name}: reverse one-to-one primary key")
+            path = self._lookup(relative + attr)
+            to_representation = field.to_representation
+            return lambda row, ctx: None if row[path] is None else to_representation(PKOnlyObject(pk=row[path]))
+
+        path = self._lookup(relative + attr)
+        to_representation = field.to_representation
+        if isinstance(field, serializers.FileField):
+            return self._compile_file(path, field, model_field)
+        return lambda row, ctx: None if row[path] is None else to_representation(row[path])
+
+    def _compile_annotation(self, attr: str, field) -> Callable:
+        self.annotations.append(attr)
+        to_representation = field.to_representation
+
+        def annotated(row, ctx):
+            if attr not in row:
+                return _SKIP
+            value = row[attr]
+            return None if value is None else to_representation(value)
+
+        return annotated
+
+    def _compile_file(self, path: str, field, model_field) -> Callable:
+        # Same steps as FileField.to_representation, with the request taken
+        # from the render call instead of the (shared) serializer context.
+        use_url = getattr(field, "use_url", api_settings.UPLOADED_FILES_USE_URL)
+        attr_class = model_field.attr_class
+
+        def file_value(row, ctx):
+            value = row[path]
+            if not value:
+                return None
+            if not use_url:
+                return value
+            url = attr_class(None, model_field, value).url
+            request = ctx["request"]
+            return request.build_absolute_uri(url) if request is not None else url
+
+        return file_value
+
+    def _compile_resolver(self, lookups: Iterable[str], func: Callable) -> Callable:
+        paths: List[Optional[str]] = []
+        for lookup in lookups:
+            if self._get_field(self.model, lookup.split("__")[0]) is not None:
+                paths.append(self._lookup(lookup))
+            elif self.top_level:
+                if lookup not in self.annotations:
+                    self.annotations.append(lookup)
+                paths.append(lookup)
+            else:
+                # Annotations only exist on the top-level queryset.
+                paths.append(None)
+        return lambda row, ctx: func(*(row.get(path) if path else None for path in paths))
+
+    @staticmethod
+    def _get_field(model, name: str) -> Optional[models.Field]:
+        try:
+            return model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+
+    def to_dict(self, row: dict, ctx: dict) -> dict:
+        data = {}
+        for name, getter in self.getters:
+            value = getter(row, ctx)
+            if value is not _SKIP:
+                data[name] = value
+        return data
+
+
+class CompiledSerializer:
+    """Row renderer equivalent to ``serializer_class(..., many=True).data``."""
+
+    def __init__(self, serializer: serializers.Serializer, model=None):
+        self.model = model or serializer.Meta.model
+        self.root = _Node(serializer, self.model, prefix="", top_level=True)
+
+    def values(self, queryset: QuerySet, extra: Iterable[str] = ()) -> QuerySet:
+        """Return ``queryset`` as a ``values()`` queryset with every lookup the plan reads."""
+        available = queryset.query.annotations
+        annotations = [name for name in self.root.annotations if name in available]
+        return queryset.prefetch_related(None).values(*self.root.paths, *annotations, *extra)
+
+    def render(self, rows: List[dict], request=None) -> List[dict]:
+        """Turn rows from ``values()`` into serialized dicts."""
+        ctx = {"request": request, "many": {many: many.fetch(rows, request) for many in self.root.many}}
+        to_dict = self.root.to_dict
+        return [to_dict(row, ctx) for row in rows]
+
+    def serialize(self, queryset: QuerySet, request=None) -> List[dict]:
+        return self.render(list(self.values(queryset)), request=request)
+
+
+# Field sets come from the client (``?fields=``), so only the most recently
+# used plans are kept.
+COMPILED_CACHE_SIZE = 128
+
+
+@lru_cache(maxsize=COMPILED_CACHE_SIZE)
+def _compile(serializer_class, kwargs: frozenset) -> Optional[CompiledSerializer]:
+    try:
+        return CompiledSerializer(serializer_class(**dict(kwargs)))
+    except SerializerNotCompilable:
+        return None
+
+
+def compile_serializer(serializer_class, **kwargs) -> Optional[CompiledSerializer]:
+    """Return a cached compiled plan, or None when the serializer is not compilable.
+
+    ``kwargs`` are passed to the serializer constructor and must be hashable
+    (e.g. ``fields=frozenset(...)`` for ``ProductListSerializer``).
+    """
+    return _compile(serializer_class, frozenset(kwargs.items()))
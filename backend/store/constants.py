@@ -19,7 +19,13 @@ CART_GUEST_PREFIX = "guest:"
 
 # TTLs
 CART_TTL_SECONDS = 60 * 60 * 24 * 7        # 7 days
+CART_GUEST_TTL_SECONDS = 60 * 60 * 24 * 2  # 2 days; guest carts are mostly abandoned
 CART_COOKIE_MAX_AGE = 60 * 60 * 24 * 30    # 30 days
+# Priced cart snapshots are keyed by cart contents and a catalog epoch that
+# product and inventory writes bump; the TTL bounds staleness from
+# writes that bypass signals (e.g. queryset updates to stock).
+PRICING_CACHE_PREFIX = "pricing:"
+PRICING_SNAPSHOT_TTL_SECONDS = 60 * 5
 
 # ------------------ Providers & Status ------------------
 # Providers (should match Payment.Provider choices)
@@ -56,5 +62,69 @@ MAX_PAGE_SIZE = 100
 
 # ------------------ Inventory ------------------
 LOW_STOCK_THRESHOLD = 3
-RESERVATION_TIMEOUT_SECONDS = 60 * 10  # reserved for 10 minutes (future use)
+RESERVATION_TIMEOUT_SECONDS = 60 * 10  # checkout stock holds expire after 10 minutes
 
+# ------------------ Catalog facets ------------------
+# Price buckets as (min, max) pairs; ``None`` leaves the bound open.
+PRICE_FACET_BUCKETS = (
+    (None, 25),
+    (25, 50),
+    (50, 100),
+    (100, 250),
+    (250, None),
+)
+# Upper bounds (in days) for the "ships within" facet.
+SHIPPING_FACET_MAX_DAYS = (3, 7, 14, 30)
+
+# ------------------ Recommendations ------------------
+RECOMMENDATION_TOP_K = 8
+# How long an order stays marked as counted in the incremental co-purchase update.
+COPURCHASE_ORDER_MARKER_TTL_SECONDS = 60 * 60 * 48
+
+# ------------------ Coupons ------------------
+COUPON_CACHE_TTL_SECONDS = 60
+# Unknown codes are cached briefly so typing in the coupon box stays off the DB.
+COUPON_NEGATIVE_CACHE_TTL_SECONDS = 30
+
+# ------------------ Circuit breakers ------------------
+# A provider or supplier operation that fails this many times within the
+# window is short-circuited for the reset timeout, then probed by one call.
+# The probe lock outlives the longest gateway read timeout.
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_FAILURE_WINDOW_SECONDS = 60
+CIRCUIT_RESET_TIMEOUT_SECONDS = 30
+CIRCUIT_PROBE_TIMEOUT_SECONDS = 15
+
+# ------------------ Currency ------------------
+# Each process re-reads conversion rates from the configured source this often.
+CURRENCY_RATE_TTL_SECONDS = 300
+
+# ------------------ Payments ------------------
+# (connect, read) timeouts for gateway HTTP calls; connect fails fast so a
+# down host does not hold a worker.
+PAYMENT_HTTP_TIMEOUT = (3.05, 10)
+PAYMENT_HTTP_POOL_SIZE = 10
+# Idempotent (GET/HEAD) gateway calls are retried on connection errors and 502/503/504.
+PAYMENT_HTTP_GET_RETRIES = 2
+# An intent call still unfinished after this long died with its worker and
+# may be retried; well above the longest gateway call.
+PAYMENT_INTENT_STALE_SECONDS = 120
+# Pending payments are polled with fetch_payment_status after these delays
+# (seconds since intent creation, then since the previous check).
+PAYMENT_POLL_BACKOFF_SECONDS = (60, 300, 900, 3600)
+# At most this many status calls run at once per provider in one poll run.
+PAYMENT_POLL_CONCURRENCY = 4
+PAYMENT_POLL_BATCH_SIZE = 200
+# Extra time on the poll run lock beyond its worst-case gateway time (see
+# poll_lock_timeout), for applying the results.
+PAYMENT_POLL_LOCK_MARGIN_SECONDS = 120
+# Webhook inbox rows that keep failing are left for manual follow-up after this many tries.
+WEBHOOK_INBOX_MAX_ATTEMPTS = 5
+# Bulk refund jobs: gateway refunds in flight per provider, items applied per
+# transaction (and per progress update), and orders accepted per job.
+REFUND_JOB_CONCURRENCY = 4
+REFUND_JOB_CHUNK_SIZE = 50
+REFUND_JOB_MAX_ORDERS = 1000
+# A running job that has not finished a chunk for this long belongs to a dead
+# worker; a chunk takes at most ~13 rounds of gateway timeouts.
+REFUND_JOB_STALE_SECONDS = 600
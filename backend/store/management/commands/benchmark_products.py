@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+
+from store.repositories.product import ProductRepository
+from store.serializers import ProductListSerializer, ProductSerializer
+
+
+class Command(BaseCommand):
+    help = "Compare payload size, query count and serialization time of full vs slim product listings."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--page-size", type=int, default=50)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--fields", default="", help="Comma separated ?fields= value for the slim run.")
+        parser.add_argument("--expand", default="", help="Comma separated ?expand= value for the slim run.")
+
+    def handle(self, *args, **options):
+        page_size = options["page_size"]
+        fields = ProductListSerializer.selected_fields({"fields": options["fields"], "expand": options["expand"]})
+        runs = [
+            ("full", lambda: ProductRepository.get_active_products_queryset(), ProductSerializer, {}),
+            ("slim", lambda: ProductRepository.get_listing_queryset(fields), ProductListSerializer, {"fields": fields}),
+        ]
+        for label, make_queryset, serializer_class, kwargs in runs:
+            elapsed = 0.0
+            for _ in range(options["repeat"]):
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    page = list(make_queryset().order_by("-created_at")[:page_size])
+                    payload = JSONRenderer().render(serializer_class(page, many=True, **kwargs).data)
+                    elapsed += time.perf_counter() - started
+            self.stdout.write(
+                f"{label}: {len(page)} products, {len(payload)} bytes, {len(queries)} queries, "
+                f"{elapsed / options['repeat'] * 1000:.2f} ms/page"
+            )
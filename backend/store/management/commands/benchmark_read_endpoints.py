@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from store.models import Order, User
+
+
+class Command(BaseCommand):
+    help = "Measure single-worker requests/sec of hot list endpoints with and without compiled serializers."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seconds", type=float, default=5.0, help="Duration of each run.")
+        parser.add_argument("--page-size", type=int, default=50)
+        parser.add_argument("--email", help="User for /api/orders/ (defaults to the user with the most orders).")
+
+    def handle(self, *args, **options):
+        client = APIClient()
+        user = self._orders_user(options.get("email"))
+        if user is not None:
+            client.force_authenticate(user)
+        page_size = options["page_size"]
+        urls = [f"/api/products/?page_size={page_size}", f"/api/products/?expand=&page_size={page_size}"]
+        if user is not None:
+            urls.append(f"/api/orders/?page_size={page_size}")
+
+        for url in urls:
+            rates = {}
+            for compiled in (False, True):
+                with override_settings(COMPILED_SERIALIZERS=compiled):
+                    rates[compiled] = self._requests_per_second(client, url, options["seconds"])
+            self.stdout.write(
+                f"{url}: DRF {rates[False]:.1f} req/s, compiled {rates[True]:.1f} req/s "
+                f"({rates[True] / rates[False]:.2f}x)"
+            )
+
+    @staticmethod
+    def _orders_user(email):
+        if email:
+            try:
+                return User.objects.get(email=email)
+            except User.DoesNotExist:
+                raise CommandError(f"No user with email {email}")
+        order = Order.objects.order_by("user_id").first()
+        return order.user if order else None
+
+    @staticmethod
+    def _requests_per_second(client, url, seconds):
+        response = client.get(url)
+        if response.status_code != 200:
+            raise CommandError(f"{url} returned {response.status_code}")
+        count = 0
+        started = time.perf_counter()
+        while time.perf_counter() - started < seconds:
+            client.get(url)
+            count += 1
+        return count / (time.perf_counter() - started)
@@ -0,0 +1,85 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from scipy import sparse
+
+from store.constants import RECOMMENDATION_TOP_K
+from store.models import Product
+from store.repositories.product import ProductRepository
+from store.services.similarity import build_interaction_matrix, top_k_similar
+from store.tasks import COPURCHASE_ORDER_STATUSES
+
+
+def orm_recommendations(product: Product, limit: int):
+    """The per-request co-occurrence query the endpoint used to run."""
+    return list(
+        ProductRepository.get_active_products_queryset()
+        .filter(order_items__order__items__product=product)
+        .exclude(id=product.id)
+        .annotate(freq=Count("order_items__id"))
+        .order_by("-freq", "-avg_rating")
+        .values_list("id", flat=True)[:limit]
+    )
+
+
+class Command(BaseCommand):
+    help = "Compare per-request ORM recommendations against the vectorized similarity build."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sample", type=int, default=50, help="Products to time the ORM query on.")
+        parser.add_argument("--top-k", type=int, default=RECOMMENDATION_TOP_K)
+        parser.add_argument(
+            "--synthetic-products",
+            type=int,
+            default=0,
+            help="Also time the vectorized build on a random matrix with this many products (e.g. 100000).",
+        )
+        parser.add_argument("--synthetic-users", type=int, default=200000)
+        parser.add_argument("--interactions-per-user", type=int, default=8)
+
+    def handle(self, *args, **options):
+        top_k = options["top_k"]
+        active = ProductRepository.get_active_products_queryset()
+        catalog_size = active.count()
+
+        products = list(active.order_by("?")[: options["sample"]])
+        if products:
+            started = time.perf_counter()
+            for product in products:
+                orm_recommendations(product, top_k)
+            per_product = (time.perf_counter() - started) / len(products)
+            self.stdout.write(
+                f"ORM per-request query: {per_product * 1000:.2f} ms/product over {len(products)} products; "
+                f"{per_product * catalog_size:.1f}s to cover all {catalog_size} active products"
+            )
+
+        started = time.perf_counter()
+        matrix, product_ids = build_interaction_matrix(COPURCHASE_ORDER_STATUSES)
+        load_time = time.perf_counter() - started
+        started = time.perf_counter()
+        top_k_similar(matrix, top_k)
+        build_time = time.perf_counter() - started
+        self.stdout.write(
+            f"Vectorized build on database: {matrix.shape[0]} users x {len(product_ids)} products, "
+            f"{matrix.nnz} interactions; load {load_time:.2f}s, similarity {build_time:.2f}s"
+        )
+
+        n_products = options["synthetic_products"]
+        if n_products:
+            n_users = options["synthetic_users"]
+            nnz = n_users * options["interactions_per_user"]
+            rng = np.random.default_rng(0)
+            # Zipf-like popularity so a few products are dense, as in real catalogs.
+            cols = np.minimum(rng.zipf(1.3, nnz) - 1, n_products - 1)
+            rows = rng.integers(0, n_users, nnz)
+            synthetic = sparse.coo_matrix(
+                (np.ones(nnz, dtype=np.float32), (rows, cols)), shape=(n_users, n_products)
+            ).tocsr()
+            started = time.perf_counter()
+            top_k_similar(synthetic, top_k)
+            self.stdout.write(
+                f"Vectorized build on synthetic data: {n_users} users x {n_products} products, "
+                f"{synthetic.nnz} interactions; similarity {time.perf_counter() - started:.2f}s"
+            )
@@ -1,4 +1,4 @@
-from prometheus_client import Counter
+from prometheus_client import Counter, Gauge, Histogram
 
 SUPPLIER_SYNC_FAILURES = Counter(
     "supplier_sync_failures_total",
@@ -12,3 +12,67 @@ PAYMENT_FAILURES = Counter(
     labelnames=("provider",),
 )
 
+PAYMENT_WEBHOOK_REJECTED = Counter(
+    "payment_webhook_rejected_total",
+    "Webhooks rejected for a bad or missing signature before their body was decoded",
+    labelnames=("provider",),
+)
+
+
+CHECKOUT_LATENCY = Histogram(
+    "checkout_latency_seconds",
+    "End-to-end checkout request latency",
+    labelnames=("provider",),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0),
+)
+
+INVENTORY_LOCK_SECONDS = Histogram(
+    "inventory_lock_seconds",
+    "Time the stock reservation transaction holds inventory row locks",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+
+PAYMENT_INTENT_LATENCY = Histogram(
+    "payment_intent_latency_seconds",
+    "Latency of gateway payment-intent creation calls",
+    labelnames=("provider", "outcome"),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0),
+)
+
+CART_LIVE_KEYS = Gauge(
+    "cart_live_keys",
+    "Live cart keys in Redis at the last sweep",
+    labelnames=("kind",),
+)
+
+CART_MEMORY_BYTES = Gauge(
+    "cart_memory_bytes",
+    "Redis memory used by live carts at the last sweep",
+    labelnames=("kind",),
+)
+
+WEBHOOK_APPLY_LAG_SECONDS = Histogram(
+    "payment_webhook_apply_lag_seconds",
+    "Time from webhook intake to the inbox worker applying it",
+    labelnames=("provider",),
+    buckets=(0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0),
+)
+
+PAYMENT_GATEWAY_REQUEST_SECONDS = Histogram(
+    "payment_gateway_request_seconds",
+    "Latency of HTTP calls to payment gateways",
+    labelnames=("provider", "operation"),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0),
+)
+
+CIRCUIT_STATE = Gauge(
+    "circuit_breaker_state",
+    "Circuit breaker state as last seen by this process (0 closed, 1 half-open, 2 open)",
+    labelnames=("name",),
+)
+
+CIRCUIT_REJECTED = Counter(
+    "circuit_breaker_rejected_total",
+    "Calls failed fast because their circuit breaker was open",
+    labelnames=("name",),
+)
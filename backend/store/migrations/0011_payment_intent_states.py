@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-19 09:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0010_inventory_reservation'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('succeeded', 'Succeeded'), ('failed', 'Failed'), ('refunded', 'Refunded'), ('intent_pending', 'Creating intent'), ('intent_failed', 'Intent creation failed')], default='pending', max_length=16),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.16 on 2026-10-19 09:27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_counters(apps, schema_editor):
+    Coupon = apps.get_model('store', 'Coupon')
+    CouponRedemption = apps.get_model('store', 'CouponRedemption')
+    CouponUserUsage = apps.get_model('store', 'CouponUserUsage')
+    totals = CouponRedemption.objects.values('coupon_id').annotate(total=models.Count('id'))
+    for row in totals:
+        Coupon.objects.filter(pk=row['coupon_id']).update(redemption_count=row['total'])
+    per_user = CouponRedemption.objects.values('coupon_id', 'user_id').annotate(total=models.Count('id'))
+    CouponUserUsage.objects.bulk_create(
+        [CouponUserUsage(coupon_id=row['coupon_id'], user_id=row['user_id'], count=row['total']) for row in per_user],
+        batch_size=1000,
+    )
+
+
+def noop_reverse(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_payment_intent_states'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coupon',
+            name='redemption_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='CouponUserUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('coupon', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_usage', to='store.coupon')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='coupon_usage', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('coupon', 'user')},
+            },
+        ),
+        migrations.RunPython(backfill_counters, reverse_code=noop_reverse),
+    ]
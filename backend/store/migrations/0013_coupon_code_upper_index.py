@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-19 09:29
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_coupon_redemption_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='coupon',
+            index=models.Index(django.db.models.functions.text.Upper('code'), name='store_coupon_code_upper_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.16 on 2026-10-19 09:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_webhook_inbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(choices=[('stripe', 'Stripe'), ('paypal', 'PayPal'), ('esewa', 'eSewa'), ('khalti', 'Khalti'), ('cod', 'Cash on Delivery'), ('other', 'Other')], max_length=16)),
+                ('provider_event_id', models.CharField(max_length=160)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('succeeded', 'Succeeded'), ('failed', 'Failed'), ('refunded', 'Refunded'), ('intent_pending', 'Creating intent'), ('intent_failed', 'Intent creation failed')], max_length=16)),
+                ('source', models.CharField(choices=[('webhook', 'Webhook'), ('verify', 'Verify'), ('reconcile', 'Reconcile')], max_length=16)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payment_events', to='store.order')),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='events', to='store.payment')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='paymentevent',
+            constraint=models.UniqueConstraint(fields=('provider', 'provider_event_id'), name='store_payment_event_unique'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.16 on 2026-10-19 09:47
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def schedule_pending_payments(apps, schema_editor):
+    Payment = apps.get_model('store', 'Payment')
+    Payment.objects.filter(status='pending').update(next_check_at=timezone.now())
+
+
+def noop_reverse(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_payment_event_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='check_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='next_check_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='paymentevent',
+            name='source',
+            field=models.CharField(choices=[('webhook', 'Webhook'), ('verify', 'Verify'), ('reconcile', 'Reconcile'), ('poll', 'Status poll')], max_length=16),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(condition=models.Q(('next_check_at__isnull', False), ('status', 'pending')), fields=['next_check_at'], name='store_payment_next_check_idx'),
+        ),
+        migrations.RunPython(schedule_pending_payments, noop_reverse),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.16 on 2026-10-19 09:53
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_payment_status_polling'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RefundJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('completed', 'Completed')], default='pending', max_length=16)),
+                ('reason', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='refund_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RefundJobItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(blank=True, choices=[('stripe', 'Stripe'), ('paypal', 'PayPal'), ('esewa', 'eSewa'), ('khalti', 'Khalti'), ('cod', 'Cash on Delivery'), ('other', 'Other')], max_length=16)),
+                ('amount', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('succeeded', 'Succeeded'), ('failed', 'Failed'), ('skipped', 'Skipped')], default='pending', max_length=16)),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('response', models.JSONField(blank=True, default=dict)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='store.refundjob')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='refund_items', to='store.order')),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='refund_items', to='store.payment')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['job', 'status'], name='store_refund_item_job_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='refundjobitem',
+            constraint=models.UniqueConstraint(fields=('job', 'order'), name='store_refund_item_job_order_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='refundjobitem',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'processing', 'succeeded'])), fields=('payment',), name='store_refund_item_active_payment_unique'),
+        ),
+    ]
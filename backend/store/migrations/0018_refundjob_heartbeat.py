@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-19 10:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0017_refund_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='refundjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
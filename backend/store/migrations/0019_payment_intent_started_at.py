@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-19 10:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0018_refundjob_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='intent_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.16 on 2026-10-19 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0019_payment_intent_started_at'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='webhookinbox',
+            old_name='verified',
+            new_name='succeeded',
+        ),
+        migrations.AlterField(
+            model_name='webhookinbox',
+            name='succeeded',
+            field=models.BooleanField(null=True),
+        ),
+        migrations.RemoveField(
+            model_name='webhookinbox',
+            name='payload',
+        ),
+        migrations.AddField(
+            model_name='webhookinbox',
+            name='body',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='webhookinbox',
+            name='content_type',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='webhookinbox',
+            name='headers',
+            field=models.JSONField(default=dict),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-19 10:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0020_webhookinbox_raw_request'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='refundjob',
+            name='owner',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
@@ -4,6 +4,7 @@ from django.conf import settings
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.db.models.functions import Upper
 from django.utils import timezone
 
 
@@ -240,14 +241,9 @@ class Bundle(models.Model):
         return total.quantize(Decimal("0.01"))
 
     def final_price(self) -> Decimal:
-        price = self.base_price()
-        if self.discount_percent:
-            price = price * (Decimal("1.00") - self.discount_percent / Decimal("100.00"))
-        if self.discount_amount:
-            price = price - self.discount_amount
-        if price < Decimal("0.00"):
-            price = Decimal("0.00")
-        return price.quantize(Decimal("0.01"))
+        from .services.pricing import bundle_price
+
+        return bundle_price(self.base_price(), self.discount_percent, self.discount_amount)
 
 
 class AdminActionLog(models.Model):
@@ -404,6 +400,54 @@ class OrderItem(models.Model):
         return f"{self.product.sku} x {self.quantity}"
 
 
+class ProductCoPurchase(models.Model):
+    """Sparse item-item co-purchase counts backing "frequently bought together"."""
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="copurchases")
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product", "related"], name="uniq_copurchase_pair"),
+        ]
+        indexes = [
+            models.Index(fields=["product", "-count"], name="store_copurchase_top_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.related_id} ({self.count})"
+
+
+class InventoryReservation(models.Model):
+    """Stock held for an order between checkout and payment.
+
+    Stock is taken from ``Inventory.quantity`` when the hold is created, then
+    committed on payment or returned when the hold is released or expires.
+    """
+
+    class Status(models.TextChoices):
+        HELD = "held", "Held"
+        COMMITTED = "committed", "Committed"
+        RELEASED = "released", "Released"
+
+    order = models.ForeignKey(Order, null=True, blank=True, on_delete=models.CASCADE, related_name="reservations")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="reservations")
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.HELD)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    released_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "expires_at"], name="store_reservation_expiry_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} x {self.quantity} ({self.status})"
+
+
 class Payment(models.Model):
     class Provider(models.TextChoices):
         STRIPE = "stripe", "Stripe"
@@ -418,6 +462,10 @@ class Payment(models.Model):
         SUCCEEDED = "succeeded", "Succeeded"
         FAILED = "failed", "Failed"
         REFUNDED = "refunded", "Refunded"
+        # Checkout commits the order before calling the gateway; these track
+        # the intent call that happens after that commit.
+        INTENT_PENDING = "intent_pending", "Creating intent"
+        INTENT_FAILED = "intent_failed", "Intent creation failed"
 
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="payments")
     provider = models.CharField(max_length=16, choices=Provider.choices)
@@ -426,11 +474,159 @@ class Payment(models.Model):
     status = models.CharField(max_length=16, choices=Status.choices, default=Status.PENDING)
     raw_response = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # When the current intent call started; an ``INTENT_PENDING`` payment
+    # older than PAYMENT_INTENT_STALE_SECONDS was abandoned by its worker.
+    intent_started_at = models.DateTimeField(null=True, blank=True)
+    # When ``poll_pending_payments`` next asks the gateway about a pending
+    # payment; cleared once the backoff schedule is used up.
+    next_check_at = models.DateTimeField(null=True, blank=True)
+    check_attempts = models.PositiveSmallIntegerField(default=0)
 
     class Meta:
         indexes = [
             models.Index(fields=["provider_payment_id"]),
+            models.Index(
+                fields=["next_check_at"],
+                name="store_payment_next_check_idx",
+                condition=models.Q(status="pending", next_check_at__isnull=False),
+            ),
+        ]
+
+
+class PaymentEvent(models.Model):
+    """Append-only ledger of payment outcomes reported by gateways.
+
+    One row per payment state transition: ``provider_event_id`` is
+    ``<provider_payment_id>:<status>``, so a webhook, a verify callback and a
+    gateway retry reporting the same outcome collide on the unique index and
+    only the first one is applied.
+    """
+
+    class Source(models.TextChoices):
+        WEBHOOK = "webhook", "Webhook"
+        VERIFY = "verify", "Verify"
+        RECONCILE = "reconcile", "Reconcile"
+        POLL = "poll", "Status poll"
+
+    provider = models.CharField(max_length=16, choices=Payment.Provider.choices)
+    provider_event_id = models.CharField(max_length=160)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="payment_events")
+    payment = models.ForeignKey(Payment, null=True, blank=True, on_delete=models.SET_NULL, related_name="events")
+    status = models.CharField(max_length=16, choices=Payment.Status.choices)
+    source = models.CharField(max_length=16, choices=Source.choices)
+    payload = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["provider", "provider_event_id"], name="store_payment_event_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.provider}:{self.provider_event_id}"
+
+
+class WebhookInbox(models.Model):
+    """Gateway webhook waiting to be verified and applied by ``process_webhook_inbox``.
+
+    Rows are appended by the webhook endpoint in async intake mode once the
+    signature passes the gateway's local check; the raw request is kept so the
+    worker can run the full verification. Events are applied in id order per
+    order; ``processed_at`` marks them done.
+    """
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="webhook_events")
+    provider = models.CharField(max_length=16, choices=Payment.Provider.choices)
+    # Raw request as received: body, Content-Type header and the other headers
+    # the gateway verifies against (credentials stripped).
+    body = models.BinaryField(default=b"")
+    content_type = models.CharField(max_length=255, blank=True)
+    headers = models.JSONField(default=dict)
+    # Payment outcome from ``verify_webhook``; null until the worker verifies it.
+    succeeded = models.BooleanField(null=True)
+    # Gateway result from ``verify_webhook`` (status, provider_payment_id, ...).
+    result = models.JSONField(default=dict)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["id"], name="store_webhook_pending_idx", condition=models.Q(processed_at__isnull=True)
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.provider} webhook for order {self.order_id}"
+
+
+class RefundJob(models.Model):
+    """A batch of order refunds requested together, run by ``run_refund_job``."""
+
+    class Status(models.TextChoices):
+        PENDING = "pending", "Pending"
+        RUNNING = "running", "Running"
+        COMPLETED = "completed", "Completed"
+
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name="refund_jobs"
+    )
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.PENDING)
+    reason = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Touched by the running worker after every gateway call; a RUNNING job
+    # whose heartbeat is older than REFUND_JOB_STALE_SECONDS is taken over.
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    # Token of the run that owns the job; a run that was taken over stops
+    # claiming items and writing progress once this changes.
+    owner = models.CharField(max_length=32, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Refund job {self.id} ({self.status})"
+
+
+class RefundJobItem(models.Model):
+    """One order of a ``RefundJob`` and the outcome of its gateway refund."""
+
+    class Status(models.TextChoices):
+        PENDING = "pending", "Pending"
+        # The gateway call is in flight; an item left here by a crashed
+        # worker needs checking with the provider before it is retried.
+        PROCESSING = "processing", "Processing"
+        SUCCEEDED = "succeeded", "Succeeded"
+        FAILED = "failed", "Failed"
+        SKIPPED = "skipped", "Skipped"
+
+    # A payment can be in at most one of these at a time, across jobs.
+    ACTIVE_STATUSES = (Status.PENDING, Status.PROCESSING, Status.SUCCEEDED)
+
+    job = models.ForeignKey(RefundJob, on_delete=models.CASCADE, related_name="items")
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="refund_items")
+    payment = models.ForeignKey(Payment, null=True, blank=True, on_delete=models.SET_NULL, related_name="refund_items")
+    provider = models.CharField(max_length=16, choices=Payment.Provider.choices, blank=True)
+    amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.PENDING)
+    error = models.CharField(max_length=255, blank=True)
+    response = models.JSONField(default=dict, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["job", "order"], name="store_refund_item_job_order_unique"),
+            models.UniqueConstraint(
+                fields=["payment"],
+                name="store_refund_item_active_payment_unique",
+                condition=models.Q(status__in=["pending", "processing", "succeeded"]),
+            ),
         ]
+        indexes = [models.Index(fields=["job", "status"], name="store_refund_item_job_idx")]
+
+    def __str__(self):
+        return f"Refund of order {self.order_id} in job {self.job_id}"
 
 
 class Coupon(models.Model):
@@ -450,6 +646,14 @@ class Coupon(models.Model):
     influencer_name = models.CharField(max_length=120, blank=True)
     influencer_handle = models.CharField(max_length=120, blank=True)
     referral_url = models.URLField(blank=True)
+    # Maintained by store.services.coupons alongside CouponRedemption rows.
+    redemption_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Case-insensitive lookups go through UPPER(code); see store.services.coupons.
+            models.Index(Upper("code"), name="store_coupon_code_upper_idx"),
+        ]
 
     def is_valid(self) -> bool:
         if not self.is_active:
@@ -520,6 +724,17 @@ class CouponRedemption(models.Model):
         ]
 
 
+class CouponUserUsage(models.Model):
+    """Per-user redemption counter, so limit checks are a single-row read."""
+
+    coupon = models.ForeignKey(Coupon, on_delete=models.CASCADE, related_name="user_usage")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="coupon_usage")
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("coupon", "user")
+
+
 class OrderStatusEvent(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="events")
     status = models.CharField(max_length=16, choices=Order.Status.choices)
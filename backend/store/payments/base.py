@@ -1,11 +1,88 @@
 from __future__ import annotations
 
+import hashlib
+import hmac
+import threading
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Tuple
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Any, Iterator, Optional, Tuple, Union
 
+import requests
 from django.utils.module_loading import import_string
 
-from store.models import Order
+from store.models import Order, Payment
+
+from .http import agateway_request, gateway_request
+
+
+class InvalidReturn(ValueError):
+    """The customer's return parameters are missing what the provider needs to verify them."""
+
+
+class InvalidSignature(ValueError):
+    """A webhook carried a signature that does not match its raw body."""
+
+
+RawBody = Union[bytes, memoryview]
+
+
+class WebhookPayload(Mapping):
+    """Webhook fields, decoded from the request body on first access.
+
+    Gateways check the signature against the raw bytes before reading any
+    field, so a request with a bad signature is rejected without decoding
+    its body. Single-element lists (form posts) are unwrapped and a top-level
+    JSON array is exposed as ``{"data": [...]}``.
+    """
+
+    def __init__(self, loader: Callable[[], Any]):
+        self._loader = loader
+        self._data: Optional[Dict[str, Any]] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._data is not None
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        if self._data is None:
+            raw = self._loader()
+            if hasattr(raw, "lists"):
+                raw = dict(raw.lists())
+            elif isinstance(raw, list):
+                raw = {"data": raw}
+            self._data = {
+                key: value[0] if isinstance(value, list) and len(value) == 1 else value
+                for key, value in dict(raw or {}).items()
+            }
+        return self._data
+
+    def __getitem__(self, key: str) -> Any:
+        return self.data[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.data)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+
+def signature_matches(secret: str, raw_body: RawBody, signature: str) -> bool:
+    """Constant-time check of a hex HMAC-SHA256 ``signature`` over ``raw_body``."""
+    expected = hmac.new(secret.encode(), raw_body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature or "")
+
+
+@dataclass(frozen=True)
+class ReturnCheck:
+    """The provider call that verifies a customer's return from the hosted payment page."""
+
+    method: str
+    url: str
+    kwargs: Dict[str, Any]
+    provider_payment_id: str
+    details: Dict[str, Any] = field(default_factory=dict)
 
 
 class PaymentGateway(ABC):
@@ -16,8 +93,28 @@ class PaymentGateway(ABC):
         """Return dict with keys like: payment_url, token, provider_payment_id."""
 
     @abstractmethod
-    def verify_webhook(self, payload: Dict[str, Any], headers: Dict[str, Any]) -> Tuple[bool, Dict[str, Any]]:
-        """Return (is_valid, normalized_data). normalized_data should include status and provider_payment_id."""
+    def verify_webhook(
+        self, payload: Mapping[str, Any], headers: Mapping[str, Any], raw_body: RawBody = b""
+    ) -> Tuple[bool, Dict[str, Any]]:
+        """Return (is_valid, normalized_data). normalized_data should include status and provider_payment_id.
+
+        ``raw_body`` is the request body as received; signatures are checked
+        against it, before reading ``payload``, and a mismatch raises
+        ``InvalidSignature``.
+        """
+
+    def check_webhook_signature(self, headers: Mapping[str, Any], raw_body: RawBody) -> bool:
+        """The local part of ``verify_webhook``: no network calls, payload not decoded.
+
+        Raises ``InvalidSignature`` for a request ``verify_webhook`` would
+        reject on its signature; returns whether a signature was present and
+        matched. Async webhook intake runs only this before queueing.
+        """
+        return False
+
+    def webhook_order_id(self, payload: Mapping[str, Any]) -> Optional[Any]:
+        """Order id carried by a webhook payload, for routing it before verification."""
+        return payload.get("order_id")
 
     @abstractmethod
     def handle_refund(self, order: Order, amount) -> Dict[str, Any]:
@@ -27,6 +124,33 @@ class PaymentGateway(ABC):
     def fetch_payment_status(self, provider_payment_id: str) -> Dict[str, Any]:
         raise NotImplementedError
 
+    def _request(self, operation: str, method: str, url: str, **kwargs) -> requests.Response:
+        """HTTP call to this provider over its pooled session (see ``store.payments.http``)."""
+        return gateway_request(self.key, operation, method, url, **kwargs)
+
+    # Return-URL verification, for providers that redirect the customer back
+    # with a token to confirm server-side.
+    def return_check(self, order: Order, params, payment: Optional[Payment] = None) -> ReturnCheck:
+        """Build the verification call from the return query params; raise ``InvalidReturn`` if incomplete."""
+        raise NotImplementedError
+
+    def return_succeeded(self, status_code: int, text: str) -> bool:
+        return status_code in (200, 201)
+
+    def verify_return(self, order: Order, params, payment: Optional[Payment] = None) -> Tuple[bool, str, Dict[str, Any]]:
+        """Return ``(ok, provider_payment_id, details)`` for a customer's return."""
+        check = self.return_check(order, params, payment)
+        resp = self._request("verify", check.method, check.url, **check.kwargs)
+        return self.return_succeeded(resp.status_code, resp.text), check.provider_payment_id, check.details
+
+    async def averify_return(
+        self, order: Order, params, payment: Optional[Payment] = None
+    ) -> Tuple[bool, str, Dict[str, Any]]:
+        """``verify_return`` over the async client, for ASGI views."""
+        check = self.return_check(order, params, payment)
+        resp = await agateway_request(self.key, "verify", check.method, check.url, **check.kwargs)
+        return self.return_succeeded(resp.status_code, resp.text), check.provider_payment_id, check.details
+
 
 _GATEWAYS: Dict[str, str] = {
     "esewa": "store.payments.esewa.ESewaGateway",
@@ -37,9 +161,30 @@ _GATEWAYS: Dict[str, str] = {
 }
 
 
+_instances: Dict[str, PaymentGateway] = {}
+_instances_lock = threading.Lock()
+
+
 def get_gateway(key: str) -> PaymentGateway:
+    """Return the process-wide gateway for ``key``, created on first use.
+
+    Gateways hold configuration and SDK clients only, so one instance per
+    process is shared by all requests.
+    """
     key = (key or "").lower()
+    gateway = _instances.get(key)
+    if gateway is not None:
+        return gateway
     if key not in _GATEWAYS:
         raise ValueError(f"Unknown payment provider '{key}'")
-    cls = import_string(_GATEWAYS[key])
-    return cls()
+    with _instances_lock:
+        gateway = _instances.get(key)
+        if gateway is None:
+            gateway = _instances[key] = import_string(_GATEWAYS[key])()
+    return gateway
+
+
+def reset_gateways() -> None:
+    """Drop cached gateways, e.g. after changing provider credentials in tests."""
+    with _instances_lock:
+        _instances.clear()
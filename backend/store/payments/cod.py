@@ -1,10 +1,11 @@
 from __future__ import annotations
 
+from collections.abc import Mapping
 from typing import Any, Dict, Tuple
 
 from store.models import Order
 
-from .base import PaymentGateway
+from .base import PaymentGateway, RawBody
 
 
 class CODGateway(PaymentGateway):
@@ -17,7 +18,9 @@ class CODGateway(PaymentGateway):
             "instructions": "Pay with cash when your order arrives at your doorstep.",
         }
 
-    def verify_webhook(self, payload: Dict[str, Any], headers: Dict[str, Any]) -> Tuple[bool, Dict[str, Any]]:
+    def verify_webhook(
+        self, payload: Mapping[str, Any], headers: Mapping[str, Any], raw_body: RawBody = b""
+    ) -> Tuple[bool, Dict[str, Any]]:
         # Cash on delivery does not rely on remote webhooks. Manual confirmation required.
         return True, {"status": payload.get("status", "pending"), "provider_payment_id": payload.get("provider_payment_id")}
 
@@ -5,11 +5,12 @@ import os
 import hmac
 import hashlib
 import base64
-from decimal import Decimal, ROUND_HALF_UP
+from decimal import Decimal
+from collections.abc import Mapping
 from typing import Any, Dict, Tuple
 from urllib.parse import urlencode, urlparse, parse_qsl, urlunparse
 
-from .base import PaymentGateway
+from .base import InvalidReturn, InvalidSignature, PaymentGateway, RawBody, ReturnCheck, signature_matches
 
 
 class ESewaGateway(PaymentGateway):
@@ -22,6 +23,7 @@ class ESewaGateway(PaymentGateway):
     STATUS_URL = os.environ.get("ESEWA_STATUS_URL")
     DEFAULT_FORM_URL = "https://rc-epay.esewa.com.np/api/epay/main/v2/form"
     DEFAULT_STATUS_URL = "https://rc.esewa.com.np/api/epay/transaction/status/"
+    VERIFY_URL = os.environ.get("ESEWA_VERIFY_URL", "https://uat.esewa.com.np/epay/transrec")
     SUCCESS_URL = os.environ.get("ESEWA_SUCCESS_URL")
     FAILURE_URL = os.environ.get("ESEWA_FAILURE_URL")
     WEBSITE_URL = os.environ.get("ESEWA_WEBSITE_URL") or os.environ.get("FRONTEND_URL", "http://localhost:5173")
@@ -30,7 +32,6 @@ class ESewaGateway(PaymentGateway):
     SERVICE_CHARGE = os.environ.get("ESEWA_SERVICE_CHARGE", "0")
     DELIVERY_CHARGE = os.environ.get("ESEWA_DELIVERY_CHARGE", "0")
     TAX_AMOUNT = os.environ.get("ESEWA_TAX_AMOUNT", "0")
-    DEFAULT_CONVERSION_RATE = os.environ.get("ESEWA_CONVERSION_RATE", "133.5")
 
     @staticmethod
     def _decimal(value: Any, default: str = "0") -> Decimal:
@@ -44,13 +45,14 @@ class ESewaGateway(PaymentGateway):
         return format(value.quantize(Decimal("0.01")), "f")
 
     def _conversion_rate(self) -> Decimal:
-        return self._decimal(self.DEFAULT_CONVERSION_RATE, "133.5")
+        from store.services.currency import get_rates
+
+        return get_rates().rate("NPR")
 
     def _to_npr(self, amount: Decimal) -> Decimal:
-        rate = self._conversion_rate()
-        if amount <= 0 or rate <= 0:
-            return amount
-        return (amount * rate).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+        from store.services.pricing import to_npr
+
+        return to_npr(amount, self._conversion_rate())
 
     def _with_query(self, base_url: str, **params: Any) -> str:
         parsed = urlparse(base_url)
@@ -141,28 +143,25 @@ class ESewaGateway(PaymentGateway):
             "base_amount_npr": amount_base_str,
         }
 
-    def verify_webhook(self, payload: Dict[str, Any], headers: Dict[str, Any]) -> Tuple[bool, Dict[str, Any]]:
+    def check_webhook_signature(self, headers: Mapping[str, Any], raw_body: RawBody) -> bool:
+        # A signature, when sent, must match the raw body; nothing is decoded before that.
+        sig = headers.get("X-Signature", "")
+        signature_valid = bool(self.SECRET and sig) and signature_matches(self.SECRET, raw_body, sig)
+        if self.SECRET and sig and not signature_valid:
+            raise InvalidSignature(self.key)
+        return signature_valid
+
+    def verify_webhook(
+        self, payload: Mapping[str, Any], headers: Mapping[str, Any], raw_body: RawBody = b""
+    ) -> Tuple[bool, Dict[str, Any]]:
+        sig = headers.get("X-Signature", "")
+        signature_valid = self.check_webhook_signature(headers, raw_body)
+
         status = (payload.get("status") or payload.get("state") or "").lower()
         provider_payment_id = payload.get("provider_payment_id") or payload.get("refId") or payload.get("oid")
         transaction_id = payload.get("transaction_id") or payload.get("txn_id") or provider_payment_id
         amount = payload.get("amount") or payload.get("amt") or payload.get("total_amount")
-        
-        signature_valid = False
-        if self.SECRET:
-            # Verify signature from headers
-            raw = (headers.get("X-Raw-Body") or "").encode() or (str(payload).encode())
-            sig = headers.get("X-Signature", "")
-            expected = hmac.new(self.SECRET.encode(), raw, hashlib.sha256).hexdigest()
-            signature_valid = hmac.compare_digest(sig, expected)
-            
-            # If signature is present but invalid, reject the webhook
-            if sig and not signature_valid:
-                return False, {
-                    "status": "invalid_signature", 
-                    "provider_payment_id": provider_payment_id,
-                    "signature_verified": False
-                }
-        
+
         # Verify with eSewa API if possible
         api_verified = False
         response_data = {}
@@ -179,7 +178,7 @@ class ESewaGateway(PaymentGateway):
                     "merchant_id": self.MERCHANT_ID
                 }
                 
-                resp = requests.get(status_url, params=params, headers=headers, timeout=15)
+                resp = self._request("status", "GET", status_url, params=params, headers=headers)
                 if resp.status_code in (200, 201):
                     try:
                         response_data = resp.json()
@@ -208,6 +207,25 @@ class ESewaGateway(PaymentGateway):
             
         return ok, result
 
+    def return_check(self, order, params, payment=None) -> ReturnCheck:
+        # transrec?amt=<amt>&scd=<merchant_code>&pid=<order_id or pid>&rid=<refId>
+        ref_id = params.get("refId") or params.get("rid")
+        if not ref_id:
+            raise InvalidReturn("refId (rid) required for eSewa verify")
+        amt = params.get("amt") or str(payment.amount if payment else order.total_amount)
+        stored_pid = payment.provider_payment_id if payment and payment.provider_payment_id else None
+        pid = params.get("pid") or stored_pid or str(order.id)
+        return ReturnCheck(
+            method="GET",
+            url=self.VERIFY_URL,
+            kwargs={"params": {"amt": amt, "scd": self.MERCHANT_ID, "pid": pid, "rid": ref_id}},
+            provider_payment_id=stored_pid or pid,
+            details={"ref_id": ref_id, "amount": amt, "transaction_id": ref_id},
+        )
+
+    def return_succeeded(self, status_code: int, text: str) -> bool:
+        return status_code == 200 and "Success" in text
+
     def handle_refund(self, order, amount):
         return {"status": "refunded", "reference": f"esewa_ref_{order.id}"}
 
@@ -0,0 +1,127 @@
+"""Pooled HTTP sessions for payment gateway calls.
+
+Each provider gets one lazily created ``requests.Session`` per process, so
+calls to the same payment host reuse keep-alive connections instead of
+opening a new TLS connection per request. Idempotent GETs are retried with
+backoff; POSTs are never retried here. Every call is timed into
+``payment_gateway_request_seconds`` by provider and operation.
+
+Async views use ``agateway_request``, backed by one ``httpx.AsyncClient``
+per provider and event loop. Under WSGI every async view runs on its own
+short-lived loop, so those views must ``aclose_async_clients()`` before
+returning.
+
+Both go through the ``payment:<provider>:<operation>`` circuit breaker
+(``store.services.circuit``): connection errors, timeouts and 5xx responses
+count as failures, and while the breaker is open the call raises
+``CircuitOpen`` without touching the network.
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+import weakref
+from typing import Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from ..constants import PAYMENT_HTTP_GET_RETRIES, PAYMENT_HTTP_POOL_SIZE, PAYMENT_HTTP_TIMEOUT
+from ..metrics import PAYMENT_GATEWAY_REQUEST_SECONDS
+from ..services.circuit import get_breaker
+
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def _new_session() -> requests.Session:
+    retry = Retry(
+        total=PAYMENT_HTTP_GET_RETRIES,
+        backoff_factor=0.2,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=PAYMENT_HTTP_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(provider: str) -> requests.Session:
+    session = _sessions.get(provider)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(provider)
+            if session is None:
+                session = _sessions[provider] = _new_session()
+    return session
+
+
+def close_sessions() -> None:
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def gateway_request(provider: str, operation: str, method: str, url: str, **kwargs) -> requests.Response:
+    """Send one gateway request through the provider's pooled session."""
+    kwargs.setdefault("timeout", PAYMENT_HTTP_TIMEOUT)
+    started = time.perf_counter()
+    try:
+        with get_breaker(f"payment:{provider}:{operation}").guard() as call:
+            response = get_session(provider).request(method, url, **kwargs)
+            if response.status_code >= 500:
+                call.failed()
+            return response
+    finally:
+        PAYMENT_GATEWAY_REQUEST_SECONDS.labels(provider=provider, operation=operation).observe(
+            time.perf_counter() - started
+        )
+
+
+# Event loop -> provider -> client. httpx clients cannot be shared across
+# loops; entries go away with their loop.
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, object]]" = weakref.WeakKeyDictionary()
+
+
+def get_async_client(provider: str):
+    import httpx
+
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(provider)
+    if client is None or client.is_closed:
+        connect, read = PAYMENT_HTTP_TIMEOUT
+        client = clients[provider] = httpx.AsyncClient(
+            timeout=httpx.Timeout(read, connect=connect),
+            limits=httpx.Limits(max_connections=PAYMENT_HTTP_POOL_SIZE, max_keepalive_connections=PAYMENT_HTTP_POOL_SIZE),
+            # Transport retries only cover failed connects, so they are safe for POSTs too.
+            transport=httpx.AsyncHTTPTransport(retries=PAYMENT_HTTP_GET_RETRIES),
+        )
+    return client
+
+
+async def aclose_async_clients() -> None:
+    """Close the running loop's clients; call before a per-request loop (WSGI) ends."""
+    clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.aclose()
+
+
+async def agateway_request(provider: str, operation: str, method: str, url: str, **kwargs):
+    """Async ``gateway_request``; returns an ``httpx.Response``."""
+    started = time.perf_counter()
+    try:
+        with get_breaker(f"payment:{provider}:{operation}").guard() as call:
+            response = await get_async_client(provider).request(method, url, **kwargs)
+            if response.status_code >= 500:
+                call.failed()
+            return response
+    finally:
+        PAYMENT_GATEWAY_REQUEST_SECONDS.labels(provider=provider, operation=operation).observe(
+            time.perf_counter() - started
+        )
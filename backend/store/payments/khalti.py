@@ -3,11 +3,10 @@ from __future__ import annotations
 import uuid
 import os
 from decimal import Decimal
+from collections.abc import Mapping
 from typing import Any, Dict, Tuple
 
-import requests
-
-from .base import PaymentGateway
+from .base import InvalidReturn, InvalidSignature, PaymentGateway, RawBody, ReturnCheck, signature_matches
 
 
 class KhaltiGateway(PaymentGateway):
@@ -48,7 +47,7 @@ class KhaltiGateway(PaymentGateway):
                     "purchase_order_id": str(order.id),
                     "purchase_order_name": f"Order {order.id}",
                 }
-                resp = requests.post(self.INITIATE_URL, json=payload, headers=self._headers(), timeout=20)
+                resp = self._request("initiate", "POST", self.INITIATE_URL, json=payload, headers=self._headers())
                 if resp.status_code in (200, 201):
                     data = resp.json()
                     pidx = data.get("pidx") or data.get("provider_payment_id") or uuid.uuid4().hex
@@ -75,33 +74,25 @@ class KhaltiGateway(PaymentGateway):
             "return_url": return_url,
         }
 
-    def verify_webhook(self, payload: Dict[str, Any], headers: Dict[str, Any]) -> Tuple[bool, Dict[str, Any]]:
+    def check_webhook_signature(self, headers: Mapping[str, Any], raw_body: RawBody) -> bool:
+        # A signature, when sent, must match the raw body; nothing is decoded before that.
+        signature = headers.get("X-Khalti-Signature")
+        signature_valid = bool(self.SECRET_KEY and signature) and signature_matches(self.SECRET_KEY, raw_body, signature)
+        if self.SECRET_KEY and signature and not signature_valid:
+            raise InvalidSignature(self.key)
+        return signature_valid
+
+    def verify_webhook(
+        self, payload: Mapping[str, Any], headers: Mapping[str, Any], raw_body: RawBody = b""
+    ) -> Tuple[bool, Dict[str, Any]]:
+        signature = headers.get("X-Khalti-Signature")
+        signature_valid = self.check_webhook_signature(headers, raw_body)
+
         # Support both classic token verification and newer pidx lookup flows.
         status = (payload.get("status") or "").lower()
         token = payload.get("token")
         pidx = payload.get("pidx")
         provider_payment_id = payload.get("provider_payment_id") or pidx or token
-        
-        # Verify signature if present in headers
-        signature_valid = False
-        if self.SECRET_KEY and "X-Khalti-Signature" in headers:
-            try:
-                # Verify HMAC signature using SHA256
-                raw_payload = str(payload)
-                expected_signature = hmac.new(
-                    self.SECRET_KEY.encode(),
-                    raw_payload.encode(),
-                    hashlib.sha256
-                ).hexdigest()
-                received_signature = headers.get("X-Khalti-Signature")
-                signature_valid = hmac.compare_digest(expected_signature, received_signature)
-                
-                # If signature is present but invalid, reject the webhook
-                if not signature_valid:
-                    return False, {"status": "invalid_signature", "provider_payment_id": provider_payment_id}
-            except Exception:
-                # If signature verification fails, continue with API verification
-                pass
 
         ok = False
         response_data = {}
@@ -118,11 +109,12 @@ class KhaltiGateway(PaymentGateway):
                         except Exception:
                             paisa = None
                     if paisa is not None:
-                        resp = requests.post(
+                        resp = self._request(
+                            "verify",
+                            "POST",
                             self.VERIFY_URL,
                             json={"token": token, "amount": paisa},
                             headers=self._headers(),
-                            timeout=20,
                         )
                         ok = resp.status_code in (200, 201)
                         if ok:
@@ -132,7 +124,7 @@ class KhaltiGateway(PaymentGateway):
                                 response_data = {}
                 elif pidx:
                     # Lookup using pidx (ePayment)
-                    resp = requests.post(self.LOOKUP_URL, json={"pidx": pidx}, headers=self._headers(), timeout=20)
+                    resp = self._request("lookup", "POST", self.LOOKUP_URL, json={"pidx": pidx}, headers=self._headers())
                     if resp.status_code in (200, 201):
                         try:
                             response_data = resp.json()
@@ -146,7 +138,7 @@ class KhaltiGateway(PaymentGateway):
 
         # Fallback: trust webhook-reported status when API verification isn't possible
         # Only if signature is valid or we couldn't verify the signature
-        if not ok and (signature_valid or "X-Khalti-Signature" not in headers):
+        if not ok and (signature_valid or not signature):
             ok = status in ("success", "succeeded", "paid") and bool(provider_payment_id)
 
         result = {
@@ -161,10 +153,43 @@ class KhaltiGateway(PaymentGateway):
             
         return ok, result
 
+    def return_check(self, order, params, payment=None) -> ReturnCheck:
+        # Classic token verification: POST token + amount (in paisa)
+        token = params.get("token")
+        if not token:
+            raise InvalidReturn("token required for khalti verify")
+        try:
+            paisa = int(Decimal(params.get("amount") or str(order.total_amount)) * 100)
+        except Exception:
+            paisa = int(order.total_amount * 100)
+        return ReturnCheck(
+            method="POST",
+            url=self.VERIFY_URL,
+            kwargs={"json": {"token": token, "amount": paisa}, "headers": self._headers()},
+            provider_payment_id=token,
+        )
+
     def handle_refund(self, order, amount):
         return {"status": "refunded", "reference": f"khalti_ref_{order.id}"}
 
+    # ePayment lookup states that are final, mapped onto the poller's vocabulary.
+    LOOKUP_STATUSES = {
+        "completed": "succeeded",
+        "refunded": "refunded",
+        "partially refunded": "refunded",
+        "expired": "expired",
+        "user canceled": "canceled",
+    }
+
     def fetch_payment_status(self, provider_payment_id: str) -> Dict[str, Any]:
-        # For local/testing, infer a success prefix; in real usage, prefer LOOKUP API
-        status = "succeeded" if str(provider_payment_id).startswith("khalti_ok_") else "processing"
-        return {"status": status}
+        if not self.SECRET_KEY:
+            # Local/testing without credentials: infer from a success prefix
+            status = "succeeded" if str(provider_payment_id).startswith("khalti_ok_") else "processing"
+            return {"status": status}
+        resp = self._request(
+            "lookup", "POST", self.LOOKUP_URL, json={"pidx": provider_payment_id}, headers=self._headers()
+        )
+        resp.raise_for_status()
+        data = resp.json()
+        state = str(data.get("status") or "").lower()
+        return {"status": self.LOOKUP_STATUSES.get(state, "processing"), "raw": data}
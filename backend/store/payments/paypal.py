@@ -2,13 +2,14 @@ from __future__ import annotations
 
 import os
 from decimal import Decimal
+from collections.abc import Mapping
 from typing import Any, Dict, Tuple
 
 from paypalcheckoutsdk.core import PayPalHttpClient, SandboxEnvironment, LiveEnvironment
 from paypalcheckoutsdk.orders import OrdersCreateRequest, OrdersGetRequest, OrdersCaptureRequest
 from paypalcheckoutsdk.notifications import VerifyWebhookSignatureRequest
 
-from .base import PaymentGateway
+from .base import InvalidSignature, PaymentGateway, RawBody
 
 
 class PayPalGateway(PaymentGateway):
@@ -64,9 +65,19 @@ class PayPalGateway(PaymentGateway):
         request.prefer("return=representation")
         return self.client.execute(request)
 
-    def verify_webhook(self, payload: Dict[str, Any], headers: Dict[str, Any]) -> Tuple[bool, Dict[str, Any]]:
+    def check_webhook_signature(self, headers: Mapping[str, Any], raw_body: RawBody) -> bool:
+        # PayPal verifies the decoded event remotely; unsigned requests are
+        # turned away before the body is decoded or PayPal is called.
+        if self.webhook_id and not (headers.get("PAYPAL-TRANSMISSION-SIG") and headers.get("PAYPAL-TRANSMISSION-ID")):
+            raise InvalidSignature(self.key)
+        return False
+
+    def verify_webhook(
+        self, payload: Mapping[str, Any], headers: Mapping[str, Any], raw_body: RawBody = b""
+    ) -> Tuple[bool, Dict[str, Any]]:
         if not self.webhook_id:
             return False, {"status": "webhook_not_configured"}
+        self.check_webhook_signature(headers, raw_body)
         body = {
             "auth_algo": headers.get("PAYPAL-AUTH-ALGO"),
             "cert_url": headers.get("PAYPAL-CERT-URL"),
@@ -74,7 +85,7 @@ class PayPalGateway(PaymentGateway):
             "transmission_sig": headers.get("PAYPAL-TRANSMISSION-SIG"),
             "transmission_time": headers.get("PAYPAL-TRANSMISSION-TIME"),
             "webhook_id": self.webhook_id,
-            "webhook_event": payload,
+            "webhook_event": dict(payload),
         }
         request = VerifyWebhookSignatureRequest()
         request.request_body(body)
@@ -83,7 +94,7 @@ class PayPalGateway(PaymentGateway):
         resource = payload.get("resource", {})
         provider_payment_id = resource.get("id") or payload.get("id")
         status = resource.get("status") or payload.get("event_type")
-        return ok, {"status": status, "provider_payment_id": provider_payment_id, "raw": payload}
+        return ok, {"status": status, "provider_payment_id": provider_payment_id, "raw": dict(payload)}
 
     def handle_refund(self, order, amount):
         raise NotImplementedError("Refund via PayPal is not yet implemented")
@@ -1,13 +1,13 @@
 from __future__ import annotations
 
-import json
 import os
+from collections.abc import Mapping
 from decimal import Decimal
-from typing import Any, Dict, Tuple
+from typing import Any, Dict, Optional, Tuple
 
 import stripe
 
-from .base import PaymentGateway
+from .base import InvalidSignature, PaymentGateway, RawBody
 
 
 class StripeGateway(PaymentGateway):
@@ -27,6 +27,7 @@ class StripeGateway(PaymentGateway):
             currency=os.environ.get("STRIPE_CURRENCY", "usd"),
             metadata={"order_id": order.id},
             receipt_email=order.user.email,
+            idempotency_key=kwargs.get("idempotency_key"),
         )
         return {
             "provider_payment_id": intent.id,
@@ -34,25 +35,46 @@ class StripeGateway(PaymentGateway):
             "payment_url": intent.next_action.get("redirect_to_url", {}).get("url") if intent.next_action else None,
         }
 
-    def verify_webhook(self, payload: Dict[str, Any], headers: Dict[str, Any]) -> Tuple[bool, Dict[str, Any]]:
+    def _construct_event(self, headers: Mapping[str, Any], raw_body: RawBody):
         signature = headers.get("Stripe-Signature")
-        if not self.webhook_secret or not signature:
-            return False, {"status": "missing_signature"}
-        raw_body = headers.get("X-Raw-Body") or json.dumps(payload)
+        if not signature or not raw_body:
+            raise InvalidSignature(self.key)
         try:
-            event = stripe.Webhook.construct_event(
-                payload=raw_body,
+            return stripe.Webhook.construct_event(
+                payload=raw_body if isinstance(raw_body, bytes) else bytes(raw_body),
                 sig_header=signature,
                 secret=self.webhook_secret,
             )
         except stripe.error.SignatureVerificationError:
-            return False, {"status": "invalid_signature"}
+            raise InvalidSignature(self.key)
 
-        data = event["data"]["object"]
+    def check_webhook_signature(self, headers: Mapping[str, Any], raw_body: RawBody) -> bool:
+        if not self.webhook_secret:
+            return False
+        self._construct_event(headers, raw_body)
+        return True
+
+    def webhook_order_id(self, payload: Mapping[str, Any]) -> Optional[Any]:
+        data = (payload.get("data") or {}).get("object") or {}
+        return (data.get("metadata") or {}).get("order_id") or payload.get("order_id")
+
+    def verify_webhook(
+        self, payload: Mapping[str, Any], headers: Mapping[str, Any], raw_body: RawBody = b""
+    ) -> Tuple[bool, Dict[str, Any]]:
+        # Stripe signs every event: the signature is checked against the raw
+        # body and the event is decoded from it, so ``payload`` is never read.
+        if not self.webhook_secret:
+            return False, {"status": "webhook_not_configured"}
+        data = self._construct_event(headers, raw_body)["data"]["object"]
         status = data.get("status")
         provider_payment_id = data.get("id")
         ok = status in ("succeeded", "paid")
-        normalized = {"status": status, "provider_payment_id": provider_payment_id, "raw": data}
+        normalized = {
+            "status": status,
+            "provider_payment_id": provider_payment_id,
+            "order_id": (data.get("metadata") or {}).get("order_id"),
+            "raw": data,
+        }
         return ok, normalized
 
     def handle_refund(self, order, amount):
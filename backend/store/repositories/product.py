@@ -7,7 +7,9 @@ from __future__ import annotations
 
 from django.db.models import Avg, F, IntegerField, QuerySet
 from django.db.models.functions import Coalesce
-from ..models import Product
+from ..models import Product, ProductCoPurchase
+
+PRODUCT_COLUMNS = frozenset(field.name for field in Product._meta.concrete_fields)
 
 
 class ProductRepository:
@@ -31,6 +33,41 @@ class ProductRepository:
             )
         )
 
+    @staticmethod
+    def get_listing_queryset(fields: set[str]) -> QuerySet[Product]:
+        """Return active products loading only what ``fields`` renders.
+
+        Args:
+            fields: ``ProductSerializer`` field names that will be serialized.
+
+        Returns:
+            QuerySet[Product]: Same filtering and annotations as
+            ``get_active_products_queryset`` but restricted with ``only()``;
+            category/size guide/supplier joins and the variants prefetch are
+            added only when the matching field is requested.
+        """
+        columns = {"id"}
+        related = []
+        for name in fields:
+            if name in ("category", "size_guide"):
+                # CategorySerializer.size_guide_available reads the reverse one-to-one.
+                columns.add("category")
+                related += ["category", "category__size_guide"]
+            elif name == "supplier":
+                columns.add("supplier")
+                related.append("supplier")
+            elif name in PRODUCT_COLUMNS:
+                columns.add(name)
+        qs = Product.objects.filter(is_deleted=False, active=True)
+        if related:
+            qs = qs.select_related(*related)
+        if "variants" in fields:
+            qs = qs.prefetch_related("variants")
+        return qs.only(*columns).annotate(
+            avg_rating=Avg("reviews__rating"),
+            stock_qty=Coalesce(F("inventory__quantity"), 0, output_field=IntegerField()),
+        )
+
     @staticmethod
     def get_by_slug(slug: str) -> Product:
         """Fetch a single product by slug.
@@ -43,6 +80,23 @@ class ProductRepository:
         """
         return Product.objects.select_related("category", "supplier").get(slug=slug)
 
+    @staticmethod
+    def copurchased_product_ids(product_id: int, limit: int = 8) -> list[int]:
+        """Return ids of products most often bought together with ``product_id``.
+
+        Args:
+            product_id: Product to look up neighbours for.
+            limit: Max neighbours, strongest first.
+
+        Returns:
+            List of related product ids from the precomputed co-purchase table.
+        """
+        return list(
+            ProductCoPurchase.objects.filter(product_id=product_id)
+            .order_by("-count")
+            .values_list("related_id", flat=True)[:limit]
+        )
+
     @staticmethod
     def search_titles_and_skus(query: str, limit: int = 10) -> list[str]:
         """Return a list of suggestions by title and SKU.
@@ -17,6 +17,7 @@ from .api import (
     AdminContentPageViewSet,
     AdminUserViewSet,
     AdminActionLogViewSet,
+    AdminRefundJobViewSet,
     AdminMetricsView,
     AdminLowStockView,
     WishlistViewSet,
@@ -27,9 +28,11 @@ from .api import (
     CartSaveForLaterView,
     CartClearView,
     CheckoutView,
+    CheckoutIntentRetryView,
     OrderTrackingView,
     PaymentsWebhookView,
     PaymentsVerifyView,
+    PaymentsReturnView,
     PaymentRefundView,
     SearchSuggestionsView,
     HealthView,
@@ -63,6 +66,7 @@ admin_router.register(r"bundles", AdminBundleViewSet, basename="admin-bundles")
 admin_router.register(r"pages", AdminContentPageViewSet, basename="admin-pages")
 admin_router.register(r"users", AdminUserViewSet, basename="admin-users")
 admin_router.register(r"logs", AdminActionLogViewSet, basename="admin-logs")
+admin_router.register(r"refund-jobs", AdminRefundJobViewSet, basename="admin-refund-jobs")
 
 
 api_urlpatterns = [
@@ -75,9 +79,15 @@ api_urlpatterns = [
     path("cart/save-for-later/", CartSaveForLaterView.as_view(), name="cart-save-for-later"),
     path("cart/clear/", CartClearView.as_view(), name="cart-clear"),
     path("checkout/", CheckoutView.as_view(), name="checkout"),
+    path(
+        "checkout/<int:order_id>/payment-intent/",
+        CheckoutIntentRetryView.as_view(),
+        name="checkout-intent-retry",
+    ),
     path("order-tracking/", OrderTrackingView.as_view(), name="order-track"),
     path("payments/webhook/", PaymentsWebhookView.as_view(), name="payments-webhook"),
     path("payments/verify/", PaymentsVerifyView.as_view(), name="payments-verify"),
+    path("payments/return/", PaymentsReturnView.as_view(), name="payments-return"),
     path("search/suggestions/", SearchSuggestionsView.as_view(), name="search-suggestions"),
     path("health/", HealthView.as_view(), name="health"),
     path("auth/register/", RegisterView.as_view(), name="auth-register"),
@@ -24,11 +24,33 @@ from .models import (
     SizeGuide,
     ContentPage,
     AdminActionLog,
+    RefundJob,
+    RefundJobItem,
 )
+from .constants import REFUND_JOB_MAX_ORDERS
+
+
+def _is_set(value) -> bool:
+    return value is not None
+
+
+def urgency_copy_for_stock(qty) -> str | None:
+    if qty is None:
+        return None
+    if qty <= 0:
+        return "Out of stock"
+    threshold = 5
+    if qty <= threshold:
+        return f"Only {qty} left in stock"
+    if qty <= threshold * 2:
+        return "Selling fast"
+    return None
 
 
 class CategorySerializer(serializers.ModelSerializer):
     size_guide_available = serializers.SerializerMethodField()
+    # Row-level equivalents of method fields for store.compiled_serializers.
+    compiled_resolvers = {"size_guide_available": (("size_guide__id",), _is_set)}
 
     class Meta:
         model = Category
@@ -80,6 +102,7 @@ class ProductSerializer(serializers.ModelSerializer):
     variants = ProductVariantSerializer(many=True, read_only=True)
     size_guide = SizeGuideSerializer(source="category.size_guide", read_only=True)
     urgency_copy = serializers.SerializerMethodField()
+    compiled_resolvers = {"urgency_copy": (("stock_qty",), urgency_copy_for_stock)}
 
     class Meta:
         model = Product
@@ -111,17 +134,48 @@ class ProductSerializer(serializers.ModelSerializer):
         ]
 
     def get_urgency_copy(self, obj) -> str | None:
-        qty = getattr(obj, "stock_qty", None)
-        if qty is None:
-            return None
-        if qty <= 0:
-            return "Out of stock"
-        threshold = 5
-        if qty <= threshold:
-            return f"Only {qty} left in stock"
-        if qty <= threshold * 2:
-            return "Selling fast"
-        return None
+        return urgency_copy_for_stock(getattr(obj, "stock_qty", None))
+
+
+class ProductListSerializer(ProductSerializer):
+    """Listing-card representation with sparse fieldsets.
+
+    Renders ``CARD_FIELDS`` by default. ``?fields=a,b`` replaces that set and
+    ``?expand=category,variants`` adds heavier fields on top of it; names that
+    ``ProductSerializer`` does not know are ignored.
+    """
+
+    CARD_FIELDS = (
+        "id",
+        "title",
+        "slug",
+        "base_price",
+        "sku",
+        "images",
+        "brand",
+        "avg_rating",
+        "stock_qty",
+        "urgency_copy",
+    )
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop("fields", None)
+        super().__init__(*args, **kwargs)
+        if fields is None:
+            request = self.context.get("request")
+            fields = self.selected_fields(request.query_params if request else {})
+        for name in set(self.fields) - set(fields):
+            self.fields.pop(name)
+
+    @classmethod
+    def selected_fields(cls, params) -> set[str]:
+        def _split(value):
+            return {part.strip() for part in (value or "").split(",") if part.strip()}
+
+        requested = _split(params.get("fields")) or set(cls.CARD_FIELDS)
+        requested |= _split(params.get("expand"))
+        requested.add("id")
+        return requested & set(ProductSerializer.Meta.fields)
 
 
 class ProductWriteSerializer(serializers.ModelSerializer):
@@ -436,6 +490,50 @@ class AdminActionLogSerializer(serializers.ModelSerializer):
         read_only_fields = fields
 
 
+class RefundJobCreateSerializer(serializers.Serializer):
+    order_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=REFUND_JOB_MAX_ORDERS
+    )
+    reason = serializers.CharField(max_length=255, required=False, allow_blank=True, default="")
+
+    def validate_order_ids(self, value: List[int]) -> List[int]:
+        ids = list(dict.fromkeys(value))
+        missing = set(ids) - set(Order.objects.filter(pk__in=ids).values_list("pk", flat=True))
+        if missing:
+            raise serializers.ValidationError(f"Unknown order ids: {', '.join(map(str, sorted(missing)))}")
+        return ids
+
+
+class RefundJobItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RefundJobItem
+        fields = ["id", "order", "payment", "provider", "amount", "status", "error", "processed_at"]
+        read_only_fields = fields
+
+
+class RefundJobSerializer(serializers.ModelSerializer):
+    created_by_email = serializers.EmailField(source="created_by.email", read_only=True)
+    progress = serializers.SerializerMethodField()
+
+    class Meta:
+        model = RefundJob
+        fields = ["id", "status", "reason", "created_by_email", "created_at", "started_at", "finished_at", "progress"]
+        read_only_fields = fields
+
+    def get_progress(self, obj: RefundJob) -> dict:
+        from .services.refunds import refund_job_progress
+
+        return refund_job_progress(obj)
+
+
+class RefundJobDetailSerializer(RefundJobSerializer):
+    items = RefundJobItemSerializer(many=True, read_only=True)
+
+    class Meta(RefundJobSerializer.Meta):
+        fields = RefundJobSerializer.Meta.fields + ["items"]
+        read_only_fields = fields
+
+
 class RegisterSerializer(serializers.ModelSerializer):
     email = serializers.EmailField(validators=[UniqueValidator(queryset=User.objects.all(), message="Email already registered")])
     password = serializers.CharField(write_only=True, min_length=6)
@@ -7,7 +7,7 @@ from typing import Any
 from store.models import AdminActionLog
 
 
-def record_admin_action(
+def build_admin_action(
     *,
     actor,
     request,
@@ -17,10 +17,10 @@ def record_admin_action(
     changes: Mapping[str, Any] | None = None,
     metadata: Mapping[str, Any] | None = None,
     status: str = AdminActionLog.Status.SUCCESS,
-) -> None:
-    """Persist an immutable admin audit trail entry."""
+) -> AdminActionLog:
+    """An unsaved audit entry; see ``record_admin_actions`` for writing many at once."""
 
-    AdminActionLog.objects.create(
+    return AdminActionLog(
         actor=actor if getattr(actor, "is_authenticated", False) else None,
         resource=resource,
         action=action,
@@ -32,6 +32,37 @@ def record_admin_action(
     )
 
 
+def record_admin_action(
+    *,
+    actor,
+    request,
+    resource: str,
+    action: str,
+    object_pk: str | None = None,
+    changes: Mapping[str, Any] | None = None,
+    metadata: Mapping[str, Any] | None = None,
+    status: str = AdminActionLog.Status.SUCCESS,
+) -> None:
+    """Persist an immutable admin audit trail entry."""
+
+    build_admin_action(
+        actor=actor,
+        request=request,
+        resource=resource,
+        action=action,
+        object_pk=object_pk,
+        changes=changes,
+        metadata=metadata,
+        status=status,
+    ).save()
+
+
+def record_admin_actions(entries: Sequence[AdminActionLog]) -> None:
+    """Persist entries from ``build_admin_action`` with one bulk insert."""
+
+    AdminActionLog.objects.bulk_create(entries)
+
+
 def _extract_ip(request) -> str | None:
     if not request:
         return None
@@ -1,52 +1,353 @@
 """Cart service layer.
 
-Encapsulates cart read/write operations (guest + user) via cache and cookie.
-Keeping the same public API shape originally used in views for compatibility.
+Encapsulates cart read/write operations (guest + user) keyed by user id or
+cart cookie. Carts live in a ``CartStore``: Redis hashes (one field per
+product, updated with ``HINCRBY``/``HSET``/``HDEL``; small hashes use Redis'
+packed listpack encoding) when ``CART_REDIS_URL`` is configured, otherwise
+the Django cache (locmem in tests/dev) holding packed id/quantity arrays.
+Guest keys are minted on the first write only, so anonymous reads create
+nothing. Keeping the same public API shape originally used in views for
+compatibility.
 """
 from __future__ import annotations
 
-from typing import Dict
+import threading
+from array import array
+from typing import Any, Dict, Iterable, Optional
+
+from django.conf import settings
 from django.core.cache import cache
-from ..constants import CART_CACHE_PREFIX, CART_COOKIE_NAME, CART_TTL_SECONDS
+from django.db.models import F
+
+from ..constants import (
+    CART_CACHE_PREFIX,
+    CART_COOKIE_MAX_AGE,
+    CART_COOKIE_NAME,
+    CART_GUEST_PREFIX,
+    CART_GUEST_TTL_SECONDS,
+    CART_TTL_SECONDS,
+)
+from ..models import Product
+
+# Sums guest cart quantities into the user cart and adds guest saved-for-later
+# lines the user does not already have, then drops the guest keys.
+# KEYS: guest cart, user cart, guest saved, user saved. ARGV: ttl seconds.
+MERGE_SCRIPT = """
+local function merge(src, dst, add)
+    local fields = redis.call('HGETALL', src)
+    for i = 1, #fields, 2 do
+        if add then
+            redis.call('HINCRBY', dst, fields[i], fields[i + 1])
+        else
+            redis.call('HSETNX', dst, fields[i], fields[i + 1])
+        end
+    end
+    redis.call('DEL', src)
+    if redis.call('EXISTS', dst) == 1 then
+        redis.call('EXPIRE', dst, ARGV[1])
+    end
+end
+merge(KEYS[1], KEYS[2], true)
+merge(KEYS[3], KEYS[4], false)
+return redis.call('HGETALL', KEYS[2])
+"""
+
+
+SAVED_SUFFIX = ":saved"
+
+
+def cart_kind(key: str) -> str:
+    """Classify a cart key as ``guest``/``user``, with ``_saved`` for saved-for-later lists."""
+    owner = "guest" if key.startswith(CART_CACHE_PREFIX + CART_GUEST_PREFIX) else "user"
+    return f"{owner}_saved" if key.endswith(SAVED_SUFFIX) else owner
+
+
+def cart_ttl(key: str) -> int:
+    return CART_GUEST_TTL_SECONDS if cart_kind(key).startswith("guest") else CART_TTL_SECONDS
+
+
+def pack_cart(data: Dict[int, int]) -> bytes:
+    """Encode a cart as one flat int64 array of id/quantity pairs."""
+    flat = array("q")
+    for product_id, quantity in data.items():
+        flat.append(product_id)
+        flat.append(quantity)
+    return flat.tobytes()
+
+
+def unpack_cart(raw) -> Dict[int, int]:
+    if not raw:
+        return {}
+    if isinstance(raw, dict):
+        # Entries written before carts were packed.
+        return {int(pid): int(qty) for pid, qty in raw.items()}
+    flat = array("q")
+    flat.frombytes(raw)
+    return dict(zip(flat[::2], flat[1::2]))
+
+
+class RedisCartStore:
+    """Carts as Redis hashes; every write is one pipelined round trip with a TTL refresh."""
+
+    def __init__(self, client):
+        self.client = client
+        self._merge = client.register_script(MERGE_SCRIPT)
+
+    @staticmethod
+    def _decode(raw) -> Dict[int, int]:
+        return {int(pid): int(qty) for pid, qty in raw.items()}
+
+    def get(self, key: str) -> Dict[int, int]:
+        return self._decode(self.client.hgetall(key))
+
+    def replace(self, key: str, data: Dict[int, int]) -> None:
+        pipe = self.client.pipeline()
+        pipe.delete(key)
+        if data:
+            pipe.hset(key, mapping=data)
+            pipe.expire(key, cart_ttl(key))
+        pipe.execute()
+
+    def incr(self, key: str, product_id: int, quantity: int) -> int:
+        pipe = self.client.pipeline()
+        pipe.hincrby(key, product_id, quantity)
+        pipe.expire(key, cart_ttl(key))
+        return int(pipe.execute()[0])
+
+    def set_quantity(self, key: str, product_id: int, quantity: int) -> None:
+        pipe = self.client.pipeline()
+        pipe.hset(key, product_id, quantity)
+        pipe.expire(key, cart_ttl(key))
+        pipe.execute()
+
+    def remove(self, key: str, *product_ids: int) -> None:
+        if product_ids:
+            self.client.hdel(key, *product_ids)
+
+    def delete(self, key: str) -> None:
+        self.client.delete(key)
+
+    def merge(self, guest_key: str, user_key: str, guest_saved_key: str, user_saved_key: str) -> Dict[int, int]:
+        raw = self._merge(keys=[guest_key, user_key, guest_saved_key, user_saved_key], args=[CART_TTL_SECONDS])
+        return self._decode(dict(zip(raw[::2], raw[1::2])))
+
+    def sweep(self, batch_size: int = 1000) -> Dict[str, Dict[str, int]]:
+        """Measure live carts per kind and give any key without a TTL its expiry.
+
+        Uses ``SCAN`` so Redis is never blocked; TTL and ``MEMORY USAGE`` are
+        fetched in one pipeline per batch.
+        """
+        stats: Dict[str, Dict[str, int]] = {}
+        batch = []
+        for key in self.client.scan_iter(match=f"{CART_CACHE_PREFIX}*", count=batch_size):
+            batch.append(key.decode() if isinstance(key, bytes) else key)
+            if len(batch) >= batch_size:
+                self._sweep_batch(batch, stats)
+                batch = []
+        if batch:
+            self._sweep_batch(batch, stats)
+        return stats
+
+    def _sweep_batch(self, keys, stats) -> None:
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.ttl(key)
+            pipe.memory_usage(key)
+        results = pipe.execute()
+        fix = self.client.pipeline(transaction=False)
+        for key, ttl, size in zip(keys, results[::2], results[1::2]):
+            if ttl == -2:
+                continue  # expired between SCAN and TTL
+            kind = stats.setdefault(cart_kind(key), {"keys": 0, "bytes": 0, "ttl_fixed": 0})
+            kind["keys"] += 1
+            kind["bytes"] += size or 0
+            if ttl == -1:
+                fix.expire(key, cart_ttl(key))
+                kind["ttl_fixed"] += 1
+        fix.execute()
+
+
+class CacheCartStore:
+    """Fallback for tests/dev: whole carts in the Django cache as packed arrays.
+
+    A process-wide lock keeps read-modify-write updates atomic, which is
+    sufficient for locmem; use ``RedisCartStore`` across processes.
+    """
+
+    _lock = threading.RLock()
+
+    def get(self, key: str) -> Dict[int, int]:
+        return unpack_cart(cache.get(key))
+
+    def replace(self, key: str, data: Dict[int, int]) -> None:
+        if data:
+            cache.set(key, pack_cart(data), timeout=cart_ttl(key))
+        else:
+            cache.delete(key)
+
+    def incr(self, key: str, product_id: int, quantity: int) -> int:
+        with self._lock:
+            data = self.get(key)
+            data[product_id] = data.get(product_id, 0) + quantity
+            self.replace(key, data)
+            return data[product_id]
+
+    def set_quantity(self, key: str, product_id: int, quantity: int) -> None:
+        with self._lock:
+            data = self.get(key)
+            data[product_id] = quantity
+            self.replace(key, data)
+
+    def remove(self, key: str, *product_ids: int) -> None:
+        with self._lock:
+            data = self.get(key)
+            for product_id in product_ids:
+                data.pop(product_id, None)
+            self.replace(key, data)
+
+    def delete(self, key: str) -> None:
+        cache.delete(key)
+
+    def merge(self, guest_key: str, user_key: str, guest_saved_key: str, user_saved_key: str) -> Dict[int, int]:
+        with self._lock:
+            merged = self.get(user_key)
+            for product_id, quantity in self.get(guest_key).items():
+                merged[product_id] = merged.get(product_id, 0) + quantity
+            self.replace(user_key, merged)
+            self.replace(user_saved_key, {**self.get(guest_saved_key), **self.get(user_saved_key)})
+            cache.delete_many([guest_key, guest_saved_key])
+            return merged
+
+    def sweep(self, batch_size: int = 1000) -> Dict[str, Dict[str, int]]:
+        """The Django cache cannot be enumerated; its entries expire by TTL."""
+        return {}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_cart_store():
+    """Return the process-wide cart store for the configured backend."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                url = getattr(settings, "CART_REDIS_URL", None)
+                if url:
+                    import redis
+
+                    _store = RedisCartStore(redis.Redis.from_url(url))
+                else:
+                    _store = CacheCartStore()
+    return _store
 
 
 class CartService:
     COOKIE_NAME = CART_COOKIE_NAME
 
     @classmethod
-    def _key(cls, request) -> str:
+    def _key(cls, request, create: bool = False) -> Optional[str]:
+        """Store key for the request's cart.
+
+        Anonymous requests without a cart cookie only get a guest key when
+        ``create`` is set (i.e. on a write); otherwise None.
+        """
         if getattr(request, "user", None) and request.user.is_authenticated:
             return f"{CART_CACHE_PREFIX}user:{request.user.id}"
         cached = getattr(request, "_cart_cache_token", None)
         key = cached or request.COOKIES.get(cls.COOKIE_NAME) or request.headers.get("X-Cart-Key")
         if not key:
+            if not create:
+                return None
             from uuid import uuid4
 
-            key = f"guest:{uuid4().hex}"
+            key = f"{CART_GUEST_PREFIX}{uuid4().hex}"
         if not cached:
             setattr(request, "_cart_cache_token", key)
         return f"{CART_CACHE_PREFIX}{key}"
 
+    @classmethod
+    def guest_key(cls, cookie_key: str) -> str:
+        return f"{CART_CACHE_PREFIX}{cookie_key}"
+
     @classmethod
     def get(cls, request) -> Dict[int, int]:
-        data = cache.get(cls._key(request))
-        return data or {}
+        key = cls._key(request)
+        return get_cart_store().get(key) if key else {}
 
     @classmethod
     def set(cls, request, data: Dict[int, int]):
-        cache.set(cls._key(request), data, timeout=CART_TTL_SECONDS)
+        """Replace the whole cart. Prefer the per-line methods for updates."""
+        key = cls._key(request, create=bool(data))
+        if key:
+            get_cart_store().replace(key, data)
+
+    @classmethod
+    def add(cls, request, product_id: int, quantity: int) -> int:
+        """Atomically add ``quantity`` (may be negative) and return the new line quantity."""
+        return get_cart_store().incr(cls._key(request, create=True), product_id, quantity)
+
+    @classmethod
+    def set_quantity(cls, request, product_id: int, quantity: int):
+        get_cart_store().set_quantity(cls._key(request, create=True), product_id, quantity)
+
+    @classmethod
+    def remove(cls, request, *product_ids: int):
+        key = cls._key(request)
+        if key:
+            get_cart_store().remove(key, *product_ids)
 
     @classmethod
     def clear(cls, request):
+        key = cls._key(request)
+        if not key:
+            return
         try:
-            cache.delete(cls._key(request))
+            get_cart_store().delete(key)
         except Exception:
             pass
 
+    @classmethod
+    def merge_guest_into_user(cls, request, cookie_key: str) -> Dict[int, int]:
+        """Fold a guest cart and its saved-for-later list into the user's, in one round trip."""
+        guest = cls.guest_key(cookie_key)
+        return get_cart_store().merge(
+            guest,
+            cls._key(request),
+            guest + SavedCartService.SUFFIX,
+            SavedCartService._key(request),
+        )
+
+    @classmethod
+    def attach_cookie(cls, request, response):
+        """Give guests a durable cart cookie once a write has minted their cart key."""
+        token = getattr(request, "_cart_cache_token", None)
+        if token and not request.user.is_authenticated and cls.COOKIE_NAME not in request.COOKIES:
+            response.set_cookie(cls.COOKIE_NAME, token, max_age=CART_COOKIE_MAX_AGE)
+        return response
+
 
 class SavedCartService(CartService):
-    SUFFIX = ":saved"
+    SUFFIX = SAVED_SUFFIX
 
     @classmethod
-    def _key(cls, request) -> str:
-        return super()._key(request) + cls.SUFFIX
+    def _key(cls, request, create: bool = False) -> Optional[str]:
+        key = super()._key(request, create)
+        return key + cls.SUFFIX if key else None
+
+
+def hydrate_cart(product_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+    """Load purchasable products and their stock in a single query.
+
+    Returns a mapping of product id to ``id``/``sku``/``title``/``base_price``/
+    ``shipping_time_max_days``/``stock`` (``None`` when the product has no
+    inventory row). Inactive or deleted products are absent.
+    """
+    ids = set(product_ids)
+    if not ids:
+        return {}
+    rows = Product.objects.filter(id__in=ids, is_deleted=False, active=True).values(
+        "id", "sku", "title", "base_price", "shipping_time_max_days", stock=F("inventory__quantity")
+    )
+    return {row["id"]: row for row in rows}
@@ -0,0 +1,285 @@
+"""Circuit breakers for calls to payment providers and suppliers.
+
+Each breaker is named after the remote operation it guards (for example
+``payment:khalti:initiate`` or ``supplier:cj:place_order``). After
+``CIRCUIT_FAILURE_THRESHOLD`` failures within ``CIRCUIT_FAILURE_WINDOW_SECONDS``
+the breaker opens: calls fail at once with ``CircuitOpen`` instead of
+waiting on a timeout, so callers take their fallback immediately. Once
+``CIRCUIT_RESET_TIMEOUT_SECONDS`` have passed the breaker is half-open and
+exactly one caller (across all workers) is let through as a probe; its
+success closes the breaker, its failure opens it again.
+
+State lives in Redis when ``settings.CIRCUIT_REDIS_URL`` is set, so every
+worker sees the same breakers, and in the Django cache otherwise. A call to
+a closed breaker costs one read; writes happen only on failures and state
+changes. When the state store itself fails the breaker fails open: the call
+goes ahead as if the breaker were closed, so a Redis outage does not stop
+healthy providers from being called.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from ..constants import (
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_FAILURE_WINDOW_SECONDS,
+    CIRCUIT_PROBE_TIMEOUT_SECONDS,
+    CIRCUIT_RESET_TIMEOUT_SECONDS,
+)
+from ..metrics import CIRCUIT_REJECTED, CIRCUIT_STATE
+
+log = logging.getLogger(__name__)
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+_PREFIX = "circuit:"
+_NAMES_KEY = f"{_PREFIX}names"
+
+
+class CircuitOpen(Exception):
+    """The breaker for this operation is open; the remote call was not made."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit {name} is open")
+        self.name = name
+        self.retry_after = max(0.0, retry_after)
+
+
+class CacheCircuitState:
+    """Breaker state in the Django cache (per host unless the cache is shared)."""
+
+    def read(self, name: str) -> Tuple[int, float]:
+        values = cache.get_many([f"{_PREFIX}{name}:failures", f"{_PREFIX}{name}:open_until"])
+        return int(values.get(f"{_PREFIX}{name}:failures") or 0), float(values.get(f"{_PREFIX}{name}:open_until") or 0)
+
+    def add_failure(self, name: str, window: int) -> int:
+        key = f"{_PREFIX}{name}:failures"
+        if cache.add(key, 1, timeout=window):
+            return 1
+        try:
+            return cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=window)
+            return 1
+
+    def open(self, name: str, until: float) -> None:
+        cache.set(f"{_PREFIX}{name}:open_until", until, timeout=None)
+        cache.delete_many([f"{_PREFIX}{name}:failures", f"{_PREFIX}{name}:probe"])
+        names = cache.get(_NAMES_KEY) or []
+        if name not in names:
+            cache.set(_NAMES_KEY, [*names, name], timeout=None)
+
+    def reset(self, name: str) -> None:
+        cache.delete_many([f"{_PREFIX}{name}:{field}" for field in ("failures", "open_until", "probe")])
+
+    def claim_probe(self, name: str, ttl: int) -> bool:
+        return cache.add(f"{_PREFIX}{name}:probe", 1, timeout=ttl)
+
+    def names(self) -> List[str]:
+        return list(cache.get(_NAMES_KEY) or [])
+
+
+class RedisCircuitState:
+    """Breaker state in Redis: one hash per breaker plus a probe lock key."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def read(self, name: str) -> Tuple[int, float]:
+        failures, open_until = self.client.hmget(f"{_PREFIX}{name}", "failures", "open_until")
+        return int(failures or 0), float(open_until or 0)
+
+    def add_failure(self, name: str, window: int) -> int:
+        key = f"{_PREFIX}{name}"
+        failures = int(self.client.hincrby(key, "failures", 1))
+        if failures == 1:
+            # The window starts with the first failure after a quiet period.
+            self.client.expire(key, window)
+        return failures
+
+    def open(self, name: str, until: float) -> None:
+        key = f"{_PREFIX}{name}"
+        pipe = self.client.pipeline()
+        pipe.hset(key, mapping={"open_until": until, "failures": 0})
+        pipe.persist(key)
+        pipe.delete(f"{key}:probe")
+        pipe.sadd(_NAMES_KEY, name)
+        pipe.execute()
+
+    def reset(self, name: str) -> None:
+        self.client.delete(f"{_PREFIX}{name}", f"{_PREFIX}{name}:probe")
+
+    def claim_probe(self, name: str, ttl: int) -> bool:
+        return bool(self.client.set(f"{_PREFIX}{name}:probe", 1, nx=True, ex=ttl))
+
+    def names(self) -> List[str]:
+        return sorted(name.decode() if isinstance(name, bytes) else name for name in self.client.smembers(_NAMES_KEY))
+
+
+class _Call:
+    """Handed to the body of ``CircuitBreaker.guard``; ``failed()`` records a bad response."""
+
+    __slots__ = ("failure",)
+
+    def __init__(self):
+        self.failure = False
+
+    def failed(self) -> None:
+        self.failure = True
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        state,
+        threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        window: int = CIRCUIT_FAILURE_WINDOW_SECONDS,
+        reset_timeout: int = CIRCUIT_RESET_TIMEOUT_SECONDS,
+        probe_timeout: int = CIRCUIT_PROBE_TIMEOUT_SECONDS,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.name = name
+        self.state = state
+        self.threshold = threshold
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.probe_timeout = probe_timeout
+        # Wall-clock seconds; ``open_until`` is compared across processes.
+        self.clock = clock
+
+    def current_state(self) -> str:
+        _, open_until = self.state.read(self.name)
+        return self._state_of(open_until, self.clock())
+
+    @staticmethod
+    def _state_of(open_until: float, now: float) -> str:
+        if not open_until:
+            return CLOSED
+        return OPEN if now < open_until else HALF_OPEN
+
+    def _set_gauge(self, state: str) -> None:
+        CIRCUIT_STATE.labels(name=self.name).set(_STATE_VALUES[state])
+
+    def before_call(self) -> Tuple[bool, int]:
+        """Raise ``CircuitOpen`` unless the call may go ahead; returns ``(is_probe, failures)``."""
+        now = self.clock()
+        try:
+            failures, open_until = self.state.read(self.name)
+            state = self._state_of(open_until, now)
+            if state == CLOSED:
+                return False, failures
+            if state == HALF_OPEN and self.state.claim_probe(self.name, self.probe_timeout):
+                self._set_gauge(HALF_OPEN)
+                return True, failures
+        except Exception as exc:
+            log.warning("Circuit %s state unavailable, letting the call through: %s", self.name, exc)
+            return False, 0
+        self._set_gauge(state)
+        CIRCUIT_REJECTED.labels(name=self.name).inc()
+        raise CircuitOpen(self.name, open_until - now if state == OPEN else self.probe_timeout)
+
+    def record_success(self, probe: bool, failures: int) -> None:
+        try:
+            if probe or failures:
+                self.state.reset(self.name)
+        except Exception as exc:
+            log.warning("Circuit %s state unavailable, success not recorded: %s", self.name, exc)
+            return
+        if probe:
+            log.info("Circuit %s closed after a successful probe", self.name)
+            self._set_gauge(CLOSED)
+
+    def record_failure(self, probe: bool) -> None:
+        try:
+            if not probe and self.state.add_failure(self.name, self.window) < self.threshold:
+                return
+            self.state.open(self.name, self.clock() + self.reset_timeout)
+        except Exception as exc:
+            log.warning("Circuit %s state unavailable, failure not recorded: %s", self.name, exc)
+            return
+        log.warning("Circuit %s opened for %ss", self.name, self.reset_timeout)
+        self._set_gauge(OPEN)
+
+    @contextmanager
+    def guard(self) -> Iterator[_Call]:
+        """Run the body as one call through the breaker.
+
+        Raises ``CircuitOpen`` on entry when the call is not allowed. An
+        exception from the body counts as a failure, as does calling
+        ``failed()`` on the yielded object (e.g. for a 5xx response).
+        """
+        probe, failures = self.before_call()
+        call = _Call()
+        try:
+            yield call
+        except Exception:
+            self.record_failure(probe)
+            raise
+        if call.failure:
+            self.record_failure(probe)
+        else:
+            self.record_success(probe, failures)
+
+
+_state = None
+_breakers: Dict[str, CircuitBreaker] = {}
+_lock = threading.Lock()
+
+
+def get_circuit_state():
+    """Return the process-wide state backend for the configured store."""
+    global _state
+    if _state is None:
+        with _lock:
+            if _state is None:
+                url = getattr(settings, "CIRCUIT_REDIS_URL", None)
+                if url:
+                    import redis
+
+                    _state = RedisCircuitState(redis.Redis.from_url(url))
+                else:
+                    _state = CacheCircuitState()
+    return _state
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    breaker = _breakers.get(name)
+    if breaker is None:
+        state = get_circuit_state()
+        with _lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = _breakers[name] = CircuitBreaker(name, state)
+    return breaker
+
+
+def reset_breakers() -> None:
+    """Forget breakers and the state backend (tests)."""
+    global _state
+    with _lock:
+        _breakers.clear()
+        _state = None
+
+
+def circuit_states() -> Dict[str, str]:
+    """State of every breaker used in this process or opened by any worker.
+
+    Raises when the state store is unavailable.
+    """
+    names = set(_breakers) | set(get_circuit_state().names())
+    states = {}
+    for name in sorted(names):
+        breaker = get_breaker(name)
+        states[name] = breaker.current_state()
+        breaker._set_gauge(states[name])
+    return states
@@ -0,0 +1,146 @@
+"""Coupon redemption counters.
+
+``Coupon.redemption_count`` and ``CouponUserUsage.count`` mirror the
+``CouponRedemption`` rows so limit checks read one row instead of counting
+redemptions. Claims increment the counters with ``UPDATE ... WHERE count <
+limit``, which the database serialises per row, so concurrent checkouts
+cannot push a coupon past ``usage_limit`` or ``per_user_limit``.
+
+Checkout claims inside the order transaction; a cancelled order gives its
+claims back.
+
+Codes are matched case-insensitively on ``UPPER(code)``, which is indexed.
+``get_cached_coupon`` puts a small cache in front of that lookup for the
+validate endpoint, including short-lived entries for unknown codes; coupon
+writes invalidate it (see ``store.signals``).
+"""
+from __future__ import annotations
+
+from typing import Optional
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Upper
+
+from ..constants import COUPON_CACHE_TTL_SECONDS, COUPON_NEGATIVE_CACHE_TTL_SECONDS
+from ..models import Coupon, CouponRedemption, CouponUserUsage, Order
+
+_MISSING = "missing"
+
+
+class CouponLimitReached(Exception):
+    def __init__(self, coupon: Coupon, per_user: bool):
+        super().__init__(f"Coupon {coupon.code} {'per-user' if per_user else 'usage'} limit reached")
+        self.coupon = coupon
+        self.per_user = per_user
+
+
+def normalize_code(code: str) -> str:
+    return (code or "").strip().upper()
+
+
+def coupon_cache_key(code: str) -> str:
+    return f"coupon:code:{normalize_code(code)}"
+
+
+def find_coupon(code: str, **filters) -> Optional[Coupon]:
+    """Case-insensitive lookup that matches the ``UPPER(code)`` index."""
+    return (
+        Coupon.objects.annotate(code_upper=Upper("code"))
+        .filter(code_upper=normalize_code(code), **filters)
+        .first()
+    )
+
+
+def get_cached_coupon(code: str) -> Optional[Coupon]:
+    """Cached ``find_coupon``; includes inactive coupons.
+
+    ``redemption_count`` on the returned instance may lag by up to
+    ``COUPON_CACHE_TTL_SECONDS``. Checkout enforces limits on the database row.
+    """
+    normalized = normalize_code(code)
+    if not normalized or len(normalized) > Coupon._meta.get_field("code").max_length:
+        return None
+    key = coupon_cache_key(normalized)
+    cached = cache.get(key)
+    if cached == _MISSING:
+        return None
+    if cached is not None:
+        return cached
+    coupon = find_coupon(normalized)
+    if coupon is None:
+        cache.set(key, _MISSING, timeout=COUPON_NEGATIVE_CACHE_TTL_SECONDS)
+    else:
+        cache.set(key, coupon, timeout=COUPON_CACHE_TTL_SECONDS)
+    return coupon
+
+
+def invalidate_coupon_cache(*codes: str) -> None:
+    cache.delete_many([coupon_cache_key(code) for code in codes if code])
+
+
+def limit_reached(coupon: Coupon, user=None) -> Optional[str]:
+    """Return ``"usage"`` or ``"per_user"`` when a limit is exhausted, else None."""
+    if coupon.usage_limit and coupon.redemption_count >= coupon.usage_limit:
+        return "usage"
+    if coupon.per_user_limit and user is not None and user.is_authenticated:
+        used = CouponUserUsage.objects.filter(coupon=coupon, user=user).values_list("count", flat=True).first()
+        if (used or 0) >= coupon.per_user_limit:
+            return "per_user"
+    return None
+
+
+def claim_coupon(coupon: Coupon, user, order: Optional[Order] = None, enforce_limits: bool = True) -> CouponRedemption:
+    """Record one redemption of ``coupon`` by ``user``.
+
+    Raises ``CouponLimitReached`` (and changes nothing) when ``enforce_limits``
+    is set and either limit is already used up.
+    """
+    with transaction.atomic():
+        coupons = Coupon.objects.filter(pk=coupon.pk)
+        if enforce_limits and coupon.usage_limit:
+            coupons = coupons.filter(redemption_count__lt=F("usage_limit"))
+        if not coupons.update(redemption_count=F("redemption_count") + 1):
+            raise CouponLimitReached(coupon, per_user=False)
+
+        usage, _ = CouponUserUsage.objects.get_or_create(coupon=coupon, user=user)
+        usages = CouponUserUsage.objects.filter(pk=usage.pk)
+        if enforce_limits and coupon.per_user_limit:
+            usages = usages.filter(count__lt=coupon.per_user_limit)
+        if not usages.update(count=F("count") + 1):
+            # Leaving the atomic block with an error undoes the coupon-wide increment.
+            raise CouponLimitReached(coupon, per_user=True)
+        return CouponRedemption.objects.create(coupon=coupon, user=user, order=order)
+
+
+def record_order_redemptions(order: Order) -> None:
+    """Ensure a paid order's coupons are counted.
+
+    Orders normally claim at checkout; this covers orders whose claims were
+    released (paid after cancellation) or that predate the counters. Limits
+    are not enforced because the customer has already paid.
+    """
+    coupon_ids = {coupon_id for coupon_id in (order.coupon_id, order.referral_coupon_id) if coupon_id}
+    if not coupon_ids:
+        return
+    claimed = CouponRedemption.objects.filter(order=order, coupon_id__in=coupon_ids).values_list("coupon_id", flat=True)
+    missing = coupon_ids - set(claimed)
+    for coupon in Coupon.objects.filter(pk__in=missing).order_by("pk") if missing else ():
+        claim_coupon(coupon, order.user, order, enforce_limits=False)
+
+
+def release_order_redemptions(order: Order) -> int:
+    """Give back the coupon claims of a cancelled order."""
+    released = 0
+    with transaction.atomic():
+        for redemption in CouponRedemption.objects.select_for_update().filter(order=order):
+            Coupon.objects.filter(pk=redemption.coupon_id, redemption_count__gt=0).update(
+                redemption_count=F("redemption_count") - 1
+            )
+            CouponUserUsage.objects.filter(
+                coupon_id=redemption.coupon_id, user_id=redemption.user_id, count__gt=0
+            ).update(count=F("count") - 1)
+            redemption.delete()
+            released += 1
+    return released
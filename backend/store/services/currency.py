@@ -0,0 +1,214 @@
+"""Currency conversion rates.
+
+Store prices are kept in ``settings.CURRENCY_BASE``. Rates come from a
+pluggable source (``settings.CURRENCY_RATE_SOURCE``): the default reads
+``settings.CURRENCY_RATES_FILE`` when it is set and ``settings.CURRENCY_RATES``
+otherwise. Each process keeps the loaded ``RateTable`` for
+``CURRENCY_RATE_TTL_SECONDS`` and then asks the source again, so editing the
+rates file takes effect without a restart. A table's ``version`` changes with
+its rates; cached values derived from a rate (priced cart snapshots) include it.
+
+``convert_many`` converts a whole page of prices with integer numpy
+arithmetic on cents, so listings pay for one array operation instead of a
+``Decimal`` multiplication per item.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from dataclasses import dataclass
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import ValidationError
+
+from ..constants import CURRENCY_RATE_TTL_SECONDS
+
+CENT = Decimal("0.01")
+# Rates are applied as integers in millionths.
+RATE_SCALE = 1_000_000
+# Largest cents * scaled-rate product that still fits an int64 with headroom.
+_INT64_SAFE = 2**62
+
+
+class UnknownCurrency(KeyError):
+    """No rate is configured for the requested currency."""
+
+
+@dataclass(frozen=True)
+class RateTable:
+    base: str
+    rates: Mapping[str, Decimal]
+    version: str
+
+    @classmethod
+    def build(cls, base: str, rates: Mapping[str, object]) -> "RateTable":
+        """Normalise codes and values; the version is a digest of the result."""
+        base = base.upper()
+        parsed: Dict[str, Decimal] = {base: Decimal(1)}
+        for code, value in rates.items():
+            try:
+                rate = Decimal(str(value))
+            except InvalidOperation:
+                continue
+            if rate > 0:
+                parsed[str(code).upper()] = rate
+        raw = ";".join(f"{code}={rate}" for code, rate in sorted(parsed.items()))
+        version = hashlib.blake2b(f"{base}|{raw}".encode(), digest_size=6).hexdigest()
+        return cls(base=base, rates=parsed, version=version)
+
+    def rate(self, currency: str) -> Decimal:
+        try:
+            return self.rates[currency.upper()]
+        except KeyError:
+            raise UnknownCurrency(currency) from None
+
+
+class SettingsRateSource:
+    """Rates from ``settings.CURRENCY_RATES``."""
+
+    def load(self) -> RateTable:
+        return RateTable.build(settings.CURRENCY_BASE, getattr(settings, "CURRENCY_RATES", {}))
+
+
+class JSONFileRateSource:
+    """Rates from a JSON file: ``{"base": "USD", "rates": {"NPR": "133.5"}}``.
+
+    The file is only parsed again when its modification time changes.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = Path(path or settings.CURRENCY_RATES_FILE)
+        self._loaded: Optional[Tuple[float, RateTable]] = None
+
+    def load(self) -> RateTable:
+        mtime = self.path.stat().st_mtime
+        if self._loaded and self._loaded[0] == mtime:
+            return self._loaded[1]
+        data = json.loads(self.path.read_text())
+        table = RateTable.build(data.get("base") or settings.CURRENCY_BASE, data.get("rates") or {})
+        self._loaded = (mtime, table)
+        return table
+
+
+class DefaultRateSource:
+    """``JSONFileRateSource`` when ``CURRENCY_RATES_FILE`` is set, else ``SettingsRateSource``.
+
+    A missing or unreadable file falls back to the settings rates so a bad
+    deploy of the file cannot break checkout.
+    """
+
+    def __init__(self):
+        path = getattr(settings, "CURRENCY_RATES_FILE", None)
+        self.file = JSONFileRateSource(path) if path else None
+        self.fallback = SettingsRateSource()
+
+    def load(self) -> RateTable:
+        if self.file is not None:
+            try:
+                return self.file.load()
+            except (OSError, ValueError):
+                pass
+        return self.fallback.load()
+
+
+_source = None
+_table: Optional[Tuple[float, RateTable]] = None
+_lock = threading.Lock()
+
+
+def _get_source():
+    global _source
+    if _source is None:
+        _source = import_string(settings.CURRENCY_RATE_SOURCE)()
+    return _source
+
+
+def get_rates() -> RateTable:
+    """The current rate table, reloaded from the source at most every TTL."""
+    global _table
+    cached = _table
+    now = time.monotonic()
+    if cached and now - cached[0] < CURRENCY_RATE_TTL_SECONDS:
+        return cached[1]
+    with _lock:
+        cached = _table
+        if cached and now - cached[0] < CURRENCY_RATE_TTL_SECONDS:
+            return cached[1]
+        _table = (now, _get_source().load())
+        return _table[1]
+
+
+def reset_rates() -> None:
+    """Forget the cached table and source (tests, or after changing the source setting)."""
+    global _source, _table
+    with _lock:
+        _source = None
+        _table = None
+
+
+def rates_version() -> str:
+    return get_rates().version
+
+
+def convert(amount: Decimal, currency: str, table: Optional[RateTable] = None) -> Decimal:
+    """Convert one base-currency amount, rounded half-up to cents."""
+    rate = (table or get_rates()).rate(currency)
+    if amount <= 0:
+        return amount
+    return (amount * rate).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def convert_many(amounts: Sequence[object], currency: str, table: Optional[RateTable] = None) -> List[str]:
+    """Convert base-currency prices (``Decimal`` or their string form) to formatted amounts.
+
+    Prices are turned into int64 cents once and multiplied by the rate in
+    millionths; rounding is half-up to cents, like ``convert``. Rates with
+    more than six decimal places are rounded to six here.
+    """
+    rate = (table or get_rates()).rate(currency)
+    if not len(amounts):
+        return []
+    scaled_rate = int((rate * RATE_SCALE).to_integral_value(rounding=ROUND_HALF_UP))
+    cents = np.rint(np.asarray(amounts, dtype=np.float64) * 100).astype(np.int64)
+    if int(np.abs(cents).max()) * scaled_rate < _INT64_SAFE:
+        products = cents * np.int64(scaled_rate)
+    else:
+        products = cents.astype(object) * scaled_rate
+    half = RATE_SCALE // 2
+    converted = np.where(products >= 0, (products + half) // RATE_SCALE, -((-products + half) // RATE_SCALE))
+    return [_format_cents(int(value)) for value in converted]
+
+
+def _format_cents(value: int) -> str:
+    sign = "-" if value < 0 else ""
+    whole, cents = divmod(abs(value), 100)
+    return f"{sign}{whole}.{cents:02d}"
+
+
+def localize_rows(rows: List[dict], currency: str, field: str = "base_price", target: str = "localized_price") -> None:
+    """Add ``target`` (converted ``field``) to each serialized row that has ``field``, in place."""
+    table = get_rates()
+    code = currency.upper()
+    priced = [row for row in rows if row.get(field) is not None]
+    for row, amount in zip(priced, convert_many([row[field] for row in priced], code, table)):
+        row[target] = amount
+        row["currency"] = code
+
+
+def requested_currency(request) -> Optional[str]:
+    """The ``?currency=`` code, or None when absent; unconfigured codes are a 400."""
+    code = (request.query_params.get("currency") or "").strip().upper()
+    if not code:
+        return None
+    try:
+        get_rates().rate(code)
+    except UnknownCurrency:
+        raise ValidationError({"currency": f"Unsupported currency {code}"})
+    return code
@@ -0,0 +1,86 @@
+"""Facet counts for the product listing.
+
+Computes every storefront facet for an already-filtered product queryset with
+grouped aggregate SQL: one conditional-aggregate query for the bucketed facets
+(price, stock, shipping time) plus one ``GROUP BY`` per value facet. The number
+of queries is fixed regardless of how many facet values or products exist.
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, List
+
+from django.db.models import Count, Q, QuerySet
+
+from ..constants import PRICE_FACET_BUCKETS, SHIPPING_FACET_MAX_DAYS
+from ..models import Product, ProductVariant
+
+
+def _price_bucket_q(low, high) -> Q:
+    q = Q()
+    if low is not None:
+        q &= Q(base_price__gte=low)
+    if high is not None:
+        q &= Q(base_price__lt=high)
+    return q
+
+
+def _value_facet(qs: QuerySet, field: str, count_field: str = "id") -> List[Dict[str, Any]]:
+    rows = (
+        qs.exclude(**{field: ""})
+        .values(field)
+        .annotate(count=Count(count_field, distinct=True))
+        .order_by("-count", field)
+    )
+    return [{"value": row[field], "count": row["count"]} for row in rows]
+
+
+def compute_facets(queryset: QuerySet[Product]) -> Dict[str, Any]:
+    """Return facet counts for the products matched by ``queryset``.
+
+    The queryset is reduced to an id subquery first so filter annotations
+    (ratings, stock) and ``select_related`` joins are not repeated per facet.
+    """
+    ids = queryset.order_by().values("id")
+    products = Product.objects.filter(id__in=ids)
+    variants = ProductVariant.objects.filter(product_id__in=ids)
+
+    bucket_aggregates = {"total": Count("id")}
+    for index, (low, high) in enumerate(PRICE_FACET_BUCKETS):
+        bucket_aggregates[f"price_{index}"] = Count("id", filter=_price_bucket_q(low, high))
+    for days in SHIPPING_FACET_MAX_DAYS:
+        bucket_aggregates[f"shipping_{days}"] = Count("id", filter=Q(shipping_time_max_days__lte=days))
+    bucket_aggregates["in_stock"] = Count("id", filter=Q(inventory__quantity__gt=0))
+    buckets = products.aggregate(**bucket_aggregates)
+
+    categories = (
+        products.values("category__slug", "category__name")
+        .annotate(count=Count("id"))
+        .order_by("-count", "category__name")
+    )
+
+    return {
+        "total": buckets["total"],
+        "category": [
+            {"value": row["category__slug"], "label": row["category__name"], "count": row["count"]}
+            for row in categories
+        ],
+        "brand": _value_facet(products, "brand"),
+        "size": _value_facet(variants, "size", count_field="product_id"),
+        "color": _value_facet(variants, "color", count_field="product_id"),
+        "price": [
+            {
+                "min": low,
+                "max": high,
+                "count": buckets[f"price_{index}"],
+            }
+            for index, (low, high) in enumerate(PRICE_FACET_BUCKETS)
+        ],
+        "stock": {
+            "in_stock": buckets["in_stock"],
+            "out_of_stock": buckets["total"] - buckets["in_stock"],
+        },
+        "shipping_max": [
+            {"max_days": days, "count": buckets[f"shipping_{days}"]}
+            for days in SHIPPING_FACET_MAX_DAYS
+        ],
+    }
@@ -0,0 +1,148 @@
+"""Short-lived inventory reservations.
+
+Checkout takes stock with one conditional ``UPDATE ... SET quantity = quantity - n
+WHERE quantity >= n`` over the whole cart inside its own small transaction, so
+row locks on hot SKUs last for that statement rather than the whole checkout.
+Each hold is recorded as an ``InventoryReservation`` that is committed when
+the order is paid, or released (stock returned) on payment failure, on a
+failed checkout, or by the expiry sweeper.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from collections import defaultdict
+from datetime import timedelta
+from typing import Dict, Iterable, List, Tuple
+
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from ..constants import RESERVATION_TIMEOUT_SECONDS
+from ..metrics import INVENTORY_LOCK_SECONDS
+from ..models import Inventory, InventoryReservation, Order
+
+log = logging.getLogger(__name__)
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_id: int, available: int):
+        super().__init__(f"Insufficient stock for product {product_id}: {available} available")
+        self.product_id = product_id
+        self.available = available
+
+
+def reserve_stock(
+    lines: Iterable[Tuple[int, int]], timeout: int = RESERVATION_TIMEOUT_SECONDS
+) -> List[InventoryReservation]:
+    """Hold ``quantity`` of each ``(product_id, quantity)`` line, all or nothing.
+
+    The cart's inventory rows are locked with one ``SELECT ... FOR UPDATE``
+    ordered by primary key, so concurrent checkouts over overlapping SKUs
+    always acquire locks in the same order and cannot deadlock. Stock is then
+    taken with a single guarded ``UPDATE`` over all lines. Raises
+    ``InsufficientStock`` for the first product (by id) that cannot be
+    covered; nothing is held in that case.
+    """
+    wanted: Dict[int, int] = defaultdict(int)
+    for product_id, quantity in lines:
+        wanted[product_id] += quantity
+    if not wanted:
+        return []
+    expires_at = timezone.now() + timedelta(seconds=timeout)
+    started = time.perf_counter()
+    try:
+        with transaction.atomic():
+            if connection.features.has_select_for_update:
+                list(
+                    Inventory.objects.select_for_update()
+                    .filter(product_id__in=wanted)
+                    .order_by("pk")
+                    .values_list("pk", flat=True)
+                )
+            # SQLite has no row locks; there the UPDATE below is the first
+            # statement of the transaction and takes the write lock itself.
+            taken = Inventory.objects.filter(
+                _covers(wanted), product_id__in=wanted
+            ).update(quantity=F("quantity") - _per_product(wanted))
+            if taken != len(wanted):
+                available = dict(Inventory.objects.filter(product_id__in=wanted).values_list("product_id", "quantity"))
+                short = next(pid for pid in sorted(wanted) if available.get(pid, 0) < wanted[pid])
+                raise InsufficientStock(short, available.get(short, 0))
+            return InventoryReservation.objects.bulk_create(
+                InventoryReservation(product_id=product_id, quantity=quantity, expires_at=expires_at)
+                for product_id, quantity in sorted(wanted.items())
+            )
+    finally:
+        INVENTORY_LOCK_SECONDS.observe(time.perf_counter() - started)
+
+
+def _per_product(wanted: Dict[int, int]) -> Case:
+    return Case(
+        *(When(product_id=product_id, then=Value(quantity)) for product_id, quantity in wanted.items()),
+        output_field=IntegerField(),
+    )
+
+
+def _covers(wanted: Dict[int, int]) -> Q:
+    """Rows whose quantity covers the requested amount for their product."""
+    condition = Q()
+    for product_id, quantity in wanted.items():
+        condition |= Q(product_id=product_id, quantity__gte=quantity)
+    return condition
+
+
+def release_reservations(reservations: Iterable[InventoryReservation]) -> int:
+    """Return held stock to inventory. Idempotent: only ``HELD`` rows are released."""
+    released = 0
+    now = timezone.now()
+    with transaction.atomic():
+        for reservation in sorted(reservations, key=lambda r: r.product_id):
+            flipped = InventoryReservation.objects.filter(
+                pk=reservation.pk, status=InventoryReservation.Status.HELD
+            ).update(status=InventoryReservation.Status.RELEASED, released_at=now)
+            if flipped:
+                Inventory.objects.filter(product_id=reservation.product_id).update(
+                    quantity=F("quantity") + reservation.quantity
+                )
+                released += 1
+    return released
+
+
+def release_order_reservations(order: Order) -> int:
+    return release_reservations(order.reservations.filter(status=InventoryReservation.Status.HELD))
+
+
+def commit_order_reservations(order: Order) -> int:
+    """Make an order's holds permanent once it is paid.
+
+    Holds that were already released (payment arrived after expiry or after a
+    failed attempt) are re-taken when stock allows; otherwise the shortfall is
+    logged for manual follow-up.
+    """
+    with transaction.atomic():
+        committed = order.reservations.filter(status=InventoryReservation.Status.HELD).update(
+            status=InventoryReservation.Status.COMMITTED
+        )
+        for reservation in order.reservations.filter(status=InventoryReservation.Status.RELEASED).order_by("product_id"):
+            taken = Inventory.objects.filter(
+                product_id=reservation.product_id, quantity__gte=reservation.quantity
+            ).update(quantity=F("quantity") - reservation.quantity)
+            if taken:
+                reservation.status = InventoryReservation.Status.COMMITTED
+                reservation.save(update_fields=["status"])
+                committed += 1
+            else:
+                log.warning(
+                    "Order %s paid after its hold on product %s was released and stock is short",
+                    order.id,
+                    reservation.product_id,
+                )
+    return committed
+
+
+def expired_reservations(now=None):
+    return InventoryReservation.objects.filter(
+        status=InventoryReservation.Status.HELD, expires_at__lte=now or timezone.now()
+    )
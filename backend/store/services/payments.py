@@ -0,0 +1,353 @@
+"""Payment-intent creation outside the checkout transaction, and the payment event ledger.
+
+Checkout commits the order together with a ``Payment`` row in
+``INTENT_PENDING`` and only then calls the gateway, so no database locks or
+open transactions are held across the third-party HTTP call. A failed call
+leaves the payment in ``INTENT_FAILED``; the order keeps its stock holds until
+they expire and the client can retry the intent for the same order. So can
+an intent left in ``INTENT_PENDING`` by a worker that died during the call,
+once it is ``PAYMENT_INTENT_STALE_SECONDS`` old.
+
+Reported outcomes (webhook, verify callback, reconciliation) are appended to
+``PaymentEvent`` before any state change; ``record_payment_event`` tells the
+caller whether the outcome is new. ``finalize_payment`` is the single "mark
+paid" path all three use.
+
+Pending payments are also polled: each intent gets a ``next_check_at`` and
+``poll_due_payments`` asks the gateway about due ones on a backoff schedule,
+so abandoned intents resolve without a full-table reconciliation pass.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+from math import ceil
+from typing import Any, Dict, Optional
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from ..constants import (
+    PAYMENT_HTTP_GET_RETRIES,
+    PAYMENT_HTTP_TIMEOUT,
+    PAYMENT_INTENT_STALE_SECONDS,
+    PAYMENT_POLL_BACKOFF_SECONDS,
+    PAYMENT_POLL_BATCH_SIZE,
+    PAYMENT_POLL_CONCURRENCY,
+    PAYMENT_POLL_LOCK_MARGIN_SECONDS,
+)
+from ..metrics import PAYMENT_INTENT_LATENCY
+from ..models import Notification, Order, OrderStatusEvent, Payment, PaymentEvent
+from ..payments.base import get_gateway
+from .coupons import record_order_redemptions
+from .inventory import commit_order_reservations, release_order_reservations
+
+log = logging.getLogger(__name__)
+
+
+class IntentInProgress(Exception):
+    """Another request is already creating the intent for this payment."""
+
+
+def start_intent(order: Order, provider: str) -> Payment:
+    """Record the payment that will carry the intent; call inside the checkout transaction."""
+    return Payment.objects.create(
+        order=order,
+        provider=provider,
+        provider_payment_id=f"{provider}_pending_{order.id}",
+        amount=order.total_amount,
+        status=Payment.Status.INTENT_PENDING,
+        intent_started_at=timezone.now(),
+    )
+
+
+def claim_intent_retry(payment: Payment) -> None:
+    """Move a failed or abandoned intent (back) to ``INTENT_PENDING`` so exactly one retry runs.
+
+    An intent counts as abandoned when it has been pending for
+    ``PAYMENT_INTENT_STALE_SECONDS``; the order-derived idempotency key keeps
+    a retry from charging twice if the first call did reach the provider.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=PAYMENT_INTENT_STALE_SECONDS)
+    abandoned = Q(status=Payment.Status.INTENT_PENDING) & (
+        Q(intent_started_at__lt=stale) | Q(intent_started_at__isnull=True, created_at__lt=stale)
+    )
+    claimed = Payment.objects.filter(Q(status=Payment.Status.INTENT_FAILED) | abandoned, pk=payment.pk).update(
+        status=Payment.Status.INTENT_PENDING, intent_started_at=now
+    )
+    if not claimed:
+        raise IntentInProgress(payment.pk)
+    payment.status = Payment.Status.INTENT_PENDING
+    payment.intent_started_at = now
+
+
+def create_intent(payment: Payment, **kwargs) -> Dict[str, Any]:
+    """Call the gateway for ``payment`` and attach the intent to it.
+
+    Must run outside ``transaction.atomic``. The idempotency key is derived
+    from the order so a retry after a timed-out call does not create a second
+    charge at providers that honour it. On failure the payment is marked
+    ``INTENT_FAILED`` and the exception propagates.
+    """
+    order = payment.order
+    provider = payment.provider
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        intent = get_gateway(provider).create_payment_intent(
+            order, idempotency_key=f"order-{order.id}-payment-intent", **kwargs
+        )
+    except Exception as exc:
+        outcome = "error"
+        log.warning("Payment intent creation failed for order %s via %s: %s", order.id, provider, exc)
+        payment.status = Payment.Status.INTENT_FAILED
+        payment.raw_response = {"intent_error": str(exc)[:500]}
+        payment.save(update_fields=["status", "raw_response"])
+        raise
+    finally:
+        PAYMENT_INTENT_LATENCY.labels(provider=provider, outcome=outcome).observe(time.perf_counter() - started)
+
+    amount = order.total_amount
+    if provider == Payment.Provider.ESEWA:
+        try:
+            amount = Decimal(str(intent.get("amount_npr") or intent.get("base_amount_npr") or order.total_amount))
+        except Exception:
+            amount = order.total_amount
+    payment.provider_payment_id = (
+        intent.get("provider_payment_id") or intent.get("token") or payment.provider_payment_id
+    )
+    payment.amount = amount
+    payment.status = Payment.Status.PENDING
+    payment.raw_response = intent
+    payment.check_attempts = 0
+    payment.next_check_at = next_check_time(0)
+    payment.save(
+        update_fields=["provider_payment_id", "amount", "status", "raw_response", "check_attempts", "next_check_at"]
+    )
+    return intent
+
+
+def next_check_time(attempts: int, now: Optional[datetime] = None) -> Optional[datetime]:
+    """When to poll a payment that has been checked ``attempts`` times; None once the schedule is used up."""
+    if attempts >= len(PAYMENT_POLL_BACKOFF_SECONDS):
+        return None
+    return (now or timezone.now()) + timedelta(seconds=PAYMENT_POLL_BACKOFF_SECONDS[attempts])
+
+
+def payment_event_id(order: Order, payment: Optional[Payment], status: str) -> str:
+    reference = payment.provider_payment_id if payment else f"order-{order.id}"
+    return f"{reference}:{status}"
+
+
+def record_payment_event(
+    order: Order,
+    provider: str,
+    payment: Optional[Payment],
+    status: str,
+    source: str,
+    payload: Optional[Dict[str, Any]] = None,
+) -> bool:
+    """Append ``status`` for this payment to the ledger; False if it was already recorded.
+
+    Duplicates are rejected by the unique ``(provider, provider_event_id)``
+    index on the INSERT itself, so a gateway retry costs one statement.
+    Call inside the transaction that applies the state change, so the event
+    and the change commit or roll back together.
+    """
+    try:
+        with transaction.atomic():
+            PaymentEvent.objects.create(
+                provider=provider,
+                provider_event_id=payment_event_id(order, payment, status),
+                order=order,
+                payment=payment,
+                status=status,
+                source=source,
+                payload=payload or {},
+            )
+    except IntegrityError:
+        log.info("Ignoring duplicate %s payment event for order %s (%s)", status, order.id, source)
+        return False
+    return True
+
+
+_PAID_NOTES = {
+    PaymentEvent.Source.WEBHOOK: "Gateway webhook",
+    PaymentEvent.Source.VERIFY: "Payment verified",
+    PaymentEvent.Source.RECONCILE: "Payment reconciled",
+}
+
+
+def finalize_payment(
+    order: Order,
+    payment: Optional[Payment],
+    provider: str,
+    source: str,
+    payload: Optional[Dict[str, Any]] = None,
+) -> bool:
+    """Mark ``payment`` succeeded and ``order`` paid, once.
+
+    Runs a fixed number of statements regardless of the caller: the ledger
+    insert, one UPDATE each for the payment and the order, the reservation
+    commit, one insert each for the status event and the notification, and
+    one coupon check. The order UPDATE is conditional on it not being paid
+    yet, so only the first outcome to get there creates the event,
+    notification, supplier forward and co-purchase update. The UPDATE fires
+    no ``post_save``, so the co-purchase task is queued here rather than by
+    the signal. Returns whether this call paid the order.
+    """
+    from ..tasks import auto_forward_order_to_supplier, update_copurchase_matrix_for_order
+
+    payload = payload or {}
+    with transaction.atomic():
+        if not record_payment_event(order, provider, payment, Payment.Status.SUCCEEDED, source, payload):
+            return False
+        if payment is not None:
+            payment.status = Payment.Status.SUCCEEDED
+            payment.raw_response = {**(payment.raw_response or {}), **payload}
+            payment.next_check_at = None
+            Payment.objects.filter(pk=payment.pk).update(
+                status=payment.status, raw_response=payment.raw_response, next_check_at=None
+            )
+        paid = (
+            Order.objects.filter(pk=order.pk)
+            .exclude(payment_status=Order.PaymentStatus.PAID)
+            .update(status=Order.Status.PAID, payment_status=Order.PaymentStatus.PAID)
+        )
+        if not paid:
+            return False
+        order.status = Order.Status.PAID
+        order.payment_status = Order.PaymentStatus.PAID
+        commit_order_reservations(order)
+        OrderStatusEvent.objects.create(order=order, status=Order.Status.PAID, note=_PAID_NOTES.get(source, ""))
+        Notification.objects.create(
+            user_id=order.user_id,
+            notification_type=Notification.Type.ORDER_UPDATE,
+            payload={"order_id": order.id, "status": order.status},
+        )
+        record_order_redemptions(order)
+
+        def forward():
+            for task in (auto_forward_order_to_supplier, update_copurchase_matrix_for_order):
+                try:
+                    task.delay(order.id)
+                except Exception:
+                    pass
+
+        transaction.on_commit(forward)
+    return True
+
+
+def fail_payment(
+    order: Order,
+    payment: Optional[Payment],
+    provider: str,
+    source: str,
+    payload: Optional[Dict[str, Any]] = None,
+) -> bool:
+    """Mark ``payment`` failed and return the order's stock holds, once per payment.
+
+    An order that is already paid is left alone: a late or replayed failure
+    is recorded in the ledger but does not unsettle it.
+    """
+    payload = payload or {}
+    with transaction.atomic():
+        if not record_payment_event(order, provider, payment, Payment.Status.FAILED, source, payload):
+            return False
+        failed = (
+            Order.objects.filter(pk=order.pk)
+            .exclude(payment_status=Order.PaymentStatus.PAID)
+            .update(payment_status=Order.PaymentStatus.FAILED)
+        )
+        if not failed:
+            return False
+        if payment is not None:
+            payment.status = Payment.Status.FAILED
+            payment.raw_response = {**(payment.raw_response or {}), **payload}
+            payment.next_check_at = None
+            payment.save(update_fields=["status", "raw_response", "next_check_at"])
+        order.payment_status = Order.PaymentStatus.FAILED
+        release_order_reservations(order)
+    return True
+
+
+_REMOTE_PAID = {"succeeded", "paid", "completed", "complete"}
+_REMOTE_FAILED = {"failed", "canceled", "cancelled", "expired", "refunded"}
+
+
+def _fetch_status(payment: Payment) -> Dict[str, Any]:
+    try:
+        return get_gateway(payment.provider).fetch_payment_status(payment.provider_payment_id)
+    except NotImplementedError:
+        return {"unsupported": True}
+    except Exception as exc:
+        log.warning("Status check for payment %s via %s failed: %s", payment.pk, payment.provider, exc)
+        return {"error": str(exc)[:200]}
+
+
+def poll_lock_timeout(batch_size: int = PAYMENT_POLL_BATCH_SIZE) -> int:
+    """Seconds a ``poll_due_payments`` run can take when every call hits its timeout.
+
+    Worst case is the whole batch on one provider: ``batch_size /
+    PAYMENT_POLL_CONCURRENCY`` rounds of a call that times out on connect and
+    read, with retries.
+    """
+    per_call = sum(PAYMENT_HTTP_TIMEOUT) * (PAYMENT_HTTP_GET_RETRIES + 1)
+    return ceil(ceil(batch_size / PAYMENT_POLL_CONCURRENCY) * per_call) + PAYMENT_POLL_LOCK_MARGIN_SECONDS
+
+
+def poll_due_payments(batch_size: int = PAYMENT_POLL_BATCH_SIZE) -> Dict[str, int]:
+    """Ask gateways about pending payments whose ``next_check_at`` has passed.
+
+    Status calls run in a thread pool per provider, at most
+    ``PAYMENT_POLL_CONCURRENCY`` at a time each, so one slow provider cannot
+    starve the others; results are applied on the calling thread. Payments
+    that are still pending move to the next backoff step; after the last one
+    they are no longer polled and the reservation sweeper cancels the order.
+    """
+    now = timezone.now()
+    due = list(
+        Payment.objects.filter(status=Payment.Status.PENDING, next_check_at__lte=now)
+        .select_related("order")
+        .order_by("next_check_at")[:batch_size]
+    )
+    stats = {"checked": len(due), "paid": 0, "failed": 0, "pending": 0}
+    if not due:
+        return stats
+
+    by_provider = defaultdict(list)
+    for payment in due:
+        by_provider[payment.provider].append(payment)
+    pools = [ThreadPoolExecutor(max_workers=PAYMENT_POLL_CONCURRENCY) for _ in by_provider]
+    try:
+        futures = [
+            (payment, pool.submit(_fetch_status, payment))
+            for pool, payments in zip(pools, by_provider.values())
+            for payment in payments
+        ]
+        results = [(payment, future.result()) for payment, future in futures]
+    finally:
+        for pool in pools:
+            pool.shutdown()
+
+    for payment, result in results:
+        remote = str(result.get("status") or "").lower()
+        if remote in _REMOTE_PAID:
+            finalize_payment(payment.order, payment, payment.provider, PaymentEvent.Source.POLL, result)
+            stats["paid"] += 1
+        elif remote in _REMOTE_FAILED:
+            fail_payment(payment.order, payment, payment.provider, PaymentEvent.Source.POLL, result)
+            stats["failed"] += 1
+        else:
+            next_check_at = None if result.get("unsupported") else next_check_time(payment.check_attempts + 1, now)
+            Payment.objects.filter(pk=payment.pk, status=Payment.Status.PENDING).update(
+                check_attempts=F("check_attempts") + 1, next_check_at=next_check_at
+            )
+            stats["pending"] += 1
+    return stats
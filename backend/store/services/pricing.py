@@ -0,0 +1,201 @@
+"""Cart pricing engine.
+
+``price_cart`` turns a cart (product id -> quantity) and its hydrated product
+rows into a ``PricedCart`` in one pass: priced lines, subtotal, the in-stock
+view shown by the cart endpoint, delivery estimate and the NPR amount eSewa
+charges. Discounts are layered on with ``PricedCart.with_discounts``.
+
+``get_priced_cart`` caches the undiscounted snapshot per cart version (a
+digest of the cart contents) and catalog epoch, so the cart view, coupon
+validation and checkout reuse one computation. Product and inventory writes
+bump the epoch (see ``store.signals``) and the key includes the currency rate
+version; coupons are applied on top of the cached snapshot, so coupon edits
+need no invalidation here.
+"""
+from __future__ import annotations
+
+import hashlib
+from dataclasses import dataclass, replace
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.core.cache import cache
+
+from ..constants import PRICING_CACHE_PREFIX, PRICING_SNAPSHOT_TTL_SECONDS
+from ..models import Coupon
+from .cart import hydrate_cart
+from .currency import convert_many, get_rates
+
+CENT = Decimal("0.01")
+ZERO = Decimal("0.00")
+EPOCH_KEY = f"{PRICING_CACHE_PREFIX}epoch"
+
+
+def to_npr(amount: Decimal, rate: Optional[Decimal] = None) -> Decimal:
+    """Convert a store-currency amount to NPR at the current rate (see ``services.currency``)."""
+    if rate is None:
+        rate = get_rates().rate("NPR")
+    if amount <= 0 or rate <= 0:
+        return amount
+    return (amount * rate).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def coupon_discount(coupon: Coupon, subtotal: Decimal) -> Decimal:
+    """Discount ``coupon`` gives on ``subtotal``, never more than the subtotal."""
+    if coupon.discount_type == Coupon.DiscountType.PERCENT:
+        amount = subtotal * coupon.value / Decimal("100")
+    else:
+        amount = Decimal(coupon.value)
+    return min(amount, subtotal).quantize(CENT)
+
+
+def bundle_price(base: Decimal, discount_percent: Decimal, discount_amount: Decimal) -> Decimal:
+    price = base
+    if discount_percent:
+        price = price * (Decimal("1.00") - discount_percent / Decimal("100.00"))
+    if discount_amount:
+        price = price - discount_amount
+    return max(price, ZERO).quantize(CENT)
+
+
+@dataclass(frozen=True)
+class PricedLine:
+    product_id: int
+    sku: str
+    title: str
+    quantity: int
+    unit_price: Decimal
+    line_total: Decimal
+    stock: Optional[int]
+    shipping_days: int
+
+    @property
+    def in_stock(self) -> bool:
+        return self.stock is None or self.stock > 0
+
+
+@dataclass(frozen=True)
+class PricedCart:
+    lines: Tuple[PricedLine, ...]
+    # Cart ids that are no longer purchasable (inactive or deleted).
+    missing: Tuple[int, ...]
+    subtotal: Decimal
+    # Total over in-stock lines only, as shown by the cart endpoint.
+    available_total: Decimal
+    max_shipping_days: int
+    discounts: Tuple[Tuple[str, Decimal], ...] = ()
+    discount_total: Decimal = ZERO
+    total: Decimal = ZERO
+    total_npr: Decimal = ZERO
+
+    @property
+    def pruned(self) -> List[int]:
+        """Lines the cart endpoint drops: missing products and sold-out lines."""
+        return [*self.missing, *(line.product_id for line in self.lines if not line.in_stock)]
+
+    def with_discounts(self, coupons: Iterable[Coupon]) -> "PricedCart":
+        """Apply each coupon to the subtotal; totals never go below zero."""
+        discounts = tuple((coupon.code, coupon_discount(coupon, self.subtotal)) for coupon in coupons)
+        discount_total = sum((amount for _, amount in discounts), ZERO)
+        total = max(self.subtotal - discount_total, ZERO).quantize(CENT)
+        return replace(self, discounts=discounts, discount_total=discount_total, total=total, total_npr=to_npr(total))
+
+    def cart_payload(self, currency: Optional[str] = None) -> Dict[str, Any]:
+        """Cart endpoint body; ``currency`` adds converted prices next to the store-currency ones."""
+        lines = [line for line in self.lines if line.in_stock]
+        payload = {
+            "items": [
+                {
+                    "product": {"id": line.product_id, "sku": line.sku, "title": line.title},
+                    "quantity": line.quantity,
+                    "unit_price": str(line.unit_price),
+                }
+                for line in lines
+            ],
+            "total": str(self.available_total),
+        }
+        if currency:
+            *unit_prices, total = convert_many([*(line.unit_price for line in lines), self.available_total], currency)
+            for item, unit_price in zip(payload["items"], unit_prices):
+                item["localized_unit_price"] = unit_price
+            payload["currency"] = currency
+            payload["localized_total"] = total
+        return payload
+
+
+def price_cart(cart: Dict[int, int], products: Dict[int, Dict[str, Any]]) -> PricedCart:
+    """Price ``cart`` from ``hydrate_cart`` rows, keeping the cart's line order."""
+    lines = []
+    missing = []
+    subtotal = available_total = ZERO
+    max_shipping_days = 0
+    for pid, qty in cart.items():
+        product = products.get(pid)
+        if product is None:
+            missing.append(pid)
+            continue
+        line = PricedLine(
+            product_id=pid,
+            sku=product["sku"],
+            title=product["title"],
+            quantity=qty,
+            unit_price=product["base_price"],
+            line_total=product["base_price"] * qty,
+            stock=product["stock"],
+            shipping_days=product["shipping_time_max_days"],
+        )
+        lines.append(line)
+        subtotal += line.line_total
+        if line.in_stock:
+            available_total += line.line_total
+        max_shipping_days = max(max_shipping_days, line.shipping_days)
+    return PricedCart(
+        lines=tuple(lines),
+        missing=tuple(missing),
+        subtotal=subtotal,
+        available_total=available_total,
+        max_shipping_days=max_shipping_days,
+        total=subtotal,
+        total_npr=to_npr(subtotal),
+    )
+
+
+def cart_version(cart: Dict[int, int]) -> str:
+    """Digest of the cart's lines in order; any change gives a new version."""
+    raw = ",".join(f"{pid}:{qty}" for pid, qty in cart.items())
+    return hashlib.blake2b(raw.encode(), digest_size=12).hexdigest()
+
+
+def _epoch() -> int:
+    return cache.get_or_set(EPOCH_KEY, 1, timeout=None)
+
+
+def bump_pricing_epoch() -> None:
+    """Invalidate every cached snapshot (catalog or coupon data changed)."""
+    try:
+        cache.incr(EPOCH_KEY)
+    except ValueError:
+        cache.set(EPOCH_KEY, 2, timeout=None)
+
+
+def _snapshot_key(cart: Dict[int, int]) -> str:
+    # Snapshots carry NPR totals, so a rate change must miss them too.
+    return f"{PRICING_CACHE_PREFIX}{_epoch()}:{get_rates().version}:{cart_version(cart)}"
+
+
+def get_priced_cart(cart: Dict[int, int], products: Optional[Dict[int, Dict[str, Any]]] = None) -> PricedCart:
+    """Cached ``price_cart``.
+
+    Pass ``products`` when the caller already hydrated fresh rows (cart
+    mutations do, to check stock); the snapshot is then rebuilt from them and
+    stored for later readers.
+    """
+    key = _snapshot_key(cart)
+    if products is None:
+        snapshot = cache.get(key)
+        if snapshot is not None:
+            return snapshot
+        products = hydrate_cart(cart)
+    snapshot = price_cart(cart, products)
+    cache.set(key, snapshot, timeout=PRICING_SNAPSHOT_TTL_SECONDS)
+    return snapshot
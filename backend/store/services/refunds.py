@@ -0,0 +1,274 @@
+"""Bulk refund jobs.
+
+``create_refund_job`` records one ``RefundJobItem`` per order with the
+payment to refund; orders without a successful payment, or whose payment is
+already in another job, are recorded as skipped. ``run_refund_job`` then
+works through the pending items in chunks: the gateway calls of a chunk run
+in a thread pool per provider, at most ``REFUND_JOB_CONCURRENCY`` at a time
+each, and the outcomes are applied on the calling thread in one transaction
+per chunk, with the item, payment and order updates, status events and
+audit entries written in bulk. Progress is read from the items, so polling a
+job is one aggregate query.
+
+Every refund path, bulk or single, first claims the payment by moving it
+from ``SUCCEEDED`` to ``REFUNDED`` with a conditional UPDATE and gives it
+back if the gateway call fails, so a payment is refunded at the gateway at
+most once. An item whose payment was refunded some other way after the job
+was created is skipped. A worker that dies leaves its job ``RUNNING``; once
+the heartbeat, written after every gateway call, is older than
+``REFUND_JOB_STALE_SECONDS`` the next run takes it over under a new owner
+token. Items are claimed one by one, conditional on still being pending and
+on the job still carrying the run's token, so a run that lost its job never
+touches items the new owner has taken.
+"""
+from __future__ import annotations
+
+import logging
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.db import connections, transaction
+from django.db.models import Count, Q, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from ..constants import REFUND_JOB_CHUNK_SIZE, REFUND_JOB_CONCURRENCY, REFUND_JOB_STALE_SECONDS
+from ..models import Order, OrderStatusEvent, Payment, RefundJob, RefundJobItem
+from ..payments.base import get_gateway
+from .audit import build_admin_action, record_admin_actions
+
+log = logging.getLogger(__name__)
+
+# ``ok`` of a refund outcome: True refunded, False failed, None skipped.
+RefundOutcome = Tuple[Optional[bool], Dict[str, Any]]
+
+
+def claim_payment_refund(payment_id: int) -> bool:
+    """Mark a succeeded payment refunded before its gateway refund; False if it is not refundable."""
+    return bool(
+        Payment.objects.filter(pk=payment_id, status=Payment.Status.SUCCEEDED).update(status=Payment.Status.REFUNDED)
+    )
+
+
+def release_payment_refund(payment_id: int) -> None:
+    """Undo ``claim_payment_refund`` after a failed gateway refund."""
+    Payment.objects.filter(pk=payment_id, status=Payment.Status.REFUNDED).update(status=Payment.Status.SUCCEEDED)
+
+
+def queued_for_refund(payment: Payment) -> bool:
+    """Whether a refund job still has to process this payment."""
+    return RefundJobItem.objects.filter(
+        payment=payment, status__in=(RefundJobItem.Status.PENDING, RefundJobItem.Status.PROCESSING)
+    ).exists()
+
+
+def create_refund_job(order_ids: Iterable[int], actor=None, reason: str = "") -> RefundJob:
+    """Queue full refunds of the latest successful payment of each order.
+
+    Unknown order ids are ignored; validate them before calling.
+    """
+    ids = list(dict.fromkeys(int(order_id) for order_id in order_ids))
+    latest: Dict[int, Payment] = {}
+    for payment in Payment.objects.filter(order_id__in=ids, status=Payment.Status.SUCCEEDED).order_by(
+        "order_id", "-created_at"
+    ):
+        latest.setdefault(payment.order_id, payment)
+    known = set(Order.objects.filter(pk__in=ids).values_list("pk", flat=True))
+
+    with transaction.atomic():
+        queued = set(
+            RefundJobItem.objects.filter(
+                payment__in=latest.values(), status__in=RefundJobItem.ACTIVE_STATUSES
+            ).values_list("payment_id", flat=True)
+        )
+        job = RefundJob.objects.create(
+            created_by=actor if getattr(actor, "is_authenticated", False) else None, reason=reason[:255]
+        )
+        items = []
+        for order_id in ids:
+            if order_id not in known:
+                continue
+            payment = latest.get(order_id)
+            item = RefundJobItem(job=job, order_id=order_id)
+            if payment is None:
+                item.status, item.error = RefundJobItem.Status.SKIPPED, "no_successful_payment"
+            elif payment.pk in queued:
+                item.status, item.error = RefundJobItem.Status.SKIPPED, "already_queued"
+            else:
+                item.payment, item.provider, item.amount = payment, payment.provider, payment.amount
+            items.append(item)
+        RefundJobItem.objects.bulk_create(items)
+    return job
+
+
+def refund_job_progress(job: RefundJob) -> Dict[str, int]:
+    """Item counts by status plus ``total`` and ``done`` (no longer pending or processing)."""
+    counts = {choice: 0 for choice in RefundJobItem.Status.values}
+    for row in job.items.values("status").annotate(n=Count("id")).order_by():
+        counts[row["status"]] = row["n"]
+    total = sum(counts.values())
+    done = total - counts[RefundJobItem.Status.PENDING] - counts[RefundJobItem.Status.PROCESSING]
+    return {**counts, "total": total, "done": done}
+
+
+def _refund(item: RefundJobItem) -> RefundOutcome:
+    try:
+        return True, get_gateway(item.provider).handle_refund(item.order, item.amount) or {}
+    except NotImplementedError:
+        return False, {"error": "not_supported"}
+    except Exception as exc:  # noqa: broad-except
+        log.warning("Refund of order %s via %s failed: %s", item.order_id, item.provider, exc)
+        return False, {"error": str(exc)[:255]}
+    finally:
+        # Gateways that read the database did so on this worker thread's own connection.
+        connections.close_all()
+
+
+def _refund_concurrently(
+    items: List[RefundJobItem], on_done: Callable[[], Any] = lambda: None
+) -> List[Tuple[RefundJobItem, RefundOutcome]]:
+    """Run the gateway refunds, calling ``on_done`` on this thread after each one."""
+    by_provider = defaultdict(list)
+    for item in items:
+        by_provider[item.provider].append(item)
+    pools = [ThreadPoolExecutor(max_workers=REFUND_JOB_CONCURRENCY) for _ in by_provider]
+    try:
+        futures = {
+            pool.submit(_refund, item): item
+            for pool, provider_items in zip(pools, by_provider.values())
+            for item in provider_items
+        }
+        results = []
+        for future in as_completed(futures):
+            results.append((futures[future], future.result()))
+            on_done()
+        return results
+    finally:
+        for pool in pools:
+            pool.shutdown()
+
+
+def _apply_results(job: RefundJob, results: List[Tuple[RefundJobItem, RefundOutcome]]) -> None:
+    now = timezone.now()
+    payments, refunded_orders, released, events, audits = [], [], [], [], []
+    for item, (ok, response) in results:
+        item.processed_at = now
+        item.response = response
+        if ok is None:
+            item.status = RefundJobItem.Status.SKIPPED
+            item.error = response["error"]
+            continue
+        if ok:
+            item.status = RefundJobItem.Status.SUCCEEDED
+            payment = item.payment
+            payment.status = Payment.Status.REFUNDED
+            payment.raw_response = {**(payment.raw_response or {}), "refund": response}
+            payments.append(payment)
+            refunded_orders.append(item.order_id)
+            events.append(
+                OrderStatusEvent(order_id=item.order_id, status=Order.Status.REFUNDED, note=f"Refund processed (job {job.pk})")
+            )
+        else:
+            item.status = RefundJobItem.Status.FAILED
+            item.error = response.get("error", "")[:255]
+            released.append(item.payment_id)
+        audits.append(
+            build_admin_action(
+                actor=job.created_by,
+                request=None,
+                resource="order",
+                action="refund",
+                object_pk=str(item.order_id),
+                status="success" if ok else "failure",
+                metadata={
+                    "refund_job": job.pk,
+                    "payment_id": item.payment_id,
+                    "provider": item.provider,
+                    "amount": str(item.amount),
+                    **({} if ok else {"error": item.error}),
+                },
+            )
+        )
+    with transaction.atomic():
+        RefundJobItem.objects.bulk_update(
+            [item for item, _ in results], ["status", "error", "response", "processed_at"]
+        )
+        if payments:
+            Payment.objects.bulk_update(payments, ["status", "raw_response"])
+            Order.objects.filter(pk__in=refunded_orders).update(
+                status=Order.Status.REFUNDED, payment_status=Order.PaymentStatus.REFUNDED
+            )
+            OrderStatusEvent.objects.bulk_create(events)
+        if released:
+            Payment.objects.filter(pk__in=released, status=Payment.Status.REFUNDED).update(
+                status=Payment.Status.SUCCEEDED
+            )
+        record_admin_actions(audits)
+
+
+def claimable_jobs() -> Q:
+    """Jobs a run may take: pending ones, and running ones whose worker stopped heartbeating."""
+    stale = timezone.now() - timedelta(seconds=REFUND_JOB_STALE_SECONDS)
+    return Q(status=RefundJob.Status.PENDING) | Q(status=RefundJob.Status.RUNNING, heartbeat_at__lt=stale)
+
+
+def run_refund_job(job_id: int, chunk_size: int = REFUND_JOB_CHUNK_SIZE) -> Optional[Dict[str, int]]:
+    """Refund every pending item of a job; returns its progress, or None if another run owns it.
+
+    Each item is moved to ``PROCESSING`` before its gateway call, so a second
+    run never refunds the same item twice. Items a dead worker left in
+    ``PROCESSING`` are not retried: their payment is claimed and whether the
+    provider refunded it has to be checked by hand.
+    """
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    claimed = RefundJob.objects.filter(claimable_jobs(), pk=job_id).update(
+        status=RefundJob.Status.RUNNING,
+        started_at=Coalesce("started_at", Value(now)),
+        heartbeat_at=now,
+        owner=token,
+    )
+    if not claimed:
+        return None
+    job = RefundJob.objects.select_related("created_by").get(pk=job_id)
+    owned = RefundJob.objects.filter(pk=job.pk, owner=token)
+
+    def heartbeat():
+        return owned.update(heartbeat_at=timezone.now())
+
+    while True:
+        chunk = list(
+            job.items.filter(status=RefundJobItem.Status.PENDING)
+            .select_related("order", "payment")
+            .order_by("pk")[:chunk_size]
+        )
+        if not chunk:
+            break
+        mine = [
+            item
+            for item in chunk
+            if RefundJobItem.objects.filter(pk=item.pk, status=RefundJobItem.Status.PENDING, job__owner=token).update(
+                status=RefundJobItem.Status.PROCESSING
+            )
+        ]
+        if not mine and not owned.exists():
+            # Taken over by another run; the items are its to finish.
+            return None
+        claimed_items, skipped = [], []
+        for item in mine:
+            if claim_payment_refund(item.payment_id):
+                claimed_items.append(item)
+            else:
+                skipped.append((item, (None, {"error": "payment_not_refundable"})))
+        # Outcomes are written even if the job was taken over meanwhile: these
+        # items are PROCESSING, which the new owner never picks up.
+        _apply_results(job, skipped + _refund_concurrently(claimed_items, on_done=heartbeat))
+        if not heartbeat():
+            return None
+    if not owned.update(status=RefundJob.Status.COMPLETED, finished_at=timezone.now()):
+        return None
+    job.refresh_from_db()
+    return refund_job_progress(job)
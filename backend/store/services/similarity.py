@@ -0,0 +1,191 @@
+"""Item-item similarity built with sparse matrix algebra.
+
+The batch side builds a user x product interaction matrix from purchases,
+wishlist adds and reviews, computes cosine similarity between product columns
+with sparse matrix products and keeps the top-K neighbours per product. The
+result is written as ``.npy`` arrays that API workers memory-map, so serving a
+recommendation is a binary search plus a row read.
+
+Each build gets its own directory under ``RECOMMENDATION_INDEX_DIR`` and the
+``CURRENT`` file names the live one; replacing that file is the only swap, so
+a reader always opens three arrays from the same build.
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+from django.conf import settings
+from scipy import sparse
+
+from ..models import OrderItem, Review, WishlistItem
+
+# Relative weight of each interaction type in the user x product matrix.
+PURCHASE_WEIGHT = 3.0
+WISHLIST_WEIGHT = 1.0
+# Reviews contribute rating / 5 * REVIEW_WEIGHT.
+REVIEW_WEIGHT = 2.0
+
+
+def build_interaction_matrix(order_statuses) -> Tuple[sparse.csr_matrix, np.ndarray]:
+    """Return a CSR users x products matrix and the product id for each column."""
+    users: List[np.ndarray] = []
+    products: List[np.ndarray] = []
+    weights: List[np.ndarray] = []
+
+    purchases = np.array(
+        list(
+            OrderItem.objects.filter(order__status__in=order_statuses).values_list("order__user_id", "product_id")
+        ),
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    users.append(purchases[:, 0])
+    products.append(purchases[:, 1])
+    weights.append(np.full(len(purchases), PURCHASE_WEIGHT, dtype=np.float32))
+
+    wishlisted = np.array(
+        list(WishlistItem.objects.values_list("wishlist__user_id", "product_id")),
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    users.append(wishlisted[:, 0])
+    products.append(wishlisted[:, 1])
+    weights.append(np.full(len(wishlisted), WISHLIST_WEIGHT, dtype=np.float32))
+
+    reviews = np.array(list(Review.objects.values_list("user_id", "product_id", "rating")), dtype=np.int64).reshape(-1, 3)
+    users.append(reviews[:, 0])
+    products.append(reviews[:, 1])
+    weights.append((reviews[:, 2] / 5.0 * REVIEW_WEIGHT).astype(np.float32))
+
+    user_ids, rows = np.unique(np.concatenate(users), return_inverse=True)
+    product_ids, cols = np.unique(np.concatenate(products), return_inverse=True)
+    matrix = sparse.coo_matrix(
+        (np.concatenate(weights), (rows, cols)),
+        shape=(len(user_ids), len(product_ids)),
+        dtype=np.float32,
+    ).tocsr()
+    # Duplicates were summed by the COO -> CSR conversion.
+    return matrix, product_ids
+
+
+def top_k_similar(matrix: sparse.spmatrix, top_k: int, block_size: int = 2048) -> Tuple[np.ndarray, np.ndarray]:
+    """Cosine top-K neighbours for every column of ``matrix``.
+
+    Returns ``(neighbours, scores)`` of shape ``(n_items, top_k)``; neighbours
+    are column indices, padded with ``-1`` where an item has fewer neighbours.
+    Similarity is computed block-wise so memory stays bounded by
+    ``block_size x n_items`` non-zeros.
+    """
+    items = sparse.csc_matrix(matrix, dtype=np.float32)
+    n_items = items.shape[1]
+    norms = np.sqrt(np.asarray(items.multiply(items).sum(axis=0)).ravel())
+    norms[norms == 0] = 1.0
+    normalized = (items @ sparse.diags(1.0 / norms)).tocsc()
+    normalized_t = normalized.T.tocsr()
+
+    neighbours = np.full((n_items, top_k), -1, dtype=np.int64)
+    scores = np.zeros((n_items, top_k), dtype=np.float32)
+    for start in range(0, n_items, block_size):
+        stop = min(start + block_size, n_items)
+        block = (normalized_t[start:stop] @ normalized).tocsr()
+        block.setdiag(0, k=start)
+        block.eliminate_zeros()
+        for offset in range(stop - start):
+            lo, hi = block.indptr[offset], block.indptr[offset + 1]
+            if lo == hi:
+                continue
+            row_scores = block.data[lo:hi]
+            row_items = block.indices[lo:hi]
+            keep = min(top_k, hi - lo)
+            best = np.argpartition(-row_scores, keep - 1)[:keep]
+            best = best[np.argsort(-row_scores[best], kind="stable")]
+            neighbours[start + offset, :keep] = row_items[best]
+            scores[start + offset, :keep] = row_scores[best]
+    return neighbours, scores
+
+
+def index_dir() -> Path:
+    return Path(settings.RECOMMENDATION_INDEX_DIR)
+
+
+# Names the live build directory inside ``index_dir()``.
+CURRENT_FILE = "CURRENT"
+# Builds kept on disk: the live one and the one before it, which readers that
+# read ``CURRENT`` just before the swap may still be opening.
+KEEP_BUILDS = 2
+
+
+def write_index(product_ids: np.ndarray, neighbours: np.ndarray, scores: np.ndarray, directory: Path | None = None) -> Path:
+    """Persist the index as a new build and point ``CURRENT`` at it atomically.
+
+    ``neighbours`` holds column indices and is translated to product ids here.
+    Returns the build directory.
+    """
+    directory = directory or index_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    neighbour_ids = np.where(neighbours >= 0, product_ids[np.clip(neighbours, 0, None)], -1)
+    # Names sort by creation time; the random suffix keeps concurrent builds apart.
+    build = Path(tempfile.mkdtemp(prefix=f"build-{time.time_ns():020d}-", dir=directory))
+    build.chmod(0o755)
+    np.save(build / "product_ids.npy", product_ids.astype(np.int64))
+    np.save(build / "neighbours.npy", neighbour_ids.astype(np.int64))
+    np.save(build / "scores.npy", scores.astype(np.float32))
+    pointer = directory / f"{CURRENT_FILE}.{build.name}.tmp"
+    pointer.write_text(build.name)
+    os.replace(pointer, directory / CURRENT_FILE)
+
+    builds = sorted(directory.glob("build-*"), reverse=True)
+    for old in builds[KEEP_BUILDS:]:
+        if old != build:
+            shutil.rmtree(old, ignore_errors=True)
+    return build
+
+
+class SimilarityIndex:
+    """Read-only view over a memory-mapped similarity index."""
+
+    def __init__(self, directory: Path):
+        self.product_ids = np.load(directory / "product_ids.npy", mmap_mode="r")
+        self.neighbours = np.load(directory / "neighbours.npy", mmap_mode="r")
+        self.scores = np.load(directory / "scores.npy", mmap_mode="r")
+
+    def similar(self, product_id: int, limit: int) -> List[int]:
+        pos = int(np.searchsorted(self.product_ids, product_id))
+        if pos >= len(self.product_ids) or int(self.product_ids[pos]) != product_id:
+            return []
+        row = self.neighbours[pos, :limit]
+        return [int(pid) for pid in row if pid >= 0]
+
+
+_index_cache: Dict[str, Tuple[str, SimilarityIndex]] = {}
+_index_lock = threading.Lock()
+
+
+def get_similarity_index() -> SimilarityIndex | None:
+    """Return the per-process index, reopening it when ``CURRENT`` names a new build."""
+    directory = index_dir()
+    try:
+        build = (directory / CURRENT_FILE).read_text().strip()
+    except OSError:
+        return None
+    if not build:
+        return None
+    key = str(directory)
+    cached = _index_cache.get(key)
+    if cached and cached[0] == build:
+        return cached[1]
+    with _index_lock:
+        cached = _index_cache.get(key)
+        if cached and cached[0] == build:
+            return cached[1]
+        try:
+            index = SimilarityIndex(directory / build)
+        except (OSError, ValueError):
+            return None
+        _index_cache[key] = (build, index)
+        return index
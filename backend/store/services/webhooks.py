@@ -0,0 +1,182 @@
+"""Applying gateway payment webhooks.
+
+``apply_webhook`` performs the order/payment updates for one verified
+webhook. The webhook endpoint either verifies and applies it inline or, with
+``PAYMENT_WEBHOOK_ASYNC`` enabled, only runs the gateway's local signature
+check, appends the raw request to ``WebhookInbox`` and answers the gateway
+immediately. ``process_inbox`` then runs the full ``verify_webhook`` (which
+may call the provider) outside any lock and applies the verified events in
+batches. Each order's events are applied in arrival order while holding the
+order row lock, so concurrent workers never apply the same event twice or
+interleave updates to one order.
+"""
+from __future__ import annotations
+
+import io
+import json
+import logging
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.core.files.uploadhandler import load_handler
+from django.db import transaction
+from django.db.models import F
+from django.http import QueryDict
+from django.http.multipartparser import MultiPartParser, MultiPartParserError
+from django.utils import timezone
+from django.utils.datastructures import CaseInsensitiveMapping
+from django.utils.http import parse_header_parameters
+from rest_framework.exceptions import ParseError, UnsupportedMediaType
+
+from ..constants import WEBHOOK_INBOX_MAX_ATTEMPTS
+from ..metrics import PAYMENT_FAILURES, WEBHOOK_APPLY_LAG_SECONDS
+from ..models import Order, Payment, PaymentEvent, WebhookInbox
+from ..payments.base import InvalidSignature, WebhookPayload, get_gateway
+from .payments import fail_payment, finalize_payment
+
+log = logging.getLogger(__name__)
+
+# Credentials are never needed to verify a webhook, so they are not queued.
+_UNQUEUED_HEADERS = {"authorization", "cookie"}
+
+
+def decode_webhook_body(raw: bytes, content_type: str, encoding: Optional[str] = None):
+    """Webhook fields decoded from ``raw``, the body the signature is checked on.
+
+    ``content_type`` is the full header (a multipart body needs its boundary).
+    """
+    media_type, params = parse_header_parameters(content_type or "")
+    encoding = encoding or params.get("charset") or settings.DEFAULT_CHARSET
+    if media_type == "application/json":
+        try:
+            return json.loads(raw or b"{}")
+        except ValueError:
+            raise ParseError("Malformed JSON webhook body")
+    if media_type == "application/x-www-form-urlencoded":
+        return QueryDict(raw, encoding=encoding)
+    if media_type == "multipart/form-data":
+        meta = {"CONTENT_TYPE": content_type, "CONTENT_LENGTH": len(raw)}
+        handlers = [load_handler(path) for path in settings.FILE_UPLOAD_HANDLERS]
+        try:
+            data, _files = MultiPartParser(meta, io.BytesIO(raw), handlers, encoding).parse()
+        except MultiPartParserError as exc:
+            raise ParseError(f"Malformed multipart webhook body: {exc}")
+        return data
+    raise UnsupportedMediaType(media_type)
+
+
+def apply_webhook(
+    order: Order, provider: str, ok: bool, result: Dict[str, Any], provider_payment_id: Optional[str] = None
+) -> bool:
+    """Mark ``order`` paid or failed from a verified webhook. Call inside a transaction.
+
+    Returns False without touching the order when the ledger already holds
+    this outcome for the payment (a gateway retry, or a verify callback that
+    got there first).
+    """
+    provider_payment_id = result.get("provider_payment_id") or provider_payment_id
+    payment = Payment.objects.filter(order=order, provider=provider).first()
+    if not payment and provider_payment_id:
+        payment = Payment.objects.filter(provider_payment_id=provider_payment_id).first()
+    if ok:
+        return finalize_payment(order, payment, provider, PaymentEvent.Source.WEBHOOK, result)
+
+    if not fail_payment(order, payment, provider, PaymentEvent.Source.WEBHOOK, result):
+        return False
+    PAYMENT_FAILURES.labels(provider=provider or "unknown").inc()
+    return True
+
+
+def enqueue_webhook(
+    order: Order, provider: str, body: bytes, content_type: str, headers: Mapping[str, Any]
+) -> WebhookInbox:
+    """Queue a webhook whose signature passed the gateway's local check."""
+    headers = {key: value for key, value in headers.items() if key.lower() not in _UNQUEUED_HEADERS}
+    return WebhookInbox.objects.create(
+        order=order, provider=provider, body=body, content_type=content_type, headers=headers
+    )
+
+
+def _pending():
+    return WebhookInbox.objects.filter(processed_at__isnull=True, attempts__lt=WEBHOOK_INBOX_MAX_ATTEMPTS)
+
+
+def _verify_event(event: WebhookInbox) -> None:
+    """Run the gateway's full verification (remote lookups included) for a queued event."""
+    body = bytes(event.body)
+    payload = WebhookPayload(lambda: decode_webhook_body(body, event.content_type))
+    try:
+        ok, result = get_gateway(event.provider).verify_webhook(payload, CaseInsensitiveMapping(event.headers), body)
+    except InvalidSignature:
+        WebhookInbox.objects.filter(pk=event.pk).update(
+            succeeded=False, processed_at=timezone.now(), last_error="invalid_signature"
+        )
+        return
+    WebhookInbox.objects.filter(pk=event.pk, succeeded__isnull=True).update(succeeded=ok, result=result)
+
+
+def _verify_order_events(order_id: int) -> bool:
+    """Verify an order's unverified events oldest first, without holding its lock.
+
+    Stops at the first event that fails to verify, records the attempt on it
+    and returns False; its later events wait for it.
+    """
+    for event in _pending().filter(order_id=order_id, succeeded__isnull=True).order_by("id"):
+        try:
+            _verify_event(event)
+        except Exception as exc:
+            log.exception("Verifying webhook %s failed", event.pk)
+            WebhookInbox.objects.filter(pk=event.pk).update(attempts=F("attempts") + 1, last_error=str(exc)[:255])
+            return False
+    return True
+
+
+def _apply_order_events(order_id: int) -> int:
+    """Apply an order's verified pending events, oldest first, under its row lock.
+
+    Stops before the first event that is not verified yet.
+    """
+    with transaction.atomic():
+        order = Order.objects.select_for_update().get(pk=order_id)
+        # Re-read under the lock: another worker may have applied them already.
+        events = []
+        for event in _pending().filter(order_id=order_id).order_by("id"):
+            if event.succeeded is None:
+                break
+            events.append(event)
+        now = timezone.now()
+        for event in events:
+            apply_webhook(order, event.provider, event.succeeded, event.result)
+            WEBHOOK_APPLY_LAG_SECONDS.labels(provider=event.provider).observe((now - event.received_at).total_seconds())
+        WebhookInbox.objects.filter(pk__in=[event.pk for event in events]).update(processed_at=now)
+    return len(events)
+
+
+def process_inbox(batch_size: int = 200) -> Dict[str, int]:
+    """Apply queued webhooks in batches until the inbox is drained.
+
+    A failing order is skipped for the rest of the run so its later events are
+    not applied out of order; the event that failed to verify, or its oldest
+    event when applying fails, records the attempt and error.
+    """
+    applied = 0
+    failed_orders = set()
+    while True:
+        rows = _pending().exclude(order_id__in=failed_orders).order_by("id").values_list("order_id", flat=True)
+        order_ids = list(OrderedDict.fromkeys(rows[:batch_size]))
+        if not order_ids:
+            break
+        for order_id in order_ids:
+            try:
+                verified = _verify_order_events(order_id)
+                applied += _apply_order_events(order_id)
+                if not verified:
+                    failed_orders.add(order_id)
+            except Exception as exc:
+                log.exception("Applying webhooks for order %s failed", order_id)
+                failed_orders.add(order_id)
+                oldest = _pending().filter(order_id=order_id).order_by("id").values_list("pk", flat=True).first()
+                WebhookInbox.objects.filter(pk=oldest).update(attempts=F("attempts") + 1, last_error=str(exc)[:255])
+    return {"applied": applied, "failed_orders": len(failed_orders)}
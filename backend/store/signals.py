@@ -1,10 +1,56 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 
-from .models import User, Wishlist
+from .models import Coupon, Inventory, Order, Product, User, Wishlist
 
 
 @receiver(post_save, sender=User)
 def ensure_wishlist(sender, instance: User, created: bool, **kwargs):
     if created:
         Wishlist.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Order)
+def update_copurchases_on_paid(sender, instance: Order, update_fields=None, **kwargs):
+    if instance.status != Order.Status.PAID:
+        return
+    if update_fields is not None and "status" not in update_fields:
+        return
+    from .tasks import update_copurchase_matrix_for_order
+
+    def _enqueue():
+        try:
+            update_copurchase_matrix_for_order.delay(instance.id)
+        except Exception:
+            pass
+
+    transaction.on_commit(_enqueue)
+
+
+@receiver(pre_save, sender=Coupon)
+def remember_coupon_code(sender, instance: Coupon, **kwargs):
+    if instance.pk:
+        instance._previous_code = Coupon.objects.filter(pk=instance.pk).values_list("code", flat=True).first()
+
+
+@receiver(post_save, sender=Coupon)
+@receiver(post_delete, sender=Coupon)
+def invalidate_coupon_lookup(sender, instance: Coupon, **kwargs):
+    from .services.coupons import invalidate_coupon_cache
+
+    codes = (instance.code, getattr(instance, "_previous_code", None))
+    invalidate_coupon_cache(*codes)
+    # Again after commit, in case a reader re-cached the old row meanwhile.
+    transaction.on_commit(lambda: invalidate_coupon_cache(*codes))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Inventory)
+@receiver(post_delete, sender=Inventory)
+def invalidate_priced_carts(sender, **kwargs):
+    from .services.pricing import bump_pricing_epoch
+
+    bump_pricing_epoch()
+    transaction.on_commit(bump_pricing_epoch)
@@ -2,13 +2,18 @@ from __future__ import annotations
 
 import math
 import uuid
+from collections import Counter, defaultdict
 from datetime import timedelta
 from decimal import Decimal
+from itertools import groupby
+from operator import itemgetter
 from typing import Dict, Iterable
 
 from celery import shared_task
 from celery.utils.log import get_task_logger
+from django.core.cache import cache
 from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
 
 from .adapters.base import get_adapter_for_supplier
@@ -21,10 +26,14 @@ from .models import (
     Order,
     OrderItem,
     Notification,
-    CouponRedemption,
+    ProductCoPurchase,
+    OrderStatusEvent,
     Payment as PaymentModel,
+    PaymentEvent,
+    RefundJob,
 )
-from .metrics import SUPPLIER_SYNC_FAILURES, PAYMENT_FAILURES
+from .constants import COPURCHASE_ORDER_MARKER_TTL_SECONDS, RECOMMENDATION_TOP_K
+from .metrics import CART_LIVE_KEYS, CART_MEMORY_BYTES, SUPPLIER_SYNC_FAILURES, PAYMENT_FAILURES
 from .payments.base import get_gateway
 
 log = get_task_logger(__name__)
@@ -161,6 +170,8 @@ def auto_forward_order_to_supplier(order_id: int):
 @shared_task(autoretry_for=(Exception,), retry_backoff=True, retry_kwargs={"max_retries": 3})
 def reconcile_payments():
     """Compare local payments with gateway-reported statuses and update mismatches."""
+    from .services.payments import finalize_payment
+
     mismatches = []
     qs = PaymentModel.objects.all()
     for p in qs:
@@ -168,18 +179,8 @@ def reconcile_payments():
             gw = get_gateway(p.provider)
             status = gw.fetch_payment_status(p.provider_payment_id)
             remote = (status.get("status") or "").lower()
-            local = p.status
-            if remote in ("succeeded", "paid") and local != PaymentModel.Status.SUCCEEDED:
-                p.status = PaymentModel.Status.SUCCEEDED
-                p.save(update_fields=["status"])
-                if p.order.status != Order.Status.PAID:
-                    p.order.status = Order.Status.PAID
-                    p.order.payment_status = Order.PaymentStatus.PAID
-                    p.order.save(update_fields=["status", "payment_status"])
-                if p.order.coupon:
-                    CouponRedemption.objects.get_or_create(order=p.order, coupon=p.order.coupon, user=p.order.user)
-                if p.order.referral_coupon:
-                    CouponRedemption.objects.get_or_create(order=p.order, coupon=p.order.referral_coupon, user=p.order.user)
+            if remote in ("succeeded", "paid") and p.status != PaymentModel.Status.SUCCEEDED:
+                finalize_payment(p.order, p, p.provider, PaymentEvent.Source.RECONCILE, status)
                 mismatches.append(p.id)
         except NotImplementedError:
             continue
@@ -227,3 +228,182 @@ def send_abandoned_checkout_notifications():
         )
         created += 1
     return {"notifications": created}
+
+
+COPURCHASE_ORDER_STATUSES = [
+    Order.Status.PAID,
+    Order.Status.PROCESSING,
+    Order.Status.SHIPPED,
+    Order.Status.DELIVERED,
+]
+
+
+@shared_task
+def rebuild_copurchase_matrix(top_k: int = RECOMMENDATION_TOP_K):
+    """Recompute the co-purchase table from order history, keeping top-K neighbours per product."""
+    rows = (
+        OrderItem.objects.filter(order__status__in=COPURCHASE_ORDER_STATUSES)
+        .order_by("order_id")
+        .values_list("order_id", "product_id")
+        .iterator(chunk_size=5000)
+    )
+    counts: Dict[int, Counter] = defaultdict(Counter)
+    for _, group in groupby(rows, key=itemgetter(0)):
+        product_ids = {product_id for _, product_id in group}
+        for product_id in product_ids:
+            for related_id in product_ids:
+                if related_id != product_id:
+                    counts[product_id][related_id] += 1
+
+    entries = [
+        ProductCoPurchase(product_id=product_id, related_id=related_id, count=count)
+        for product_id, neighbours in counts.items()
+        for related_id, count in neighbours.most_common(top_k)
+    ]
+    with transaction.atomic():
+        ProductCoPurchase.objects.all().delete()
+        ProductCoPurchase.objects.bulk_create(entries, batch_size=1000)
+    log.info("Rebuilt co-purchase matrix: %s products, %s pairs", len(counts), len(entries))
+    return {"products": len(counts), "pairs": len(entries)}
+
+
+@shared_task
+def update_copurchase_matrix_for_order(order_id: int):
+    """Fold a newly paid order into the co-purchase table.
+
+    Counting is best-effort idempotent via a cache marker; the periodic
+    rebuild remains the source of truth.
+    """
+    if not cache.add(f"copurchase:order:{order_id}", 1, timeout=COPURCHASE_ORDER_MARKER_TTL_SECONDS):
+        return {"skipped": True}
+    product_ids = set(OrderItem.objects.filter(order_id=order_id).values_list("product_id", flat=True))
+    if len(product_ids) < 2:
+        return {"pairs": 0}
+    with transaction.atomic():
+        pairs = ProductCoPurchase.objects.filter(product_id__in=product_ids, related_id__in=product_ids)
+        existing = set(pairs.values_list("product_id", "related_id"))
+        pairs.update(count=F("count") + 1)
+        missing = [
+            ProductCoPurchase(product_id=product_id, related_id=related_id, count=1)
+            for product_id in product_ids
+            for related_id in product_ids
+            if related_id != product_id and (product_id, related_id) not in existing
+        ]
+        ProductCoPurchase.objects.bulk_create(missing, ignore_conflicts=True)
+    return {"pairs": len(product_ids) * (len(product_ids) - 1)}
+
+
+@shared_task
+def build_similarity_index(top_k: int = RECOMMENDATION_TOP_K):
+    """Rebuild the memory-mapped item-item similarity index used by recommendations."""
+    from .services.similarity import build_interaction_matrix, top_k_similar, write_index
+
+    matrix, product_ids = build_interaction_matrix(COPURCHASE_ORDER_STATUSES)
+    neighbours, scores = top_k_similar(matrix, top_k)
+    directory = write_index(product_ids, neighbours, scores)
+    log.info("Built similarity index: %s users x %s products -> %s", matrix.shape[0], matrix.shape[1], directory)
+    return {"users": matrix.shape[0], "products": matrix.shape[1], "interactions": int(matrix.nnz)}
+
+
+@shared_task
+def release_expired_reservations(batch_size: int = 500):
+    """Return stock from expired checkout holds and cancel the unpaid orders they belonged to.
+
+    Coupon claims made by cancelled orders are released as well. An order is
+    cancelled with a conditional UPDATE, and its holds and coupons are only
+    released if that wins, so a payment landing meanwhile is never undone.
+    """
+    from .services.coupons import release_order_redemptions
+    from .services.inventory import expired_reservations, release_reservations
+
+    released = 0
+    cancelled = 0
+    # Holds of orders that were paid while this run was looking at them.
+    skipped = set()
+    while True:
+        batch = list(expired_reservations().exclude(pk__in=skipped)[:batch_size])
+        if not batch:
+            break
+        holds = defaultdict(list)
+        for reservation in batch:
+            holds[reservation.order_id].append(reservation)
+        unpaid = list(
+            Order.objects.filter(
+                id__in=[order_id for order_id in holds if order_id],
+                status=Order.Status.PENDING,
+                payment_status__in=[Order.PaymentStatus.PENDING, Order.PaymentStatus.FAILED],
+            )
+        )
+        # Holds with no order awaiting payment go straight back to stock.
+        unpaid_ids = {order.pk for order in unpaid}
+        released += release_reservations(
+            reservation for order_id, reservations in holds.items() if order_id not in unpaid_ids for reservation in reservations
+        )
+        for order in unpaid:
+            with transaction.atomic():
+                won = (
+                    Order.objects.filter(pk=order.pk, status=Order.Status.PENDING)
+                    .exclude(payment_status=Order.PaymentStatus.PAID)
+                    .update(status=Order.Status.CANCELLED)
+                )
+                if not won:
+                    skipped.update(reservation.pk for reservation in holds[order.pk])
+                    continue
+                released += release_reservations(holds[order.pk])
+                OrderStatusEvent.objects.create(order=order, status=Order.Status.CANCELLED, note="Reservation expired")
+                release_order_redemptions(order)
+            cancelled += 1
+    return {"released": released, "cancelled": cancelled}
+
+
+@shared_task
+def poll_pending_payments(batch_size: int = 200):
+    """Resolve pending payment intents by polling their gateways on a backoff schedule."""
+    from .services.payments import poll_due_payments, poll_lock_timeout
+
+    # One run at a time keeps the per-provider concurrency cap global. The
+    # lock outlives the slowest possible run so a second one cannot start
+    # while the first is still waiting on gateways.
+    if not cache.add("payments:poll:lock", 1, timeout=poll_lock_timeout(batch_size)):
+        return {"skipped": True}
+    try:
+        return poll_due_payments(batch_size=batch_size)
+    finally:
+        cache.delete("payments:poll:lock")
+
+
+@shared_task
+def process_webhook_inbox(batch_size: int = 200):
+    """Apply payment webhooks queued by the endpoint's async intake mode."""
+    from .services.webhooks import process_inbox
+
+    return process_inbox(batch_size=batch_size)
+
+
+@shared_task
+def process_refund_jobs(job_id: int | None = None):
+    """Run one bulk refund job, or every job still waiting.
+
+    Beat picks up jobs whose enqueue was lost and running jobs whose worker died.
+    """
+    from .services.refunds import claimable_jobs, run_refund_job
+
+    if job_id is not None:
+        return {job_id: run_refund_job(job_id)}
+    waiting = RefundJob.objects.filter(claimable_jobs()).order_by("pk").values_list("pk", flat=True)
+    return {pk: run_refund_job(pk) for pk in waiting}
+
+
+@shared_task
+def sweep_carts(batch_size: int = 1000):
+    """Report live cart counts and memory per kind and give TTL-less cart keys an expiry.
+
+    Only the Redis cart store can be enumerated; with the cache store this is a no-op.
+    """
+    from .services.cart import get_cart_store
+
+    stats = get_cart_store().sweep(batch_size=batch_size)
+    for kind, values in stats.items():
+        CART_LIVE_KEYS.labels(kind=kind).set(values["keys"])
+        CART_MEMORY_BYTES.labels(kind=kind).set(values["bytes"])
+    return stats
@@ -0,0 +1,13 @@
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class CouponValidateThrottle(SimpleRateThrottle):
+    """Per-IP rate limit for coupon validation, applied to signed-in users too.
+
+    Counters live in the default cache, next to the coupon lookup cache.
+    """
+
+    scope = "coupon_validate"
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {"scope": self.scope, "ident": self.get_ident(request)}
@@ -15,6 +15,8 @@ from store.models import (
     ContentPage,
     OrderItem,
     OrderStatusEvent,
+    ProductVariant,
+    User,
 )
 from .factories import (
     create_user,
@@ -24,6 +26,12 @@ from .factories import (
     ensure_inventory,
     ensure_address,
 )
+from store.tasks import rebuild_copurchase_matrix
+
+# A COD checkout priced from the cart snapshot: stock UPDATE + reservation
+# insert, order, items, reservation link, events, notification and payment
+# inserts, plus two savepoint pairs. Independent of the number of cart lines.
+CHECKOUT_COD_QUERIES = 12
 
 
 @pytest.mark.django_db
@@ -65,6 +73,96 @@ def test_products_list_and_filtering():
     assert resp.json()["count"] == 1
 
 
+@pytest.mark.django_db
+def test_product_facets_follow_filters():
+    client = APIClient()
+    phones = create_category("Phones")
+    laptops = create_category("Laptops")
+    sup = create_supplier("FacetCo")
+    p1 = create_product("Alpha Phone", "FCT-001", phones, sup, price=Decimal("19.99"))
+    p2 = create_product("Beta Phone", "FCT-002", phones, sup, price=Decimal("79.00"))
+    p3 = create_product("Gamma Laptop", "FCT-003", laptops, sup, price=Decimal("999.00"))
+    p1.brand = p2.brand = "Acme"
+    p1.save(update_fields=["brand"])
+    p2.save(update_fields=["brand"])
+    ensure_inventory(p1, 5)
+    ensure_inventory(p2, 0)
+    ensure_inventory(p3, 2)
+    ProductVariant.objects.create(product=p1, size="M", color="Black")
+    ProductVariant.objects.create(product=p1, size="L", color="Black")
+    ProductVariant.objects.create(product=p2, size="M", color="White")
+
+    resp = client.get("/api/products/facets/")
+    assert resp.status_code == 200
+    facets = resp.json()
+    assert facets["total"] == 3
+    assert {row["value"]: row["count"] for row in facets["category"]} == {"phones": 2, "laptops": 1}
+    assert facets["brand"] == [{"value": "Acme", "count": 2}]
+    assert {row["value"]: row["count"] for row in facets["size"]} == {"M": 2, "L": 1}
+    assert {row["value"]: row["count"] for row in facets["color"]} == {"Black": 1, "White": 1}
+    assert facets["stock"] == {"in_stock": 2, "out_of_stock": 1}
+    assert sum(row["count"] for row in facets["price"]) == 3
+
+    resp = client.get(f"/api/products/facets/?category={phones.slug}&size=M")
+    facets = resp.json()
+    assert facets["total"] == 2
+    assert facets["category"] == [{"value": "phones", "label": "Phones", "count": 2}]
+    assert facets["stock"] == {"in_stock": 1, "out_of_stock": 1}
+
+    resp = client.get("/api/products/facets/?stock=true")
+    assert resp.json()["stock"] == {"in_stock": 2, "out_of_stock": 0}
+
+
+@pytest.mark.django_db
+def test_product_list_sparse_fieldsets():
+    client = APIClient()
+    cat = create_category("Shoes")
+    sup = create_supplier("ShoeCo")
+    p = create_product("Runner", "SPF-001", cat, sup, price=Decimal("59.00"))
+    ensure_inventory(p, 3)
+    ProductVariant.objects.create(product=p, size="42", color="Red")
+
+    full = client.get("/api/products/").json()["results"][0]
+    assert "variants" in full and "description" in full
+
+    card = client.get("/api/products/?expand=").json()["results"][0]
+    assert set(card) == {
+        "id", "title", "slug", "base_price", "sku", "images", "brand", "avg_rating", "stock_qty", "urgency_copy",
+    }
+    assert card["stock_qty"] == 3
+    assert card["urgency_copy"] == "Only 3 left in stock"
+    assert card["base_price"] == full["base_price"]
+
+    expanded = client.get("/api/products/?expand=category,variants,size_guide").json()["results"][0]
+    assert expanded["category"] == full["category"]
+    assert expanded["variants"] == full["variants"]
+    assert "size_guide" in expanded
+
+    picked = client.get(f"/api/products/{p.slug}/?fields=title,supplier,bogus").json()
+    assert picked == {"id": p.id, "title": "Runner", "supplier": full["supplier"]}
+
+
+@pytest.mark.django_db
+def test_compiled_list_endpoints_match_drf(settings):
+    cat = create_category("Lamps")
+    sup = create_supplier("LampCo")
+    products = [create_product(f"Lamp {i}", f"LMP-{i}", cat, sup, price=Decimal("20.00") + i) for i in range(3)]
+    ensure_inventory(products[0], 2)
+    user = create_user("lamps@example.com")
+    Review.objects.create(user=user, product=products[1], rating=3)
+    address = ensure_address(user)
+    order = Order.objects.create(user=user, total_amount=Decimal("41.00"), shipping_address=address, billing_address=address)
+    OrderItem.objects.create(order=order, product=products[0], unit_price=Decimal("20.00"), quantity=2)
+
+    client = APIClient()
+    client.force_authenticate(user)
+    urls = ["/api/products/?ordering=-avg_rating", "/api/products/?expand=variants&stock=true", "/api/orders/"]
+    settings.COMPILED_SERIALIZERS = True
+    compiled = [client.get(url).content for url in urls]
+    settings.COMPILED_SERIALIZERS = False
+    assert compiled == [client.get(url).content for url in urls]
+
+
 @pytest.mark.django_db
 def test_cart_operations_guest():
     client = APIClient()
@@ -89,6 +187,98 @@ def test_cart_operations_guest():
     assert resp.json()["items"] == []
 
 
+@pytest.mark.django_db
+def test_cart_hydrates_in_one_query(django_assert_num_queries):
+    client = APIClient()
+    cat = create_category("Kitchen")
+    sup = create_supplier("KitchenCo")
+    products = [create_product(f"Pan {i}", f"PAN-{i}", cat, sup, price=Decimal("7.50")) for i in range(4)]
+    for product in products[:3]:
+        ensure_inventory(product, 5)
+        client.post("/api/cart/", {"product_id": product.id, "quantity": 1}, format="json")
+
+    # Served from the priced snapshot the last add stored.
+    with django_assert_num_queries(0):
+        resp = client.get("/api/cart/")
+    assert [item["product"]["id"] for item in resp.json()["items"]] == [p.id for p in products[:3]]
+    assert resp.json()["total"] == "22.50"
+
+    with django_assert_num_queries(1):
+        resp = client.patch("/api/cart/", {"product_id": products[0].id, "quantity": 3}, format="json")
+    assert resp.json()["total"] == "37.50"
+
+    products[1].active = False
+    products[1].save(update_fields=["active"])
+    resp = client.post("/api/cart/", {"product_id": products[3].id}, format="json")
+    assert resp.status_code == 400
+    resp = client.get("/api/cart/")
+    assert [item["product"]["id"] for item in resp.json()["items"]] == [products[0].id, products[2].id]
+
+
+@pytest.mark.django_db
+def test_cart_line_updates_and_guest_merge():
+    cat = create_category("Garden")
+    sup = create_supplier("GardenCo")
+    hose = create_product("Hose", "GRD-1", cat, sup, price=Decimal("15.00"))
+    rake = create_product("Rake", "GRD-2", cat, sup, price=Decimal("9.00"))
+    ensure_inventory(hose, 4)
+    ensure_inventory(rake, 10)
+
+    guest = APIClient()
+    guest.post("/api/cart/", {"product_id": hose.id, "quantity": 3}, format="json")
+    cart_key = guest.cookies["cart_key"].value
+    resp = guest.post("/api/cart/", {"product_id": hose.id, "quantity": 2}, format="json")
+    assert resp.status_code == 400
+    guest.post("/api/cart/", {"product_id": rake.id, "quantity": 1}, format="json")
+    guest.post("/api/cart/save-for-later/", {"product_id": rake.id}, format="json")
+    assert [item["quantity"] for item in guest.get("/api/cart/").json()["items"]] == [3]
+
+    user = create_user("merge@example.com")
+    member = APIClient()
+    member.force_authenticate(user)
+    member.post("/api/cart/", {"product_id": hose.id, "quantity": 1}, format="json")
+    member.cookies["cart_key"] = cart_key
+    resp = member.post("/api/cart/merge/")
+    assert resp.json() == {"merged": True, "items": {str(hose.id): 4}}
+    assert [item["product"]["id"] for item in member.get("/api/cart/save-for-later/").json()["items"]] == [rake.id]
+    assert guest.get("/api/cart/").json()["items"] == []
+
+
+@pytest.mark.django_db
+def test_guest_cart_key_minted_on_first_write_and_stored_packed():
+    from django.core.cache import cache
+
+    from store.constants import CART_GUEST_TTL_SECONDS
+    from store.services.cart import cart_kind, cart_ttl, unpack_cart
+    from store.tasks import sweep_carts
+
+    cat = create_category("Toys")
+    sup = create_supplier("ToyCo")
+    kite = create_product("Kite", "TOY-1", cat, sup, price=Decimal("12.00"))
+    ensure_inventory(kite, 5)
+
+    guest = APIClient()
+    resp = guest.get("/api/cart/")
+    assert resp.json()["items"] == []
+    assert "cart_key" not in resp.cookies
+    assert guest.get("/api/cart/save-for-later/").json()["items"] == []
+    assert "cart_key" not in guest.cookies
+
+    resp = guest.post("/api/cart/", {"product_id": kite.id, "quantity": 2}, format="json")
+    token = resp.cookies["cart_key"].value
+    assert token.startswith("guest:")
+    key = f"cart:{token}"
+    raw = cache.get(key)
+    assert isinstance(raw, bytes)
+    assert unpack_cart(raw) == {kite.id: 2}
+    assert (cart_kind(key), cart_ttl(key)) == ("guest", CART_GUEST_TTL_SECONDS)
+    assert cart_kind(key + ":saved") == "guest_saved"
+    assert "cart_key" not in guest.get("/api/cart/").cookies
+
+    # The cache store cannot be enumerated, so the sweeper only reports on Redis.
+    assert sweep_carts() == {}
+
+
 @pytest.mark.django_db
 def test_checkout_and_webhook_success(monkeypatch):
     client = APIClient()
@@ -121,7 +311,7 @@ def test_checkout_and_webhook_success(monkeypatch):
         status_code = 200
         text = "Success"
 
-    monkeypatch.setattr("store.views.requests.get", lambda *args, **kwargs: DummyResp())
+    monkeypatch.setattr("store.payments.base.gateway_request", lambda *args, **kwargs: DummyResp())
 
     hook = client.get(
         "/api/payments/verify/",
@@ -137,6 +327,198 @@ def test_checkout_and_webhook_success(monkeypatch):
     assert Order.objects.get(id=order_id).status == Order.Status.PAID
 
 
+@pytest.mark.django_db
+def test_checkout_reserves_stock_and_releases_on_failure():
+    from store.models import Inventory, InventoryReservation
+
+    client = APIClient()
+    user = create_user("reserve@example.com")
+    client.force_authenticate(user)
+    addr = ensure_address(user)
+    prod = create_product("Drop Tee", "DROP-1", create_category("Drops"), create_supplier("DropCo"), price=Decimal("25.00"))
+    ensure_inventory(prod, 3)
+
+    client.post("/api/cart/", {"product_id": prod.id, "quantity": 2}, format="json")
+    resp = client.post(
+        "/api/checkout/",
+        {"shipping_address": addr.id, "provider": "esewa", "coupon_code": "NOPE"},
+        format="json",
+    )
+    assert resp.status_code == 400
+    assert Inventory.objects.get(product=prod).quantity == 3
+    assert not Order.objects.filter(user=user).exists()
+    assert InventoryReservation.objects.get().status == InventoryReservation.Status.RELEASED
+
+    resp = client.post("/api/checkout/", {"shipping_address": addr.id, "provider": "esewa"}, format="json")
+    assert resp.status_code == 201
+    order = Order.objects.get(id=resp.json()["order_id"])
+    assert Inventory.objects.get(product=prod).quantity == 1
+    hold = order.reservations.get()
+    assert (hold.status, hold.quantity) == (InventoryReservation.Status.HELD, 2)
+
+    client.post("/api/cart/", {"product_id": prod.id, "quantity": 1}, format="json")
+    Inventory.objects.filter(product=prod).update(quantity=0)
+    resp = client.post("/api/checkout/", {"shipping_address": addr.id, "provider": "esewa"}, format="json")
+    assert resp.json() == {"detail": "Product currently out of stock"}
+    Inventory.objects.filter(product=prod).update(quantity=1)
+
+    from store.services.inventory import release_order_reservations
+
+    release_order_reservations(order)
+    release_order_reservations(order)
+    assert Inventory.objects.get(product=prod).quantity == 3
+
+
+@pytest.mark.django_db
+def test_checkout_commits_order_before_intent_and_retries(monkeypatch):
+    from datetime import timedelta
+
+    from django.db import connection
+    from django.utils import timezone
+    from prometheus_client import REGISTRY
+
+    from store.constants import PAYMENT_INTENT_STALE_SECONDS
+
+    from store.models import Payment
+    from store.payments.esewa import ESewaGateway
+
+    client = APIClient()
+    user = create_user("intent@example.com")
+    client.force_authenticate(user)
+    addr = ensure_address(user)
+    prod = create_product("Cap", "CAP-1", create_category("Caps"), create_supplier("CapCo"), price=Decimal("12.00"))
+    ensure_inventory(prod, 5)
+    client.post("/api/cart/", {"product_id": prod.id, "quantity": 1}, format="json")
+
+    test_depth = len(connection.atomic_blocks)
+    calls = []
+
+    def flaky_intent(self, order, **kwargs):
+        calls.append((len(connection.atomic_blocks), kwargs.get("idempotency_key")))
+        if len(calls) == 1:
+            raise RuntimeError("gateway timeout")
+        return {"provider_payment_id": f"esewa_{order.id}", "payment_url": "https://pay.example/x", "amount_npr": "12.00"}
+
+    monkeypatch.setattr(ESewaGateway, "create_payment_intent", flaky_intent)
+
+    resp = client.post("/api/checkout/", {"shipping_address": addr.id, "provider": "esewa"}, format="json")
+    assert resp.status_code == 502
+    order_id = resp.json()["order_id"]
+    order = Order.objects.get(id=order_id)
+    assert order.status == Order.Status.PENDING
+    assert order.reservations.count() == 1
+    payment = order.payments.get()
+    assert payment.status == Payment.Status.INTENT_FAILED
+    assert calls[0] == (test_depth, f"order-{order_id}-payment-intent")
+    retry_url = f"/api/checkout/{order_id}/payment-intent/"
+
+    # A worker that dies mid-call leaves the intent pending: a recent attempt
+    # is left alone, a stale one can be retried.
+    Payment.objects.filter(pk=payment.pk).update(status=Payment.Status.INTENT_PENDING, intent_started_at=timezone.now())
+    assert client.post(retry_url).status_code == 409
+    stale = timezone.now() - timedelta(seconds=PAYMENT_INTENT_STALE_SECONDS + 1)
+    Payment.objects.filter(pk=payment.pk).update(intent_started_at=stale)
+
+    resp = client.post(retry_url)
+    assert resp.status_code == 200
+    assert resp.json()["payment_intent"]["payment_url"] == "https://pay.example/x"
+    payment.refresh_from_db()
+    assert (payment.status, payment.provider_payment_id) == (Payment.Status.PENDING, f"esewa_{order_id}")
+
+    # Retrying again returns the stored intent without another gateway call.
+    resp = client.post(retry_url)
+    assert resp.status_code == 200
+    assert resp.json()["payment_intent"]["provider_payment_id"] == f"esewa_{order_id}"
+    assert len(calls) == 2
+
+    other = APIClient()
+    other.force_authenticate(create_user("someone@example.com"))
+    assert other.post(retry_url).status_code == 404
+
+    # Unknown or malformed providers are rejected and labelled "invalid" in the latency metric.
+    before = REGISTRY.get_sample_value("checkout_latency_seconds_count", {"provider": "invalid"}) or 0
+    assert client.post("/api/checkout/", {"shipping_address": addr.id, "provider": {"name": "x"}}, format="json").status_code == 400
+    assert client.post("/api/checkout/", {"shipping_address": addr.id, "provider": "x" * 64}, format="json").status_code == 400
+    assert REGISTRY.get_sample_value("checkout_latency_seconds_count", {"provider": "invalid"}) == before + 2
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_multi_sku_reservations_do_not_deadlock_or_oversell():
+    import random
+    import threading
+
+    from django.db import connection, connections
+
+    from store.models import Inventory, InventoryReservation
+    from store.services.inventory import InsufficientStock, reserve_stock
+
+    if connection.vendor == "sqlite" and connection.is_in_memory_db():
+        pytest.skip("needs Postgres or a file-backed SQLite test database (SQLITE_TEST_DB)")
+
+    category, supplier = create_category("Hot"), create_supplier("HotCo")
+    products = [create_product(f"Hot {i}", f"HOT-{i}", category, supplier) for i in range(4)]
+    for product in products:
+        ensure_inventory(product, 25)
+    ids = [product.id for product in products]
+
+    errors, sold_out = [], []
+
+    def buyer(seed):
+        rng = random.Random(seed)
+        try:
+            for _ in range(15):
+                # Overlapping SKUs in a different order per thread.
+                skus = rng.sample(ids, rng.randint(2, len(ids)))
+                try:
+                    reserve_stock([(pid, rng.randint(1, 3)) for pid in skus])
+                except InsufficientStock:
+                    sold_out.append(seed)
+        except Exception as exc:  # deadlocks, lock timeouts
+            errors.append(exc)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=buyer, args=(seed,)) for seed in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    for product in products:
+        held = sum(InventoryReservation.objects.filter(product=product).values_list("quantity", flat=True))
+        remaining = Inventory.objects.get(product=product).quantity
+        assert remaining >= 0
+        assert held + remaining == 25
+
+
+@pytest.mark.django_db
+def test_checkout_query_count_does_not_grow_with_cart(django_assert_num_queries):
+    category, supplier = create_category("Bulk"), create_supplier("BulkCo")
+    products = [create_product(f"Bulk {i}", f"BULK-{i}", category, supplier) for i in range(6)]
+    for product in products:
+        ensure_inventory(product, 10)
+
+    def cart_client(email, items):
+        client = APIClient()
+        user = create_user(email)
+        client.force_authenticate(user)
+        for product in items:
+            client.post("/api/cart/", {"product_id": product.id, "quantity": 2}, format="json")
+        return client, ensure_address(user)
+
+    for email, items in (("one@example.com", products[:1]), ("six@example.com", products)):
+        client, addr = cart_client(email, items)
+        with django_assert_num_queries(CHECKOUT_COD_QUERIES):
+            resp = client.post("/api/checkout/", {"shipping_address": addr.id, "provider": "cod"}, format="json")
+        assert resp.status_code == 201
+        order = Order.objects.get(id=resp.json()["order_id"])
+        assert order.items.count() == len(items)
+        assert order.total_amount == sum(p.base_price * 2 for p in items)
+        assert order.status == Order.Status.PROCESSING
+        assert list(order.events.values_list("status", flat=True)) == [Order.Status.PENDING, Order.Status.PROCESSING]
+
+
 @pytest.mark.django_db
 def test_checkout_cod_with_referral_discount():
     client = APIClient()
@@ -182,6 +564,191 @@ def test_checkout_cod_with_referral_discount():
     assert payment.status == Payment.Status.PENDING
 
 
+@pytest.mark.django_db
+def test_coupon_counters_enforce_limits_and_release_on_cancel():
+    from store.models import CouponRedemption, CouponUserUsage
+    from store.services.coupons import release_order_redemptions
+
+    product = create_product("Beanie", "CPN-001", create_category("Hats"), create_supplier("HatCo"), price=Decimal("20.00"))
+    ensure_inventory(product, 10)
+    coupon = Coupon.objects.create(
+        code="LIMIT2", discount_type=Coupon.DiscountType.FIXED, value=Decimal("5.00"), usage_limit=2, per_user_limit=1
+    )
+
+    def checkout(email):
+        client = APIClient()
+        user = create_user(email)
+        client.force_authenticate(user)
+        addr = ensure_address(user)
+        client.post("/api/cart/", {"product_id": product.id, "quantity": 1}, format="json")
+        return client, addr, client.post(
+            "/api/checkout/", {"shipping_address": addr.id, "provider": "cod", "coupon_code": "limit2"}, format="json"
+        )
+
+    client, addr, first = checkout("c1@example.com")
+    assert first.status_code == 201
+    client.post("/api/cart/", {"product_id": product.id, "quantity": 1}, format="json")
+    again = client.post("/api/checkout/", {"shipping_address": addr.id, "provider": "cod", "coupon_code": "LIMIT2"}, format="json")
+    assert again.json() == {"detail": "Coupon already redeemed"}
+
+    assert checkout("c2@example.com")[2].status_code == 201
+    assert checkout("c3@example.com")[2].json() == {"detail": "Coupon usage limit reached"}
+    coupon.refresh_from_db()
+    assert coupon.redemption_count == 2 == CouponRedemption.objects.filter(coupon=coupon).count()
+
+    validate = APIClient().post("/api/coupons/validate/", {"code": "LIMIT2", "order_total": "20"}, format="json")
+    assert validate.json()["detail"] == "Coupon usage limit reached"
+
+    release_order_redemptions(Order.objects.get(id=first.json()["order_id"]))
+    coupon.refresh_from_db()
+    assert coupon.redemption_count == 1
+    assert CouponUserUsage.objects.get(coupon=coupon, user__email="c1@example.com").count == 0
+    assert checkout("c4@example.com")[2].status_code == 201
+
+
+@pytest.mark.django_db
+def test_coupon_validate_caches_lookups_and_throttles(monkeypatch, django_assert_num_queries):
+    from django.core.cache import cache
+
+    from store.throttles import CouponValidateThrottle
+
+    cache.clear()
+    client = APIClient()
+    coupon = Coupon.objects.create(code="Save5", discount_type=Coupon.DiscountType.FIXED, value=Decimal("5.00"))
+
+    def validate(code):
+        return client.post("/api/coupons/validate/", {"code": code, "order_total": "50"}, format="json")
+
+    assert validate("save5").json()["discount_amount"] == "5.00"
+    with django_assert_num_queries(0):
+        assert validate(" SAVE5 ").json()["valid"] is True
+    assert validate("LATER10").status_code == 404
+    with django_assert_num_queries(0):
+        assert validate("later10").status_code == 404
+
+    staff = create_user("coupons-staff@example.com")
+    staff.role = User.Role.STAFF
+    staff.save()
+    admin_client = APIClient()
+    admin_client.force_authenticate(staff)
+    resp = admin_client.patch(f"/api/admin/coupons/{coupon.id}/", {"value": "7.00"}, format="json")
+    assert resp.status_code == 200
+    assert validate("SAVE5").json()["discount_amount"] == "7.00"
+    Coupon.objects.create(code="LATER10", discount_type=Coupon.DiscountType.FIXED, value=Decimal("10.00"))
+    assert validate("later10").json()["valid"] is True
+
+    cache.clear()
+    monkeypatch.setattr(CouponValidateThrottle, "rate", "2/min", raising=False)
+    assert validate("SAVE5").status_code == 200
+    assert validate("SAVE5").status_code == 200
+    assert validate("SAVE5").status_code == 429
+
+
+@pytest.mark.django_db
+def test_priced_cart_snapshot_is_shared_and_invalidated():
+    from store.services.pricing import get_priced_cart
+
+    client = APIClient()
+    mug = create_product("Mug", "PRC-1", create_category("Cups"), create_supplier("CupCo"), price=Decimal("8.00"))
+    ensure_inventory(mug, 10)
+    client.post("/api/cart/", {"product_id": mug.id, "quantity": 5}, format="json")
+    Coupon.objects.create(code="TENOFF", discount_type=Coupon.DiscountType.PERCENT, value=Decimal("10.00"))
+
+    resp = client.post("/api/coupons/validate/", {"code": "TENOFF"}, format="json")
+    assert resp.json()["discount_amount"] == "4.00"
+
+    priced = get_priced_cart({mug.id: 5})
+    discounted = priced.with_discounts([Coupon.objects.get(code="TENOFF")])
+    assert (discounted.subtotal, discounted.discount_total, discounted.total) == (
+        Decimal("40.00"),
+        Decimal("4.00"),
+        Decimal("36.00"),
+    )
+    assert discounted.total_npr == Decimal("4806.00")
+
+    mug.base_price = Decimal("9.00")
+    mug.save(update_fields=["base_price"])
+    assert client.get("/api/cart/").json()["total"] == "45.00"
+
+
+@pytest.mark.django_db
+def test_zero_balance_order_is_forwarded_only_after_commit(monkeypatch, django_capture_on_commit_callbacks):
+    from store import views
+
+    forwarded = []
+    monkeypatch.setattr(views.auto_forward_order_to_supplier, "delay", forwarded.append)
+    client = APIClient()
+    user = create_user("free-order@example.com")
+    client.force_authenticate(user)
+    addr = ensure_address(user)
+    mug = create_product("Free Mug", "FREE-1", create_category("Gifts"), create_supplier("GiftCo"), price=Decimal("8.00"))
+    ensure_inventory(mug, 5)
+    client.post("/api/cart/", {"product_id": mug.id, "quantity": 1}, format="json")
+    Coupon.objects.create(code="ALLFREE", discount_type=Coupon.DiscountType.PERCENT, value=Decimal("100.00"))
+
+    with django_capture_on_commit_callbacks() as callbacks:
+        resp = client.post("/api/checkout/", {"shipping_address": addr.id, "provider": "khalti", "coupon_code": "ALLFREE"}, format="json")
+        assert resp.status_code == 201 and resp.json()["payment_intent"] is None
+        assert forwarded == []
+    for callback in callbacks:
+        callback()
+    order_id = resp.json()["order_id"]
+    assert forwarded == [order_id]
+    assert Order.objects.get(id=order_id).status == Order.Status.PAID
+
+
+class StubRateSource:
+    rates = {"NPR": "133.5", "EUR": "0.92"}
+
+    def load(self):
+        from store.services.currency import RateTable
+
+        return RateTable.build("USD", self.rates)
+
+
+@pytest.mark.django_db
+def test_currency_rates_localize_listings_and_carts(settings, monkeypatch):
+    from store.services import currency
+    from store.services.pricing import get_priced_cart
+
+    settings.CURRENCY_RATE_SOURCE = "tests.test_api.StubRateSource"
+    currency.reset_rates()
+    try:
+        amounts = [Decimal("0.01"), Decimal("19.99"), Decimal("0.05"), Decimal("12345678.99")]
+        assert currency.convert_many(amounts, "eur") == [str(currency.convert(a, "EUR")) for a in amounts]
+
+        client = APIClient()
+        cat, sup = create_category("Kettles"), create_supplier("KettleCo")
+        kettle = create_product("Kettle", "CUR-1", cat, sup, price=Decimal("20.00"))
+        create_product("Teapot", "CUR-2", cat, sup, price=Decimal("7.45"))
+        ensure_inventory(kettle, 5)
+
+        plain = client.get("/api/products/").json()["results"]
+        assert all("localized_price" not in row for row in plain)
+        localized = {row["sku"]: row for row in client.get("/api/products/?currency=npr").json()["results"]}
+        assert localized["CUR-1"]["localized_price"] == "2670.00"
+        assert localized["CUR-2"]["localized_price"] == "994.58"
+        assert localized["CUR-2"]["currency"] == "NPR"
+        assert client.get("/api/products/?currency=XYZ").status_code == 400
+
+        client.post("/api/cart/", {"product_id": kettle.id, "quantity": 2}, format="json")
+        cart = client.get("/api/cart/?currency=EUR").json()
+        assert (cart["total"], cart["localized_total"], cart["currency"]) == ("40.00", "36.80", "EUR")
+        assert cart["items"][0]["localized_unit_price"] == "18.40"
+        assert get_priced_cart({kettle.id: 2}).total_npr == Decimal("5340.00")
+
+        # New rates are picked up once the cached table expires, and cached
+        # cart snapshots priced at the old rate are not reused.
+        monkeypatch.setattr(StubRateSource, "rates", {"NPR": "140"})
+        assert get_priced_cart({kettle.id: 2}).total_npr == Decimal("5340.00")
+        monkeypatch.setattr(currency, "CURRENCY_RATE_TTL_SECONDS", 0)
+        assert get_priced_cart({kettle.id: 2}).total_npr == Decimal("5600.00")
+        localized = {row["sku"]: row for row in client.get("/api/products/?currency=NPR").json()["results"]}
+        assert localized["CUR-1"]["localized_price"] == "2800.00"
+    finally:
+        currency.reset_rates()
+
+
 @pytest.mark.django_db
 def test_order_tracking_endpoint_returns_timeline():
     client = APIClient()
@@ -292,6 +859,7 @@ def test_product_recommendations_endpoint():
     supplier = create_supplier("Tech Co")
     product_main = create_product("Main Gadget", "REC-1", category, supplier, price=Decimal("150.00"))
     product_related = create_product("Addon", "REC-2", category, supplier, price=Decimal("30.00"))
+    product_other = create_product("Cable", "REC-3", create_category("Cables"), supplier, price=Decimal("12.00"))
     ensure_inventory(product_main, 5)
     ensure_inventory(product_related, 5)
 
@@ -306,11 +874,14 @@ def test_product_recommendations_endpoint():
     )
     OrderItem.objects.create(order=order, product=product_main, unit_price=Decimal("150.00"), quantity=1)
     OrderItem.objects.create(order=order, product=product_related, unit_price=Decimal("30.00"), quantity=1)
+    OrderItem.objects.create(order=order, product=product_other, unit_price=Decimal("12.00"), quantity=1)
+    rebuild_copurchase_matrix.apply()
 
     resp = client.get(f"/api/products/{product_main.slug}/recommendations/")
     assert resp.status_code == 200
     slugs = [item["slug"] for item in resp.json()]
     assert product_related.slug in slugs
+    assert product_other.slug in slugs
 
 
 @pytest.mark.django_db
@@ -92,6 +92,125 @@ def test_khalti_webhook_shape_token_success():
     assert Order.objects.get(id=order_id).status == Order.Status.PAID
 
 
+@pytest.mark.django_db
+def test_repeated_webhooks_apply_once(monkeypatch):
+    from store.models import Notification, OrderStatusEvent, PaymentEvent
+
+    client = APIClient()
+    user = create_user("ledger@example.com")
+    client.force_authenticate(user)
+    addr = ensure_address(user)
+
+    cat = Category.objects.create(name="CatL", slug="catl")
+    sup = Supplier.objects.create(name="AnyL", contact_email="l@example.com")
+    p = Product.objects.create(title="T", slug="t-ledger", description="", base_price=Decimal("12.00"), sku="SKU-L", category=cat, supplier=sup, active=True)
+    Inventory.objects.create(product=p, quantity=5)
+
+    client.post("/api/cart/", {"product_id": p.id, "quantity": 1}, format="json")
+    resp = client.post("/api/checkout/", {"shipping_address": addr.id, "billing_address": addr.id, "provider": "khalti"}, format="json")
+    order_id = resp.json()["order_id"]
+
+    for _ in range(3):
+        hook = client.post("/api/payments/webhook/", {"provider": "khalti", "order_id": order_id, "token": "khalti_ok_tok", "status": "success"}, format="json")
+        assert hook.json() == {"ok": True}
+
+    # The verify callback reporting the same outcome is absorbed by the ledger too.
+    class Verified:
+        status_code = 200
+        text = "{}"
+
+    monkeypatch.setattr("store.payments.base.gateway_request", lambda *args, **kwargs: Verified())
+    resp = client.get("/api/payments/verify/", {"provider": "khalti", "order_id": order_id, "token": "khalti_ok_tok"})
+    assert resp.json()["ok"] is True
+
+    assert Order.objects.get(id=order_id).status == Order.Status.PAID
+    event = PaymentEvent.objects.get(order_id=order_id)
+    assert (event.status, event.source) == (Payment.Status.SUCCEEDED, PaymentEvent.Source.WEBHOOK)
+    assert OrderStatusEvent.objects.filter(order_id=order_id, status=Order.Status.PAID).count() == 1
+    assert Notification.objects.filter(payload__order_id=order_id, payload__status=Order.Status.PAID).count() == 1
+
+
+@pytest.mark.django_db
+def test_webhook_async_intake_queues_and_worker_applies(settings, monkeypatch):
+    import json
+
+    from store.models import WebhookInbox
+    from store.payments.khalti import KhaltiGateway
+    from store.tasks import process_webhook_inbox
+
+    settings.PAYMENT_WEBHOOK_ASYNC = True
+    client = APIClient()
+    user = create_user("inbox@example.com")
+    client.force_authenticate(user)
+    addr = ensure_address(user)
+
+    cat = Category.objects.create(name="CatI", slug="cati")
+    sup = Supplier.objects.create(name="AnyI", contact_email="i@example.com")
+    p = Product.objects.create(title="T", slug="t-inbox", description="", base_price=Decimal("12.00"), sku="SKU-I", category=cat, supplier=sup, active=True)
+    Inventory.objects.create(product=p, quantity=5)
+
+    client.post("/api/cart/", {"product_id": p.id, "quantity": 1}, format="json")
+    resp = client.post("/api/checkout/", {"shipping_address": addr.id, "billing_address": addr.id, "provider": "khalti"}, format="json")
+    order_id = resp.json()["order_id"]
+
+    # With credentials configured, verification calls Khalti; intake must not.
+    calls = []
+
+    class VerifiedResponse:
+        status_code = 200
+
+        def json(self):
+            return {"idx": "khalti-idx"}
+
+    def fake_request(self, operation, method, url, **kwargs):
+        calls.append(operation)
+        return VerifiedResponse()
+
+    monkeypatch.setattr(KhaltiGateway, "SECRET_KEY", "khalti-secret")
+    monkeypatch.setattr(KhaltiGateway, "_request", fake_request)
+
+    body = {"provider": "khalti", "order_id": order_id, "token": "khalti_ok_tok", "amount": "12.00", "status": "success"}
+    for _ in range(2):
+        hook = client.post("/api/payments/webhook/", body, format="json", HTTP_AUTHORIZATION="Bearer secret")
+        assert hook.json() == {"queued": True}
+    forged = client.post("/api/payments/webhook/?provider=khalti", body, format="json", HTTP_X_KHALTI_SIGNATURE="bad")
+    assert forged.status_code == 400
+    assert calls == []
+    assert Order.objects.get(id=order_id).status == Order.Status.PENDING
+    queued = WebhookInbox.objects.filter(order_id=order_id, processed_at__isnull=True)
+    assert queued.count() == 2
+    event = queued.first()
+    assert event.succeeded is None
+    assert json.loads(bytes(event.body)) == body
+    assert event.content_type.startswith("application/json")
+    assert "Authorization" not in event.headers
+
+    assert process_webhook_inbox() == {"applied": 2, "failed_orders": 0}
+    assert calls == ["verify", "verify"]
+    assert set(WebhookInbox.objects.values_list("succeeded", flat=True)) == {True}
+    assert Order.objects.get(id=order_id).status == Order.Status.PAID
+    assert Payment.objects.get(order_id=order_id).status == Payment.Status.SUCCEEDED
+    assert not WebhookInbox.objects.filter(processed_at__isnull=True).exists()
+    assert process_webhook_inbox() == {"applied": 0, "failed_orders": 0}
+
+
+@pytest.mark.django_db
+def test_failure_webhook_fails_payment_but_never_unsettles_a_paid_order():
+    client = APIClient()
+    failing = _pending_order("webhook-fail@example.com", "khalti")
+    hook = client.post("/api/payments/webhook/", {"provider": "khalti", "order_id": failing, "token": "khalti_tok_f", "status": "failed"}, format="json")
+    assert hook.json() == {"ok": False}
+    assert Order.objects.get(id=failing).payment_status == Order.PaymentStatus.FAILED
+    assert Payment.objects.get(order_id=failing).status == Payment.Status.FAILED
+
+    settled = _pending_order("webhook-late-fail@example.com", "khalti")
+    for status in ("success", "failed"):
+        client.post("/api/payments/webhook/", {"provider": "khalti", "order_id": settled, "token": "khalti_ok_late", "status": status}, format="json")
+    order = Order.objects.get(id=settled)
+    assert (order.status, order.payment_status) == (Order.Status.PAID, Order.PaymentStatus.PAID)
+    assert Payment.objects.get(order_id=settled).status == Payment.Status.SUCCEEDED
+
+
 @pytest.mark.django_db
 def test_admin_refund_endpoint():
     client = APIClient()
@@ -114,3 +233,570 @@ def test_admin_refund_endpoint():
     assert resp.status_code == 200
     order.refresh_from_db()
     assert order.status == Order.Status.REFUNDED
+
+
+@pytest.mark.django_db
+def test_finalize_payment_query_count_is_fixed(django_assert_num_queries):
+    from store.models import Coupon, CouponRedemption, PaymentEvent
+    from store.services.payments import finalize_payment
+
+    client = APIClient()
+    user = create_user("finalize@example.com")
+    client.force_authenticate(user)
+    addr = ensure_address(user)
+
+    cat = Category.objects.create(name="CatF", slug="catf")
+    sup = Supplier.objects.create(name="AnyF", contact_email="f@example.com")
+    products = [
+        Product.objects.create(title=f"T{i}", slug=f"t-final-{i}", description="", base_price=Decimal("12.00"), sku=f"SKU-F{i}", category=cat, supplier=sup, active=True)
+        for i in range(3)
+    ]
+    for p in products:
+        Inventory.objects.create(product=p, quantity=5)
+        client.post("/api/cart/", {"product_id": p.id, "quantity": 1}, format="json")
+    Coupon.objects.create(code="FINAL5", discount_type=Coupon.DiscountType.FIXED, value=Decimal("5.00"))
+    resp = client.post("/api/checkout/", {"shipping_address": addr.id, "billing_address": addr.id, "provider": "khalti", "coupon_code": "FINAL5"}, format="json")
+    order = Order.objects.get(id=resp.json()["order_id"])
+    payment = Payment.objects.get(order=order)
+
+    # Ledger insert, payment and order UPDATEs, reservation commit (UPDATE and
+    # released-hold lookup), status event and notification inserts and the
+    # coupon check, plus three savepoint pairs. Independent of cart size.
+    with django_assert_num_queries(14):
+        assert finalize_payment(order, payment, "khalti", PaymentEvent.Source.RECONCILE, {"status": "paid"})
+    order.refresh_from_db()
+    assert order.payment_status == Order.PaymentStatus.PAID
+    assert CouponRedemption.objects.filter(order=order).count() == 1
+
+    # A repeat is rejected by the ledger's unique index: one INSERT plus savepoints.
+    with django_assert_num_queries(6):
+        assert not finalize_payment(order, payment, "khalti", PaymentEvent.Source.WEBHOOK, {"status": "paid"})
+
+
+@pytest.fixture
+def fresh_gateways():
+    """Fresh process-wide gateways and HTTP sessions, dropped again after the test."""
+    from store.payments.base import reset_gateways
+    from store.payments.http import close_sessions
+
+    reset_gateways()
+    close_sessions()
+    yield
+    reset_gateways()
+    close_sessions()
+
+
+def test_gateways_and_http_sessions_are_reused(fresh_gateways, monkeypatch):
+    from prometheus_client import REGISTRY
+
+    from store.payments.base import get_gateway
+    from store.payments.http import get_session
+
+    assert get_gateway("khalti") is get_gateway("KHALTI")
+    session = get_session("khalti")
+    assert get_session("khalti") is session
+    retry = session.get_adapter("https://khalti.com/").max_retries
+    assert "GET" in retry.allowed_methods and "POST" not in retry.allowed_methods
+
+    calls = []
+
+    class Lookup:
+        status_code = 200
+
+        def json(self):
+            return {"status": "Completed"}
+
+    monkeypatch.setattr(session, "request", lambda method, url, **kwargs: calls.append((method, kwargs)) or Lookup())
+    monkeypatch.setattr(get_gateway("khalti"), "SECRET_KEY", "test-secret")
+    labels = {"provider": "khalti", "operation": "lookup"}
+    before = REGISTRY.get_sample_value("payment_gateway_request_seconds_count", labels) or 0
+
+    ok, _ = get_gateway("khalti").verify_webhook({"pidx": "px-1", "status": "pending"}, {})
+    assert ok
+    assert calls[0][0] == "POST" and calls[0][1]["timeout"] == (3.05, 10)
+    assert REGISTRY.get_sample_value("payment_gateway_request_seconds_count", labels) == before + 1
+
+
+@pytest.fixture
+def provider_stand_in(monkeypatch):
+    """Local HTTP server standing in for eSewa ``transrec`` and Khalti ``payment/verify`` and ``epayment/lookup``."""
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlparse
+
+    from store.payments.esewa import ESewaGateway
+    from store.payments.khalti import KhaltiGateway
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            rid = parse_qs(urlparse(self.path).query).get("rid", [""])[0]
+            self._reply(200, "<response_code>Success</response_code>" if rid.startswith("ok") else "<response_code>failure</response_code>")
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if "pidx" in body:
+                states = {"ok": "Completed", "expired": "Expired"}
+                self._reply(200, json.dumps({"pidx": body["pidx"], "status": states.get(body["pidx"].split("-")[0], "Pending")}))
+                return
+            self._reply(200 if body["token"].startswith("ok") else 400, json.dumps(body))
+
+        def _reply(self, status, text):
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(text)))
+            self.end_headers()
+            self.wfile.write(text.encode())
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    monkeypatch.setattr(ESewaGateway, "VERIFY_URL", f"{base}/epay/transrec")
+    monkeypatch.setattr(KhaltiGateway, "VERIFY_URL", f"{base}/api/v2/payment/verify/")
+    monkeypatch.setattr(KhaltiGateway, "LOOKUP_URL", f"{base}/api/v2/epayment/lookup/")
+    yield base
+    server.shutdown()
+
+
+def _pending_order(email, provider):
+    client = APIClient()
+    user = create_user(email)
+    client.force_authenticate(user)
+    addr = ensure_address(user)
+    cat = Category.objects.create(name=f"Cat {email}", slug=f"cat-{provider}-{user.id}")
+    sup = Supplier.objects.create(name=f"Sup {email}", contact_email=email)
+    p = Product.objects.create(title="T", slug=f"t-return-{user.id}", description="", base_price=Decimal("10.00"), sku=f"SKU-R{user.id}", category=cat, supplier=sup, active=True)
+    Inventory.objects.create(product=p, quantity=5)
+    client.post("/api/cart/", {"product_id": p.id, "quantity": 1}, format="json")
+    resp = client.post("/api/checkout/", {"shipping_address": addr.id, "billing_address": addr.id, "provider": provider}, format="json")
+    return resp.json()["order_id"]
+
+
+@pytest.mark.django_db
+def test_verify_returns_against_provider_stand_in(provider_stand_in):
+    client = APIClient()
+    esewa_order = _pending_order("return-esewa@example.com", "esewa")
+    resp = client.get("/api/payments/verify/", {"provider": "esewa", "order_id": esewa_order, "refId": "bad-ref"})
+    assert resp.status_code == 400
+    assert Order.objects.get(id=esewa_order).payment_status == Order.PaymentStatus.FAILED
+    resp = client.get("/api/payments/verify/", {"provider": "esewa", "order_id": esewa_order})
+    assert resp.json() == {"detail": "refId (rid) required for eSewa verify"}
+
+    khalti_order = _pending_order("return-khalti@example.com", "khalti")
+    resp = client.get("/api/payments/verify/", {"provider": "khalti", "order_id": khalti_order, "token": "ok-token", "amount": "10.00"})
+    assert resp.json() == {"ok": True, "order_id": khalti_order, "provider": "khalti", "provider_payment_id": "ok-token"}
+    assert Order.objects.get(id=khalti_order).status == Order.Status.PAID
+
+
+@pytest.mark.django_db(transaction=True)
+def test_async_return_view_against_provider_stand_in(provider_stand_in, monkeypatch):
+    pytest.importorskip("httpx")
+    from asgiref.sync import async_to_sync
+    from django.test import AsyncClient
+
+    from store import views
+    from store.payments import http
+
+    client = AsyncClient()
+    esewa_order = _pending_order("areturn-esewa@example.com", "esewa")
+    resp = async_to_sync(client.get)("/api/payments/return/", {"provider": "esewa", "order_id": esewa_order, "refId": "ok-ref"})
+    assert resp.status_code == 200
+    assert resp.json()["ok"] is True
+    assert Order.objects.get(id=esewa_order).status == Order.Status.PAID
+
+    khalti_order = _pending_order("areturn-khalti@example.com", "khalti")
+    resp = async_to_sync(client.get)("/api/payments/return/", {"provider": "khalti", "order_id": khalti_order, "token": "bad"})
+    assert resp.status_code == 400
+    assert Order.objects.get(id=khalti_order).payment_status == Order.PaymentStatus.FAILED
+
+    # Under WSGI the request's event loop ends with it, so its clients are closed.
+    closed = []
+
+    async def aclose_async_clients():
+        import asyncio
+
+        closed.extend(http._async_clients.get(asyncio.get_running_loop(), {}).values())
+        await http.aclose_async_clients()
+
+    monkeypatch.setattr(views, "aclose_async_clients", aclose_async_clients)
+    wsgi_order = _pending_order("areturn-wsgi@example.com", "esewa")
+    resp = APIClient().get("/api/payments/return/", {"provider": "esewa", "order_id": wsgi_order, "refId": "ok-ref"})
+    assert resp.status_code == 200
+    assert len(closed) == 1 and closed[0].is_closed
+
+
+@pytest.mark.django_db
+def test_pending_intents_are_polled_on_backoff():
+    from datetime import timedelta
+
+    from django.utils import timezone
+
+    from store.models import PaymentEvent
+    from store.tasks import poll_pending_payments
+
+    waiting = Payment.objects.get(order_id=_pending_order("poll-wait@example.com", "khalti"))
+    paying = Payment.objects.get(order_id=_pending_order("poll-pay@example.com", "khalti"))
+    assert waiting.status == Payment.Status.PENDING
+    assert waiting.check_attempts == 0
+    assert timedelta(seconds=55) < waiting.next_check_at - timezone.now() <= timedelta(seconds=60)
+    assert poll_pending_payments() == {"checked": 0, "paid": 0, "failed": 0, "pending": 0}
+
+    past = timezone.now() - timedelta(seconds=1)
+    Payment.objects.filter(pk=waiting.pk).update(next_check_at=past)
+    Payment.objects.filter(pk=paying.pk).update(next_check_at=past, provider_payment_id="khalti_ok_polled")
+    assert poll_pending_payments() == {"checked": 2, "paid": 1, "failed": 0, "pending": 1}
+
+    waiting.refresh_from_db()
+    assert waiting.check_attempts == 1
+    assert timedelta(seconds=295) < waiting.next_check_at - timezone.now() <= timedelta(seconds=300)
+    paying.refresh_from_db()
+    assert (paying.status, paying.next_check_at) == (Payment.Status.SUCCEEDED, None)
+    assert paying.order.status == Order.Status.PAID
+    assert PaymentEvent.objects.get(payment=paying).source == PaymentEvent.Source.POLL
+
+    # After the last backoff step the payment is no longer polled.
+    Payment.objects.filter(pk=waiting.pk).update(next_check_at=past, check_attempts=3)
+    assert poll_pending_payments()["pending"] == 1
+    waiting.refresh_from_db()
+    assert (waiting.check_attempts, waiting.next_check_at) == (4, None)
+
+
+@pytest.mark.django_db
+def test_khalti_pending_intents_are_polled_with_epayment_lookup(provider_stand_in, monkeypatch):
+    from datetime import timedelta
+
+    from django.utils import timezone
+
+    from store.constants import PAYMENT_HTTP_TIMEOUT, PAYMENT_POLL_CONCURRENCY
+    from store.payments.khalti import KhaltiGateway
+    from store.services.payments import poll_lock_timeout
+    from store.tasks import poll_pending_payments
+
+    orders = {pidx: _pending_order(f"lookup-{pidx}@example.com", "khalti") for pidx in ("ok-pidx", "expired-pidx", "wait-pidx")}
+    past = timezone.now() - timedelta(seconds=1)
+    for pidx, order_id in orders.items():
+        Payment.objects.filter(order_id=order_id).update(next_check_at=past, provider_payment_id=pidx)
+    monkeypatch.setattr(KhaltiGateway, "SECRET_KEY", "khalti-secret")
+
+    assert poll_pending_payments() == {"checked": 3, "paid": 1, "failed": 1, "pending": 1}
+    assert Order.objects.get(id=orders["ok-pidx"]).status == Order.Status.PAID
+    assert Order.objects.get(id=orders["expired-pidx"]).payment_status == Order.PaymentStatus.FAILED
+    assert Payment.objects.get(order_id=orders["wait-pidx"]).check_attempts == 1
+
+    # The run lock outlives a batch where every status call times out.
+    assert poll_lock_timeout(200) > 200 / PAYMENT_POLL_CONCURRENCY * sum(PAYMENT_HTTP_TIMEOUT)
+
+
+@pytest.mark.django_db
+def test_bulk_refund_job_runs_concurrently_and_records_outcomes(monkeypatch):
+    import threading
+    import time
+
+    from store.constants import REFUND_JOB_CONCURRENCY
+    from store.models import AdminActionLog, OrderStatusEvent, RefundJobItem, User
+    from store.services import refunds
+
+    admin = create_user("refunds-admin@example.com")
+    admin.role = User.Role.ADMIN
+    admin.save(update_fields=["role"])
+    client = APIClient()
+    client.force_authenticate(admin)
+
+    customer = create_user("refunds-customer@example.com")
+    addr = ensure_address(customer)
+
+    def paid_order(provider):
+        order = Order.objects.create(
+            user=customer, status=Order.Status.PAID, payment_status=Order.PaymentStatus.PAID,
+            total_amount=Decimal("12.00"), shipping_address=addr, billing_address=addr,
+        )
+        Payment.objects.create(order=order, provider=provider, provider_payment_id=f"{provider}-{order.id}", amount=order.total_amount, status=Payment.Status.SUCCEEDED)
+        return order.id
+
+    esewa = [paid_order("esewa") for _ in range(6)]
+    paypal = paid_order("paypal")
+    unpaid = Order.objects.create(user=customer, total_amount=Decimal("5.00"), shipping_address=addr, billing_address=addr).id
+
+    assert client.post("/api/admin/refund-jobs/", {"order_ids": [esewa[0], 999999]}, format="json").status_code == 400
+    resp = client.post("/api/admin/refund-jobs/", {"order_ids": [*esewa, paypal, unpaid, esewa[0]], "reason": "Cancelled drop"}, format="json")
+    assert resp.status_code == 202
+    job_id = resp.json()["id"]
+    assert resp.json()["progress"]["total"] == 8
+    # A second job for the same orders skips the ones already queued.
+    again = client.post("/api/admin/refund-jobs/", {"order_ids": [esewa[0]]}, format="json").json()
+    assert RefundJobItem.objects.get(job_id=again["id"]).error == "already_queued"
+
+    active = peak = 0
+    lock = threading.Lock()
+
+    class NoRefunds:
+        def handle_refund(self, order, amount):
+            raise NotImplementedError
+
+    class SlowGateway:
+        def handle_refund(self, order, amount):
+            nonlocal active, peak
+            with lock:
+                active += 1
+                peak = max(peak, active)
+            time.sleep(0.05)
+            with lock:
+                active -= 1
+            return {"status": "refunded", "reference": f"ref-{order.id}"}
+
+    monkeypatch.setattr(refunds, "get_gateway", lambda key: SlowGateway() if key == "esewa" else NoRefunds())
+    progress = refunds.run_refund_job(job_id, chunk_size=10)
+    assert refunds.run_refund_job(job_id) is None
+    assert 1 < peak <= REFUND_JOB_CONCURRENCY
+    assert (progress["succeeded"], progress["failed"], progress["skipped"], progress["done"]) == (6, 1, 1, 8)
+
+    detail = client.get(f"/api/admin/refund-jobs/{job_id}/").json()
+    assert detail["status"] == "completed"
+    by_order = {item["order"]: item for item in detail["items"]}
+    assert by_order[paypal]["error"] == "not_supported"
+    assert by_order[unpaid]["error"] == "no_successful_payment"
+    assert set(Order.objects.filter(pk__in=esewa).values_list("payment_status", flat=True)) == {Order.PaymentStatus.REFUNDED}
+    assert Payment.objects.get(order_id=esewa[0]).raw_response["refund"]["reference"] == f"ref-{esewa[0]}"
+    assert OrderStatusEvent.objects.filter(order_id__in=esewa, status=Order.Status.REFUNDED).count() == 6
+    audits = AdminActionLog.objects.filter(resource="order", action="refund", metadata__refund_job=job_id)
+    assert audits.count() == 7
+    assert audits.filter(status="failure").get().object_pk == str(paypal)
+
+
+@pytest.mark.django_db
+def test_refund_job_never_refunds_a_payment_twice(monkeypatch):
+    from datetime import timedelta
+
+    from django.utils import timezone
+
+    from store.constants import REFUND_JOB_STALE_SECONDS
+    from store.models import RefundJob, RefundJobItem, User
+    from store.services import refunds
+    from store.tasks import process_refund_jobs
+
+    admin = create_user("refund-twice-admin@example.com")
+    admin.role = User.Role.ADMIN
+    admin.is_staff = True
+    admin.save(update_fields=["role", "is_staff"])
+    client = APIClient()
+    client.force_authenticate(admin)
+    customer = create_user("refund-twice-customer@example.com")
+    addr = ensure_address(customer)
+    payments = []
+    for _ in range(3):
+        order = Order.objects.create(
+            user=customer, status=Order.Status.PAID, payment_status=Order.PaymentStatus.PAID,
+            total_amount=Decimal("12.00"), shipping_address=addr, billing_address=addr,
+        )
+        payments.append(Payment.objects.create(order=order, provider="esewa", provider_payment_id=f"esewa-{order.id}", amount=order.total_amount, status=Payment.Status.SUCCEEDED))
+    queued, refunded_elsewhere, other = payments
+    job = refunds.create_refund_job([p.order_id for p in payments], actor=admin)
+
+    # Single refunds of a queued payment are turned away.
+    assert client.post(f"/api/admin/payments/{queued.pk}/refund/", {}, format="json").status_code == 409
+    assert client.post(f"/api/admin/orders/{queued.order_id}/refund/", {}, format="json").status_code == 409
+    # Refunded some other way (e.g. at the provider) after the job was created.
+    Payment.objects.filter(pk=refunded_elsewhere.pk).update(status=Payment.Status.REFUNDED)
+    # The worker that took the job died before processing anything.
+    stale = timezone.now() - timedelta(seconds=REFUND_JOB_STALE_SECONDS + 1)
+    RefundJob.objects.filter(pk=job.pk).update(status=RefundJob.Status.RUNNING, started_at=stale, heartbeat_at=stale)
+
+    refunded = []
+
+    class Gateway:
+        def handle_refund(self, order, amount):
+            refunded.append(order.id)
+            return {"status": "refunded"}
+
+    monkeypatch.setattr(refunds, "get_gateway", lambda key: Gateway())
+    progress = process_refund_jobs()[job.pk]
+    assert sorted(refunded) == sorted([queued.order_id, other.order_id])
+    assert (progress["succeeded"], progress["skipped"]) == (2, 1)
+    assert RefundJobItem.objects.get(payment=refunded_elsewhere).error == "payment_not_refundable"
+    job.refresh_from_db()
+    assert job.status == RefundJob.Status.COMPLETED and job.started_at == stale
+    assert process_refund_jobs() == {}
+    assert client.post(f"/api/admin/payments/{queued.pk}/refund/", {}, format="json").status_code == 409
+
+
+@pytest.mark.django_db
+def test_refund_job_taken_over_mid_run_leaves_the_rest_to_the_new_owner(monkeypatch):
+    from datetime import timedelta
+
+    from django.utils import timezone
+
+    from store.constants import REFUND_JOB_STALE_SECONDS
+    from store.models import RefundJob, RefundJobItem
+    from store.services import refunds
+
+    customer = create_user("refund-takeover@example.com")
+    addr = ensure_address(customer)
+    order_ids = []
+    for _ in range(3):
+        order = Order.objects.create(
+            user=customer, status=Order.Status.PAID, payment_status=Order.PaymentStatus.PAID,
+            total_amount=Decimal("12.00"), shipping_address=addr, billing_address=addr,
+        )
+        Payment.objects.create(order=order, provider="esewa", provider_payment_id=f"esewa-{order.id}", amount=order.total_amount, status=Payment.Status.SUCCEEDED)
+        order_ids.append(order.id)
+    job = refunds.create_refund_job(order_ids)
+
+    refunded = []
+
+    class Gateway:
+        def handle_refund(self, order, amount):
+            refunded.append(order.id)
+            return {"status": "refunded"}
+
+    real_apply = refunds._apply_results
+
+    def taken_over_during_first_chunk(job, results):
+        # The first chunk's gateway call was slow enough for another run to take the job.
+        if len(refunded) == 1:
+            RefundJob.objects.filter(pk=job.pk).update(owner="another-run")
+        return real_apply(job, results)
+
+    monkeypatch.setattr(refunds, "get_gateway", lambda key: Gateway())
+    monkeypatch.setattr(refunds, "_apply_results", taken_over_during_first_chunk)
+    assert refunds.run_refund_job(job.pk, chunk_size=1) is None
+    assert list(job.items.order_by("pk").values_list("status", flat=True)) == [
+        RefundJobItem.Status.SUCCEEDED, RefundJobItem.Status.PENDING, RefundJobItem.Status.PENDING,
+    ]
+    job.refresh_from_db()
+    assert (job.status, job.owner) == (RefundJob.Status.RUNNING, "another-run")
+
+    stale = timezone.now() - timedelta(seconds=REFUND_JOB_STALE_SECONDS + 1)
+    RefundJob.objects.filter(pk=job.pk).update(heartbeat_at=stale)
+    progress = refunds.run_refund_job(job.pk, chunk_size=1)
+    assert (progress["succeeded"], progress["done"]) == (3, 3)
+    assert sorted(refunded) == sorted(order_ids)
+
+
+@pytest.mark.django_db
+def test_webhook_signature_is_checked_on_raw_body_before_decoding(monkeypatch):
+    import hashlib
+    import hmac
+    import json
+
+    from store import views
+    from store.payments.esewa import ESewaGateway
+
+    monkeypatch.setattr(ESewaGateway, "SECRET", "whsec")
+    decoded = []
+    real_decode = views.decode_webhook_body
+    monkeypatch.setattr(views, "decode_webhook_body", lambda *args: decoded.append(1) or real_decode(*args))
+
+    order_id = _pending_order("signed-webhook@example.com", "esewa")
+    body = json.dumps({"order_id": order_id, "provider_payment_id": "esewa_ok_signed", "status": "success"}).encode()
+    client = APIClient()
+
+    resp = client.post("/api/payments/webhook/?provider=esewa", body, content_type="application/json", HTTP_X_SIGNATURE="forged")
+    assert resp.status_code == 400
+    assert decoded == []
+    assert Order.objects.get(id=order_id).payment_status != Order.PaymentStatus.FAILED
+
+    signature = hmac.new(b"whsec", body, hashlib.sha256).hexdigest()
+    resp = client.post("/api/payments/webhook/?provider=esewa", body, content_type="application/json", HTTP_X_SIGNATURE=signature)
+    assert resp.json() == {"ok": True}
+    assert decoded == [1]
+    assert Order.objects.get(id=order_id).status == Order.Status.PAID
+
+
+@pytest.mark.django_db
+def test_circuit_breaker_fails_fast_and_probes_provider(monkeypatch):
+    import requests
+    from django.core.cache import cache
+    from prometheus_client import REGISTRY
+
+    from store.constants import CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT_SECONDS
+    from store.payments.base import get_gateway
+    from store.payments.http import get_session
+    from store.services import circuit
+
+    cache.clear()
+    circuit.reset_breakers()
+    order = Order.objects.get(id=_pending_order("circuit@example.com", "khalti"))
+    gateway = get_gateway("khalti")
+    monkeypatch.setattr(gateway, "SECRET_KEY", "test-secret")
+    calls = []
+
+    def down(method, url, **kwargs):
+        calls.append(url)
+        raise requests.ConnectionError("provider down")
+
+    monkeypatch.setattr(get_session("khalti"), "request", down)
+    for _ in range(CIRCUIT_FAILURE_THRESHOLD):
+        assert gateway.create_payment_intent(order)["provider_payment_id"].startswith("khalti_")
+    assert len(calls) == CIRCUIT_FAILURE_THRESHOLD
+
+    # Open: the fallback is taken without another network call.
+    assert gateway.create_payment_intent(order)["provider_payment_id"].startswith("khalti_")
+    assert len(calls) == CIRCUIT_FAILURE_THRESHOLD
+    labels = {"name": "payment:khalti:initiate"}
+    assert REGISTRY.get_sample_value("circuit_breaker_rejected_total", labels) >= 1
+    assert REGISTRY.get_sample_value("circuit_breaker_state", labels) == 2
+    health = APIClient().get("/api/health/").json()
+    assert health == {"status": "degraded", "circuits": {"payment:khalti:initiate": "open"}}
+
+    class Initiated:
+        status_code = 200
+
+        def json(self):
+            return {"pidx": "px-probe", "payment_url": "https://pay.khalti.example/px-probe"}
+
+    monkeypatch.setattr(get_session("khalti"), "request", lambda method, url, **kwargs: calls.append(url) or Initiated())
+    breaker = circuit.get_breaker("payment:khalti:initiate")
+    later = breaker.clock() + CIRCUIT_RESET_TIMEOUT_SECONDS + 1
+    monkeypatch.setattr(breaker, "clock", lambda: later)
+    assert breaker.current_state() == circuit.HALF_OPEN
+    assert gateway.create_payment_intent(order)["provider_payment_id"] == "px-probe"
+    assert len(calls) == CIRCUIT_FAILURE_THRESHOLD + 1
+    assert APIClient().get("/api/health/").json()["circuits"] == {"payment:khalti:initiate": "closed"}
+    assert REGISTRY.get_sample_value("circuit_breaker_state", labels) == 0
+    circuit.reset_breakers()
+
+
+@pytest.mark.django_db
+def test_circuit_breaker_fails_open_when_its_state_store_is_down(monkeypatch):
+    from store.services import circuit
+
+    class Down:
+        def __getattr__(self, name):
+            def fail(*args, **kwargs):
+                raise ConnectionError("state store down")
+
+            return fail
+
+    circuit.reset_breakers()
+    monkeypatch.setattr(circuit, "_state", Down())
+    breaker = circuit.get_breaker("supplier:cj:fetch_products")
+    with breaker.guard():
+        pass
+    with pytest.raises(ValueError):
+        with breaker.guard():
+            raise ValueError("provider error")
+
+    resp = APIClient().get("/api/health/")
+    assert resp.status_code == 200
+    assert resp.json() == {"status": "degraded", "circuits": None}
+    circuit.reset_breakers()
+
+
+@pytest.mark.django_db
+def test_form_encoded_webhook_without_provider_query():
+    from urllib.parse import urlencode
+
+    client = APIClient()
+    multipart_order = _pending_order("form-webhook-mp@example.com", "khalti")
+    fields = {"provider": "khalti", "order_id": multipart_order, "token": "khalti_ok_mp", "status": "success"}
+    resp = client.post("/api/payments/webhook/", fields, format="multipart")
+    assert resp.json() == {"ok": True}
+    assert Order.objects.get(id=multipart_order).status == Order.Status.PAID
+
+    urlencoded_order = _pending_order("form-webhook-url@example.com", "khalti")
+    body = urlencode({"provider": "khalti", "order_id": urlencoded_order, "token": "khalti_ok_url", "status": "success"})
+    resp = client.post("/api/payments/webhook/", body, content_type="application/x-www-form-urlencoded")
+    assert resp.json() == {"ok": True}
+    assert Order.objects.get(id=urlencoded_order).status == Order.Status.PAID
@@ -9,3 +9,73 @@ def test_product_serializer_shape():
     data = ProductSerializer(p).data
     assert set(["id","title","slug","description","base_price","sku","images","category","supplier","avg_rating","created_at","updated_at"]).issuperset(data.keys())
 
+
+
+@pytest.mark.django_db
+def test_compiled_serializers_match_drf_output():
+    from decimal import Decimal
+
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from rest_framework.renderers import JSONRenderer
+    from rest_framework.test import APIRequestFactory
+
+    from store.compiled_serializers import compile_serializer
+    from store.models import Coupon, Order, OrderItem, OrderStatusEvent, ProductVariant, ReturnRequest, Review, SizeGuide
+    from store.repositories.product import ProductRepository
+    from store.serializers import OrderSerializer, ProductListSerializer
+    from .factories import create_category, create_product, create_supplier, create_user, ensure_address, ensure_inventory
+
+    shoes = create_category("Shoes")
+    SizeGuide.objects.create(category=shoes, headline="Fit", content="True to size")
+    supplier = create_supplier("Compiled Co")
+    runner = create_product("Runner", "CMP-1", shoes, supplier, price=Decimal("59.50"))
+    runner.images = SimpleUploadedFile("runner.jpg", b"img", content_type="image/jpeg")
+    runner.gallery = ["a.jpg"]
+    runner.save()
+    hat = create_product("Hat", "CMP-2", create_category("Hats"), supplier, price=Decimal("12.00"))
+    ensure_inventory(runner, 4)
+    ProductVariant.objects.create(product=runner, size="42", color="Red", price_modifier=Decimal("1.50"))
+    ProductVariant.objects.create(product=runner, size="43", color="Red", position=1)
+
+    user = create_user("compiled@example.com")
+    address = ensure_address(user)
+    Review.objects.create(user=user, product=runner, rating=4)
+    Review.objects.create(user=create_user("other@example.com"), product=runner, rating=5)
+    coupon = Coupon.objects.create(code="CMP10", discount_type="percent", value=Decimal("10"))
+    order = Order.objects.create(
+        user=user, total_amount=Decimal("71.50"), coupon=coupon, shipping_address=address, billing_address=address
+    )
+    OrderItem.objects.create(order=order, product=runner, unit_price=Decimal("59.50"), quantity=1, variant_info={"size": "42"})
+    item = OrderItem.objects.create(order=order, product=hat, unit_price=Decimal("12.00"), quantity=1)
+    OrderStatusEvent.objects.create(order=order, status=Order.Status.PENDING, note="created")
+    ReturnRequest.objects.create(order=order, order_item=item, reason="Too small")
+    Order.objects.create(user=user, total_amount=Decimal("0.00"), shipping_address=address, billing_address=address)
+
+    request = APIRequestFactory().get("/api/products/")
+    renderer = JSONRenderer()
+    products = ProductRepository.get_active_products_queryset().order_by("-created_at")
+    cases = [
+        (ProductSerializer, {}, products),
+        (ProductListSerializer, {"fields": frozenset({"id", "title", "images", "category", "urgency_copy"})}, products),
+        (OrderSerializer, {}, Order.objects.order_by("-id")),
+    ]
+    for serializer_class, kwargs, queryset in cases:
+        compiled = compile_serializer(serializer_class, **kwargs)
+        assert compiled is not None
+        expected = serializer_class(list(queryset), many=True, context={"request": request}, **kwargs).data
+        assert renderer.render(compiled.serialize(queryset, request=request)) == renderer.render(expected)
+
+
+def test_compiled_plan_cache_is_bounded():
+    from itertools import combinations
+
+    from store.compiled_serializers import COMPILED_CACHE_SIZE, _compile, compile_serializer
+    from store.serializers import ProductListSerializer
+
+    names = ("id", "title", "slug", "images", "category", "base_price", "sku", "urgency_copy", "created_at", "avg_rating")
+    plan = compile_serializer(ProductListSerializer, fields=frozenset({"id", "title"}))
+    assert compile_serializer(ProductListSerializer, fields=frozenset({"title", "id"})) is plan
+    for size in (3, 4, 5):
+        for fields in combinations(names, size):
+            compile_serializer(ProductListSerializer, fields=frozenset(fields))
+    assert _compile.cache_info().currsize <= COMPILED_CACHE_SIZE
@@ -1,8 +1,15 @@
 import pytest
 from decimal import Decimal
 
-from store.models import Supplier, Category, Product, Inventory, Order, OrderItem, Address, User
-from store.tasks import sync_supplier_products, auto_forward_order_to_supplier
+from store.models import Supplier, Category, Product, Inventory, Order, OrderItem, Address, User, ProductCoPurchase, Review
+from store.tasks import (
+    sync_supplier_products,
+    auto_forward_order_to_supplier,
+    rebuild_copurchase_matrix,
+    update_copurchase_matrix_for_order,
+    build_similarity_index,
+    release_expired_reservations,
+)
 
 
 class FakeAdapter:
@@ -60,3 +67,167 @@ def test_auto_forward_order_places_supplier_order():
 
     res = auto_forward_order_to_supplier.apply(args=(o.id,)).get()
     assert "CJ" in res
+
+
+@pytest.mark.django_db
+def test_copurchase_matrix_rebuild_and_incremental_update():
+    cat = Category.objects.create(name="Cat", slug="cat")
+    products = [
+        Product.objects.create(title=f"P{i}", slug=f"p{i}", base_price=Decimal("5.00"), sku=f"CP-{i}", category=cat)
+        for i in range(3)
+    ]
+    u = User.objects.create(email="cp@example.com")
+    addr = Address.objects.create(user=u, label="home", address_line1="1", city="c", state="s", postal_code="0", country="US")
+
+    def place(status, *items):
+        order = Order.objects.create(user=u, status=status, total_amount=Decimal("5.00"), shipping_address=addr, billing_address=addr)
+        for product in items:
+            OrderItem.objects.create(order=order, product=product, unit_price=product.base_price, quantity=1)
+        return order
+
+    place(Order.Status.PAID, products[0], products[1])
+    place(Order.Status.DELIVERED, products[0], products[1], products[2])
+    place(Order.Status.PENDING, products[0], products[2])
+
+    res = rebuild_copurchase_matrix.apply().get()
+    assert res["pairs"] == 6
+    pair = ProductCoPurchase.objects.get(product=products[0], related=products[1])
+    assert pair.count == 2
+    assert ProductCoPurchase.objects.get(product=products[0], related=products[2]).count == 1
+
+    fresh = place(Order.Status.PAID, products[0], products[2])
+    update_copurchase_matrix_for_order.apply(args=(fresh.id,)).get()
+    update_copurchase_matrix_for_order.apply(args=(fresh.id,)).get()
+    assert ProductCoPurchase.objects.get(product=products[2], related=products[0]).count == 2
+
+
+@pytest.mark.django_db
+def test_finalize_payment_updates_copurchase_matrix(monkeypatch, django_capture_on_commit_callbacks):
+    from store.models import Payment, PaymentEvent
+    from store.services.payments import finalize_payment
+
+    monkeypatch.setattr(auto_forward_order_to_supplier, "delay", lambda order_id: None)
+    monkeypatch.setattr(update_copurchase_matrix_for_order, "delay", lambda order_id: update_copurchase_matrix_for_order.apply(args=(order_id,)))
+    cat = Category.objects.create(name="Cat", slug="cat")
+    products = [
+        Product.objects.create(title=f"P{i}", slug=f"fp{i}", base_price=Decimal("5.00"), sku=f"FP-{i}", category=cat)
+        for i in range(2)
+    ]
+    u = User.objects.create(email="fp@example.com")
+    addr = Address.objects.create(user=u, label="home", address_line1="1", city="c", state="s", postal_code="0", country="US")
+    order = Order.objects.create(user=u, total_amount=Decimal("10.00"), shipping_address=addr, billing_address=addr)
+    for product in products:
+        OrderItem.objects.create(order=order, product=product, unit_price=product.base_price, quantity=1)
+    payment = Payment.objects.create(order=order, provider="khalti", amount=order.total_amount)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        assert finalize_payment(order, payment, "khalti", PaymentEvent.Source.VERIFY, {"status": "paid"})
+    assert ProductCoPurchase.objects.get(product=products[0], related=products[1]).count == 1
+    assert ProductCoPurchase.objects.get(product=products[1], related=products[0]).count == 1
+
+
+@pytest.mark.django_db
+def test_similarity_index_build_and_lookup(settings, tmp_path):
+    from rest_framework.test import APIClient
+    from store.services.similarity import get_similarity_index
+
+    settings.RECOMMENDATION_INDEX_DIR = str(tmp_path)
+    cat = Category.objects.create(name="Sim", slug="sim")
+    products = [
+        Product.objects.create(title=f"S{i}", slug=f"s{i}", base_price=Decimal("5.00"), sku=f"SIM-{i}", category=cat)
+        for i in range(4)
+    ]
+    for i in range(3):
+        u = User.objects.create(email=f"sim{i}@example.com")
+        addr = Address.objects.create(user=u, label="home", address_line1="1", city="c", state="s", postal_code="0", country="US")
+        order = Order.objects.create(user=u, status=Order.Status.PAID, total_amount=Decimal("5.00"), shipping_address=addr, billing_address=addr)
+        OrderItem.objects.create(order=order, product=products[0], unit_price=Decimal("5.00"), quantity=1)
+        if i < 2:
+            OrderItem.objects.create(order=order, product=products[1], unit_price=Decimal("5.00"), quantity=1)
+        if i == 2:
+            u.wishlist.items.create(product=products[2])
+    Review.objects.create(product=products[3], user=User.objects.get(email="sim0@example.com"), rating=5)
+
+    res = build_similarity_index.apply().get()
+    assert res["products"] == 4
+
+    index = get_similarity_index()
+    neighbours = index.similar(products[0].id, limit=3)
+    assert neighbours[0] == products[1].id
+    assert set(neighbours) == {products[1].id, products[2].id, products[3].id}
+    assert index.similar(999999, limit=3) == []
+
+    # Rebuilds land in new directories and are published by swapping CURRENT;
+    # only the live build and the one before it are kept.
+    for _ in range(3):
+        build_similarity_index.apply().get()
+    builds = sorted(path.name for path in tmp_path.glob("build-*"))
+    assert len(builds) == 2
+    assert (tmp_path / "CURRENT").read_text() in builds
+    rebuilt = get_similarity_index()
+    assert rebuilt is not index
+    assert rebuilt.similar(products[0].id, limit=3) == neighbours
+
+    resp = APIClient().get(f"/api/products/{products[2].slug}/recommendations/")
+    assert resp.status_code == 200
+    assert resp.json()[0]["slug"] == products[0].slug
+
+
+@pytest.mark.django_db
+def test_release_expired_reservations_cancels_unpaid_orders(monkeypatch):
+    from datetime import timedelta
+
+    from django.utils import timezone
+
+    from store.models import InventoryReservation, OrderStatusEvent
+    from store.services import inventory
+    from store.services.inventory import InsufficientStock, commit_order_reservations, reserve_stock
+
+    cat = Category.objects.create(name="Hold", slug="hold")
+    product = Product.objects.create(title="Held", slug="held", base_price=Decimal("5.00"), sku="HLD-1", category=cat)
+    Inventory.objects.create(product=product, quantity=5)
+    u = User.objects.create(email="hold@example.com")
+    addr = Address.objects.create(user=u, label="home", address_line1="1", city="c", state="s", postal_code="0", country="US")
+
+    def checkout(quantity):
+        order = Order.objects.create(user=u, total_amount=Decimal("5.00"), shipping_address=addr, billing_address=addr)
+        holds = reserve_stock([(product.id, quantity)])
+        InventoryReservation.objects.filter(pk__in=[h.pk for h in holds]).update(order=order)
+        return order
+
+    with pytest.raises(InsufficientStock):
+        reserve_stock([(product.id, 6)])
+    unpaid = checkout(2)
+    paid = checkout(3)
+    assert Inventory.objects.get(product=product).quantity == 0
+    paid.status = Order.Status.PAID
+    paid.save(update_fields=["status"])
+    commit_order_reservations(paid)
+
+    InventoryReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+    res = release_expired_reservations.apply().get()
+    assert res == {"released": 1, "cancelled": 1}
+    assert Inventory.objects.get(product=product).quantity == 2
+    unpaid.refresh_from_db()
+    assert unpaid.status == Order.Status.CANCELLED
+    assert release_expired_reservations.apply().get() == {"released": 0, "cancelled": 0}
+
+    # An order paid between the task reading it and cancelling it keeps its
+    # holds and stays paid.
+    racing = checkout(2)
+    InventoryReservation.objects.filter(order=racing).update(expires_at=timezone.now() - timedelta(seconds=1))
+    real_release = inventory.release_reservations
+
+    def pay_first(reservations):
+        if not Order.objects.filter(pk=racing.pk, payment_status=Order.PaymentStatus.PAID).exists():
+            Order.objects.filter(pk=racing.pk).update(status=Order.Status.PAID, payment_status=Order.PaymentStatus.PAID)
+            commit_order_reservations(racing)
+        return real_release(reservations)
+
+    monkeypatch.setattr(inventory, "release_reservations", pay_first)
+    assert release_expired_reservations.apply().get() == {"released": 0, "cancelled": 0}
+    racing.refresh_from_db()
+    assert (racing.status, racing.payment_status) == (Order.Status.PAID, Order.PaymentStatus.PAID)
+    assert not OrderStatusEvent.objects.filter(order=racing, status=Order.Status.CANCELLED).exists()
+    assert set(racing.reservations.values_list("status", flat=True)) == {InventoryReservation.Status.COMMITTED}
+